@@ -360,21 +360,104 @@ You can also select a custom merging strategy using a ``__`` object in a list:
 |       - tom    |       - __: overwrite   |       - mat             |
 |       - root   |       - mat             |                         |
 +----------------+-------------------------+-------------------------+
+
+Caching
+-------
+
+The salt master compiles the pillar of every minion in the same long running
+worker processes, so PillarStack keeps a process wide cache between calls:
+
+- one jinja2 ``Environment`` and loader per stack directory, so compiled
+  templates are shared by all minions
+- a template is reloaded only when the ``mtime``, inode or size of its file
+  changes
+- templates that neither reference any variable nor include other templates
+  are rendered and parsed once; later minions receive a copy of the parsed
+  ``yaml`` data
+
+Since the environment is shared, ``stack``, ``pillar``, ``minion_id``,
+``__opts__``, ``__grains__`` and ``__salt__`` are passed to the templates as
+render context rather than environment globals.  Templates imported with
+``{% import %}`` or ``{% from ... import %}`` see them as well, also without
+``with context``.  Hit and miss counters of the cache are logged at debug
+level after every call.
+
+Dependency index
+----------------
+
+For every minion, the ordered list of files that were loaded for its pillar
+(config files, stack files and the templates they include) and the list of
+stack files that were looked for but do not exist are stored as
+``<cachedir>/pillar_index/<minion_id>.json``.  The ``pillar_index`` runner uses
+this index to find the minions affected by a change of a file.
+
+Bulk rendering
+--------------
+
+The ``pillarstack.prerender`` runner compiles the pillars of many minions in a
+pool of processes with the ``pillarstack_stage`` option set.  The results are
+stored as ``<cachedir>/pillar_stage/<minion_id>.p`` and served by later calls
+for the same minion for ``pillarstack_stage_ttl`` seconds (600 by default),
+unless the pillar passed to PillarStack, the grains or any of the files in the
+dependency index have changed in the meantime.
 '''
 
 from __future__ import absolute_import
 import os
+import copy
+import hashlib
+import json
 import logging
+import pickle
+import pprint
+import sys
+import threading
+import time
+import types
 from functools import partial
 
 import yaml
-from jinja2 import FileSystemLoader, Environment, TemplateNotFound
+from jinja2 import FileSystemLoader, Environment, Template, TemplateNotFound, meta
+from jinja2.loaders import split_template_path
 import six
 
 
 log = logging.getLogger(__name__)
 strategies = ('overwrite', 'merge-first', 'merge-last', 'remove')
 
+TEMPLATE_CACHE_SIZE = 4096
+# Dependency index of minions on stack files, relative to the master cachedir
+INDEX_DIR = 'pillar_index'
+# Pillar data rendered ahead of time by the pillarstack runner
+STAGE_DIR = 'pillar_stage'
+STAGE_TTL = 600
+
+# Process wide caches, shared by all minions compiled in this process.  The
+# salt loader executes this module again for every pillar compilation, so the
+# caches live in a module of their own that stays in sys.modules.
+_cache = sys.modules.setdefault('deepsea_pillarstack_cache',
+                                types.ModuleType('deepsea_pillarstack_cache'))
+if not hasattr(_cache, 'stats'):
+    _cache.environments = {}
+    _cache.templates = {}
+    _cache.recorded = {}
+    _cache.stats = {
+        'template_hits': 0,
+        'template_misses': 0,
+        'yaml_hits': 0,
+        'yaml_misses': 0,
+        'stage_hits': 0,
+        'stage_misses': 0,
+        }
+if not hasattr(_cache, 'rendering'):
+    # Variables of the stack file being rendered, per thread
+    _cache.rendering = threading.local()
+_rendering = _cache.rendering
+_environments = _cache.environments
+_templates = _cache.templates
+_recorded = _cache.recorded
+_stats = _cache.stats
+
 
 def ext_pillar(minion_id, pillar, *args, **kwargs):
     import salt.utils
@@ -394,37 +477,336 @@ def ext_pillar(minion_id, pillar, *args, **kwargs):
         if not isinstance(cfgs, list):
             cfgs = [cfgs]
         stack_config_files += cfgs
+    inputs = _inputs(stack_config_files, pillar)
+    if not __opts__.get('pillarstack_stage'):
+        staged = _staged(minion_id, inputs)
+        if staged is not None:
+            return staged
+    deps = {'files': [], 'missing': []}
     for cfg in stack_config_files:
         if not os.path.isfile(cfg):
             log.warning('Ignoring pillar stack cfg "{0}": '
                      'file does not exist'.format(cfg))
             continue
-        stack = _process_stack_cfg(cfg, stack, minion_id, pillar)
+        stack = _process_stack_cfg(cfg, stack, minion_id, pillar, deps)
+    _record(minion_id, deps)
+    if __opts__.get('pillarstack_stage'):
+        _stage(minion_id, inputs, deps, stack)
+    log.debug('PillarStack cache: templates {template_hits} hits/'
+              '{template_misses} misses, yaml {yaml_hits} hits/'
+              '{yaml_misses} misses, staged {stage_hits} hits/'
+              '{stage_misses} misses'.format(**_stats))
     return stack
 
 
-def _process_stack_cfg(cfg, stack, minion_id, pillar):
+def cache_stats():
+    '''
+    Return a copy of the hit and miss counters of the process wide cache
+    '''
+    return dict(_stats)
+
+
+def clear_cache():
+    '''
+    Drop all cached environments, templates, parsed yaml data and the record
+    of written index entries
+    '''
+    _environments.clear()
+    _templates.clear()
+    _recorded.clear()
+    for key in _stats:
+        _stats[key] = 0
+
+
+def _signature(filename):
+    '''
+    Return what identifies a version of a file or None if it does not exist
+    '''
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_ino, st.st_size)
+
+
+class _StackLoader(FileSystemLoader):
+    '''
+    FileSystemLoader of a single stack directory which considers a template
+    up to date as long as the mtime, inode and size of its file are unchanged
+    '''
+
+    def __init__(self, basedir):
+        super(_StackLoader, self).__init__(basedir)
+        self.basedir = basedir
+
+    def filename(self, template):
+        '''
+        Return the path of a template or None if it would escape basedir
+        '''
+        try:
+            return os.path.join(self.basedir, *split_template_path(template))
+        except TemplateNotFound:
+            return None
+
+    def get_source(self, environment, template):
+        filename = self.filename(template)
+        signature = _signature(filename) if filename else None
+        source, filename, _ = super(_StackLoader, self).get_source(environment, template)
+        _stats['template_misses'] += 1
+
+        def uptodate():
+            ''' Compare against the file as it was before reading it '''
+            return _signature(filename) == signature
+
+        return source, filename, uptodate
+
+
+class _StackTemplate(Template):
+    '''
+    Template whose module, as seen by an import without context, is built
+    from the variables of the stack file being rendered instead of being
+    cached for the first minion
+    '''
+
+    def _get_default_module(self, *args):
+        return self.make_module(getattr(_rendering, 'context', None))
+
+
+def _environment(basedir):
+    '''
+    Return the shared jinja2 environment of a stack directory.  It holds no
+    minion specific globals; _render makes the variables of a minion visible
+    to the templates it imports.
+    '''
+    if basedir not in _environments:
+        jenv = Environment(loader=_StackLoader(basedir),
+                           cache_size=TEMPLATE_CACHE_SIZE)
+        jenv.template_class = _StackTemplate
+        _environments[basedir] = jenv
+    return _environments[basedir]
+
+
+def _render(template, context):
+    '''
+    Render a template with the variables of a minion, which templates
+    imported without context see as well
+    '''
+    previous = getattr(_rendering, 'context', None)
+    _rendering.context = context
+    try:
+        return template.render(**context)
+    finally:
+        _rendering.context = previous
+
+
+def _get_template(jenv, name):
+    '''
+    Return the compiled template, counting whether the cache was used
+    '''
+    misses = _stats['template_misses']
+    template = jenv.get_template(name)
+    if _stats['template_misses'] == misses:
+        _stats['template_hits'] += 1
+    return template
+
+
+def _template_info(jenv, name):
+    '''
+    Return what is known about the current version of a template or None if
+    it does not exist.  A template is static if it references neither
+    variables nor other templates, so its output is the same for every minion.
+    '''
+    filename = jenv.loader.filename(name)
+    if not filename or not os.path.isfile(filename):
+        return None
+    signature = _signature(filename)
+    key = (jenv.loader.basedir, name)
+    info = _templates.get(key)
+    if info is None or info['signature'] != signature:
+        source = FileSystemLoader.get_source(jenv.loader, jenv, name)[0]
+        ast = jenv.parse(source)
+        referenced = list(meta.find_referenced_templates(ast))
+        info = {
+            'signature': signature,
+            'filename': filename,
+            'includes': [ref for ref in referenced if ref],
+            'static': not (meta.find_undeclared_variables(ast) or referenced),
+            }
+        _templates[key] = info
+    return info
+
+
+def _render_yaml(jenv, path, context):
+    '''
+    Render and parse a stack file.  Static files are parsed once per version
+    and served as copies, since merging modifies the returned data.
+    '''
+    info = _template_info(jenv, path)
+    if info and info['static']:
+        if 'obj' in info:
+            _stats['yaml_hits'] += 1
+        else:
+            _stats['yaml_misses'] += 1
+            info['obj'] = yaml.safe_load(_get_template(jenv, path).render())
+        return copy.deepcopy(info['obj'])
+    return yaml.safe_load(_render(_get_template(jenv, path), context))
+
+
+def _dependencies(jenv, name, seen=None):
+    '''
+    Return the filenames of a template and of the templates it includes,
+    imports or extends, in the order they are referenced
+    '''
+    seen = set() if seen is None else seen
+    if name in seen:
+        return []
+    seen.add(name)
+    info = _template_info(jenv, name)
+    if info is None:
+        return []
+    filenames = [info['filename']]
+    for include in info['includes']:
+        filenames.extend(_dependencies(jenv, include, seen))
+    return filenames
+
+
+def _add_unique(items, values):
+    '''
+    Append values not yet in items, keeping the order
+    '''
+    for value in values:
+        if value not in items:
+            items.append(value)
+
+
+def _record(minion_id, deps):
+    '''
+    Store the files which a minion's pillar depends on in the dependency
+    index.  Every minion has its own file, so concurrent master workers never
+    write the same file; unchanged entries are not rewritten.
+    '''
+    cachedir = __opts__.get('cachedir')
+    if not cachedir:
+        return
+    if _recorded.get(minion_id) == deps:
+        return
+    index_dir = os.path.join(cachedir, INDEX_DIR)
+    filename = os.path.join(index_dir, '{0}.json'.format(minion_id))
+    try:
+        with open(filename, 'r') as index:
+            current = json.load(index)
+    except (IOError, OSError, ValueError):
+        current = None
+    try:
+        if current != deps:
+            if not os.path.isdir(index_dir):
+                os.makedirs(index_dir)
+            tmp = '{0}.{1}'.format(filename, os.getpid())
+            with open(tmp, 'w') as index:
+                json.dump(deps, index)
+            os.rename(tmp, filename)
+        _recorded[minion_id] = deps
+    except (IOError, OSError) as err:
+        log.warning('Cannot update pillar index "{0}": {1}'.format(filename, err))
+
+
+def _inputs(cfgs, pillar):
+    '''
+    Return a digest of what the rendering of a minion depends on besides
+    the stack files
+    '''
+    content = pprint.pformat((cfgs, pillar, dict(__grains__)))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def _stage_filename(minion_id):
+    cachedir = __opts__.get('cachedir')
+    if not cachedir:
+        return None
+    return os.path.join(cachedir, STAGE_DIR, '{0}.p'.format(minion_id))
+
+
+def _stage(minion_id, inputs, deps, stack):
+    '''
+    Store the pillar data of a minion rendered ahead of time along with the
+    versions of the files it was built from
+    '''
+    filename = _stage_filename(minion_id)
+    if not filename:
+        return
+    entry = {
+        'time': time.time(),
+        'inputs': inputs,
+        'files': dict((path, _signature(path)) for path in deps['files']),
+        'missing': deps['missing'],
+        'stack': stack,
+        }
+    try:
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        tmp = '{0}.{1}'.format(filename, os.getpid())
+        with open(tmp, 'wb') as staged:
+            pickle.dump(entry, staged, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, filename)
+    except (IOError, OSError, pickle.PicklingError) as err:
+        log.warning('Cannot stage pillar of "{0}": {1}'.format(minion_id, err))
+
+
+def _staged(minion_id, inputs):
+    '''
+    Return the staged pillar data of a minion if it is recent and none of
+    its inputs or files changed since, otherwise None
+    '''
+    filename = _stage_filename(minion_id)
+    if not filename or not os.path.isfile(filename):
+        return None
+    try:
+        with open(filename, 'rb') as staged:
+            entry = pickle.load(staged)
+    except Exception as err:  # pylint: disable=broad-except
+        log.warning('Cannot read staged pillar "{0}": {1}'.format(filename, err))
+        return None
+    ttl = __opts__.get('pillarstack_stage_ttl', STAGE_TTL)
+    if (entry['time'] + ttl < time.time() or entry['inputs'] != inputs or
+            any(_signature(path) != signature
+                for path, signature in six.iteritems(entry['files'])) or
+            any(os.path.exists(path) for path in entry['missing'])):
+        _stats['stage_misses'] += 1
+        return None
+    _stats['stage_hits'] += 1
+    return entry['stack']
+
+
+def _process_stack_cfg(cfg, stack, minion_id, pillar, deps=None):
     log.debug('Config: {0}'.format(cfg))
     basedir, filename = os.path.split(cfg)
-    jenv = Environment(loader=FileSystemLoader(basedir))
-    jenv.globals.update({
+    jenv = _environment(basedir)
+    if deps is None:
+        deps = {'files': [], 'missing': []}
+    owned = {}
+    context = {
         "__opts__": __opts__,
         "__salt__": __salt__,
         "__grains__": __grains__,
         "minion_id": minion_id,
         "pillar": pillar,
-        })
-    for path in _parse_stack_cfg(jenv.get_template(filename).render(stack=stack)):
+        "stack": stack,
+        }
+    content = _render(_get_template(jenv, filename), context)
+    _add_unique(deps['files'], _dependencies(jenv, filename))
+    for path in _parse_stack_cfg(content):
         try:
             log.debug('YAML: basedir={0}, path={1}'.format(basedir, path))
-            obj = yaml.safe_load(jenv.get_template(path).render(stack=stack))
+            context['stack'] = stack
+            obj = _render_yaml(jenv, path, context)
+            _add_unique(deps['files'], _dependencies(jenv, path))
             log.debug('obj: {0}'.format(obj))
             
             if not isinstance(obj, dict):
                 log.info('Ignoring pillar stack template "{0}": Can\'t parse '
                          'as a valid yaml dictionary'.format(path))
                 continue
-            stack = _merge_dict(stack, obj)
+            stack = _merge_dict(stack, obj, owned)
             log.debug('stack: {0}'.format(stack))
         except TemplateNotFound as e:
             if hasattr(e, 'name') and e.name != path:
@@ -435,72 +817,143 @@ def _process_stack_cfg(cfg, stack, minion_id, pillar):
             else:
                 log.info('Ignoring pillar stack template "{0}": can\'t find from '
                          'root dir "{1}"'.format(path, basedir))
+                if path.strip():
+                    _add_unique(deps['missing'], [os.path.join(basedir, path)])
             continue
     return stack
 
 
 def _cleanup(obj):
-    if obj:
-        if isinstance(obj, dict):
-            obj.pop('__', None)
-            for k, v in six.iteritems(obj):
-                obj[k] = _cleanup(v)
-        elif isinstance(obj, list) and isinstance(obj[0], dict) \
-                and '__' in obj[0]:
-            del obj[0]
+    '''
+    Strip the strategy markers from data adopted into the stack: the ``__``
+    key of every nested dict and a leading ``__`` item of lists found in
+    dicts.  Iterative, and every container is visited once even if the yaml
+    data references it several times.  Unlike the recursive version, which
+    stripped the first item of a list once per yaml alias, a list aliased by
+    anchors only loses its own marker and keeps a following ``__`` dict as
+    data.
+    '''
+    todo = [obj]
+    seen = set()
+    while todo:
+        item = todo.pop()
+        if not item or id(item) in seen:
+            continue
+        seen.add(id(item))
+        if isinstance(item, dict):
+            item.pop('__', None)
+            todo.extend(value for value in item.values()
+                        if isinstance(value, (dict, list)))
+        elif isinstance(item, list) and isinstance(item[0], dict) \
+                and '__' in item[0]:
+            del item[0]
     return obj
 
 
-def _merge_dict(stack, obj):
-    strategy = obj.pop('__', 'merge-last')
+def _check_strategy(strategy):
     if strategy not in strategies:
         raise Exception('Unknown strategy "{0}", should be one of {1}'.format(
             strategy, strategies))
+    return strategy
+
+
+def _merge_dict(stack, obj, owned=None):
+    '''
+    Merge obj into stack.  Nested dicts are merged in place with an explicit
+    stack of pending iterations instead of recursion, visiting keys in the
+    same order as the recursive merge did.  owned keeps the lists created by
+    the merge, which are the only ones safe to extend in place.
+    '''
+    owned = {} if owned is None else owned
+    strategy = _check_strategy(obj.pop('__', 'merge-last'))
     if strategy == 'overwrite':
         return _cleanup(obj)
-    else:
-        for k, v in six.iteritems(obj):
+    pending = [(stack, strategy, six.iteritems(obj))]
+    while pending:
+        target, strategy, items = pending[-1]
+        for k, v in items:
             if strategy == 'remove':
-                stack.pop(k, None)
+                target.pop(k, None)
                 continue
-            if k in stack:
-                if strategy == 'merge-first':
-                    # merge-first is same as merge-last but the other way round
-                    # so let's switch stack[k] and v
-                    stack_k = stack[k]
-                    stack[k] = _cleanup(v)
-                    v = stack_k
-                if type(stack[k]) != type(v):
-                    log.debug('Force overwrite, types differ: '
-                              '\'{0}\' != \'{1}\''.format(stack[k], v))
-                    stack[k] = _cleanup(v)
-                elif isinstance(v, dict):
-                    stack[k] = _merge_dict(stack[k], v)
-                elif isinstance(v, list):
-                    stack[k] = _merge_list(stack[k], v)
+            if k not in target:
+                target[k] = _cleanup(v)
+                continue
+            if strategy == 'merge-first':
+                # merge-first is same as merge-last but the other way round
+                # so let's switch target[k] and v
+                target_k = target[k]
+                target[k] = _cleanup(v)
+                v = target_k
+            if type(target[k]) != type(v):
+                log.debug('Force overwrite, types differ: '
+                          '\'{0}\' != \'{1}\''.format(target[k], v))
+                target[k] = _cleanup(v)
+            elif isinstance(v, dict):
+                nested = _check_strategy(v.pop('__', 'merge-last'))
+                if nested == 'overwrite':
+                    target[k] = _cleanup(v)
                 else:
-                    stack[k] = v
+                    pending.append((target[k], nested, six.iteritems(v)))
+                    break
+            elif isinstance(v, list):
+                target[k] = _merge_list(target[k], v, owned)
             else:
-                stack[k] = _cleanup(v)
-        return stack
+                target[k] = v
+        else:
+            pending.pop()
+    return stack
 
 
-def _merge_list(stack, obj):
+def _remove_items(stack, obj):
+    '''
+    Return the items of stack which are not in obj, looking up hashable items
+    in a set and comparing the others against the unhashable items of obj
+    '''
+    hashable = set()
+    unhashable = []
+    for item in obj:
+        try:
+            hashable.add(item)
+        except TypeError:
+            unhashable.append(item)
+    result = []
+    for item in stack:
+        try:
+            found = item in hashable
+        except TypeError:
+            found = False
+        if not found and unhashable:
+            found = item in unhashable
+        if not found:
+            result.append(item)
+    return result
+
+
+def _merge_list(stack, obj, owned=None):
+    '''
+    Merge obj into stack.  Lists from yaml data may be referenced from several
+    places, so only lists created by an earlier merge and recorded in owned
+    are extended in place.
+    '''
+    owned = {} if owned is None else owned
     strategy = 'merge-last'
     if obj and isinstance(obj[0], dict) and '__' in obj[0]:
         strategy = obj[0]['__']
         del obj[0]
-    if strategy not in strategies:
-        raise Exception('Unknown strategy "{0}", should be one of {1}'.format(
-            strategy, strategies))
+    _check_strategy(strategy)
     if strategy == 'overwrite':
         return obj
     elif strategy == 'remove':
-        return [item for item in stack if item not in obj]
+        result = _remove_items(stack, obj)
     elif strategy == 'merge-first':
-        return obj + stack
+        result = obj + stack
+    elif id(stack) in owned:
+        stack.extend(obj)
+        return stack
     else:
-        return stack + obj
+        result = stack + obj
+    owned[id(result)] = result
+    return result
 
 
 def _parse_stack_cfg(content):
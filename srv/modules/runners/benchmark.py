@@ -6,22 +6,37 @@ from __future__ import absolute_import
 import salt.client
 import salt.config
 
-import ast
+import json
 import logging
 import datetime
 import ipaddress
 import jinja2
 import os
+import sqlite3
 import subprocess
 import sys
+import threading
+import time
 import yaml
+from collections import OrderedDict
+from six.moves import queue
 from six.moves import filter
 from six.moves import zip
 from functools import reduce
 
+import fiolog
+
 log = logging.getLogger(__name__)
 local_client = salt.client.LocalClient()
 
+# Concurrent OSD benches per host and in the whole cluster
+BENCH_PER_HOST = 1
+BENCH_CLUSTER = 16
+
+RESULTS_DB = 'results.db'
+# Percent change reported by compare
+REGRESSION_THRESHOLD = 10
+
 
 class bcolors:
     HEADER = '\033[95m'
@@ -37,7 +52,7 @@ class bcolors:
 class Fio(object):
 
     def __init__(self, client_glob, target, bench_dir, work_dir,
-                 log_dir, job_dir):
+                 log_dir, job_dir, store=None):
         '''
         get a list of the minions ip addresses and pick the one that falls into
         the public_network
@@ -77,6 +92,9 @@ class Fio(object):
         self.work_dir = work_dir
         self.job_dir = job_dir
 
+        self.store = store
+        self.version = None
+
         self.jinja_env = jinja2.Environment(
             loader=jinja2.FileSystemLoader('{}/{}'.format(bench_dir,
                                                           'templates')))
@@ -105,8 +123,33 @@ class Fio(object):
         output = subprocess.check_output(
             [self.cmd] + self.cmd_global_args + log_args + client_jobs)
 
+        self._summarize(job_log_dir)
+
+        if self.store:
+            if self.version is None:
+                self.version = _cluster_version()
+            output_file = '{}/{}.json'.format(job_log_dir, 'output')
+            self.store.add('fio', self.target, job_spec, self.clients,
+                           self.version, output_file,
+                           _fio_metrics(output_file))
+
         return output
 
+    def _summarize(self, job_log_dir):
+        '''
+        write the percentiles and stalls of the bw, iops and latency logs
+        next to the fio output
+        '''
+        try:
+            summary = fiolog.summarize(job_log_dir)
+        except (IOError, OSError) as error:
+            log.error('Summarizing fio logs in {} failed: {}'.format(
+                job_log_dir, error))
+            return None
+        with open('{}/{}.json'.format(job_log_dir, 'summary'), 'w') as out:
+            json.dump(summary, out, indent=2, sort_keys=True)
+        return summary
+
     def _parse_job(self, job_spec, job_name, job_log_dir, client):
         # parse yaml and get job spec
         job = self._get_job_parameters(job_spec, job_log_dir, client)
@@ -143,6 +186,196 @@ class Fio(object):
         return job
 
 
+class ResultStore(object):
+    '''
+    SQLite index of benchmark results.  Every run is keyed by the job, the
+    clients and the cluster version and holds a set of named metrics and
+    descriptive info that is not part of the key.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS runs (
+                                id INTEGER PRIMARY KEY,
+                                time REAL, kind TEXT, target TEXT, job TEXT,
+                                clients TEXT, version TEXT, path TEXT)''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS metrics (
+                                run INTEGER, name TEXT, value REAL)''')
+        self.conn.execute('''CREATE INDEX IF NOT EXISTS metrics_run
+                                ON metrics (run)''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS info (
+                                run INTEGER, name TEXT, value TEXT)''')
+        self.conn.commit()
+
+    def add(self, kind, target, job, clients, version, path, metrics, info=None):
+        '''
+        Record a run and return its id
+        '''
+        with self.conn:
+            cursor = self.conn.execute(
+                '''INSERT INTO runs (time, kind, target, job, clients, version, path)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                (time.time(), kind, target, job, ','.join(sorted(clients)),
+                 version, path))
+            run = cursor.lastrowid
+            self.conn.executemany(
+                'INSERT INTO metrics (run, name, value) VALUES (?, ?, ?)',
+                [(run, name, value) for name, value in metrics.items()])
+            self.conn.executemany(
+                'INSERT INTO info (run, name, value) VALUES (?, ?, ?)',
+                [(run, name, value) for name, value in (info or {}).items()])
+        log.info('Stored {} metrics of {} {} as run {}'.format(
+            len(metrics), target, job, run))
+        return run
+
+    def run(self, run):
+        '''
+        Return a run as a dict, None if unknown
+        '''
+        row = self.conn.execute(
+            '''SELECT id, time, kind, target, job, clients, version, path
+               FROM runs WHERE id = ?''', (run,)).fetchone()
+        if row is None:
+            return None
+        result = dict(zip(['id', 'time', 'kind', 'target', 'job', 'clients',
+                           'version', 'path'], row))
+        result['info'] = dict(self.conn.execute(
+            'SELECT name, value FROM info WHERE run = ?', (run,)))
+        return result
+
+    def latest(self, target=None):
+        '''
+        Return the id of the latest run of every kind, target, job and
+        clients
+        '''
+        query = '''SELECT MAX(id) FROM runs {}
+                   GROUP BY kind, target, job, clients ORDER BY MAX(id)'''
+        if target:
+            rows = self.conn.execute(query.format('WHERE target = ?'), (target,))
+        else:
+            rows = self.conn.execute(query.format(''))
+        return [row[0] for row in rows]
+
+    def previous(self, run, count):
+        '''
+        Return the ids of up to count runs before run of the same kind,
+        target, job and clients
+        '''
+        current = self.run(run)
+        rows = self.conn.execute(
+            '''SELECT id FROM runs WHERE kind = ? AND target = ? AND job = ?
+               AND clients = ? AND id < ? ORDER BY id DESC LIMIT ?''',
+            (current['kind'], current['target'], current['job'],
+             current['clients'], run, count))
+        return [row[0] for row in rows]
+
+    def metrics(self, run):
+        '''
+        Return the metrics of a run
+        '''
+        return dict(self.conn.execute(
+            'SELECT name, value FROM metrics WHERE run = ?', (run,)))
+
+    def compare(self, run, baseline, threshold=REGRESSION_THRESHOLD):
+        '''
+        Compare the metrics of a run with the average of the baseline runs.
+        Return the metrics changed by more than threshold percent for the
+        worse and for the better.
+        '''
+        current = self.metrics(run)
+        reference = {}
+        for other in baseline:
+            for name, value in self.metrics(other).items():
+                reference.setdefault(name, []).append(value)
+        regressions = OrderedDict()
+        improvements = OrderedDict()
+        for name in sorted(current):
+            if name not in reference:
+                continue
+            average = sum(reference[name]) / len(reference[name])
+            if not average:
+                continue
+            change = (current[name] - average) / average * 100
+            if _lower_is_better(name):
+                change = -change
+            entry = {'value': current[name], 'baseline': average,
+                     'change': round(change, 2)}
+            if change <= -threshold:
+                regressions[name] = entry
+            elif change >= threshold:
+                improvements[name] = entry
+        return {'run': self.run(run), 'baseline': baseline,
+                'regressions': regressions, 'improvements': improvements}
+
+
+def _lower_is_better(name):
+    '''
+    Latencies improve when they shrink, bandwidth and iops when they grow
+    '''
+    return '_lat_' in name
+
+
+def _fio_metrics(output_file):
+    '''
+    Return bandwidth, iops and completion latency of the fio json output,
+    summed over all clients
+    '''
+    try:
+        with open(output_file, 'r') as output:
+            result = json.load(output)
+    except (IOError, OSError, ValueError) as err:
+        log.error('Cannot read fio output {}: {}'.format(output_file, err))
+        return {}
+    stats = result.get('client_stats', result.get('jobs', []))
+    summary = [job for job in stats if job.get('jobname') == 'All clients']
+    metrics = {}
+    latencies = {}
+    for job in summary or stats:
+        for direction in ['read', 'write']:
+            data = job.get(direction, {})
+            if not data.get('io_bytes', data.get('io_kbytes')):
+                continue
+            for key in ['bw', 'iops']:
+                name = '{}_{}'.format(direction, key)
+                metrics[name] = metrics.get(name, 0) + data.get(key, 0)
+            clat = data.get('clat_ns', data.get('clat', {}))
+            percentiles = clat.get('percentile', {})
+            latencies.setdefault('{}_lat_mean'.format(direction), []).append(
+                clat.get('mean', 0))
+            if '99.000000' in percentiles:
+                latencies.setdefault('{}_lat_p99'.format(direction), []).append(
+                    percentiles['99.000000'])
+    for name, values in latencies.items():
+        metrics[name] = max(values)
+    return metrics
+
+
+def _cluster_version():
+    '''
+    Return the output of ceph version on the master
+    '''
+    try:
+        output = local_client.cmd('I@roles:master', 'cmd.shell',
+                                  ['ceph version'], tgt_type='compound')
+        return list(output.values())[0].strip()
+    except Exception as err:
+        log.error('Cannot query ceph version: {}'.format(err))
+        return 'unknown'
+
+
+def _store():
+    '''
+    Return the result store in the master cachedir, shared by all benchmarks
+    wherever they keep their logs
+    '''
+    store_dir = '{}/benchmark'.format(
+        salt.config.client_config('/etc/salt/master')['cachedir'])
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+    return ResultStore('{}/{}'.format(store_dir, RESULTS_DB))
+
+
 def __parse_and_set_dirs(kwargs):
     '''
     check kwargs for passed directory locations and return a dict with the
@@ -197,7 +430,14 @@ def help():
 
              salt-run benchmark.baseline work_dir=/path log_dir=/path job_dir=/path default_collection=simple.yml client_glob=target
 
-                 Run Baseline benchmarks
+                 Run Baseline benchmarks, optionally with per_host=1 cluster_max=16
+                 concurrent OSD benches
+
+             salt-run benchmark.compare [run=id] [against=id|rolling=5]
+                 [threshold=10] [target=rbd]
+
+                 Report regressions of the latest, or given, runs against an earlier
+                 run or the average of the previous runs
              """)
     print(usage)
     return ""
@@ -220,7 +460,8 @@ def rbd(**kwargs):
               dir_options['bench_dir'],
               dir_options['work_dir'],
               dir_options['log_dir'],
-              dir_options['job_dir'])
+              dir_options['job_dir'],
+              store=_store())
 
     for job_spec in default_collection['rbd']:
         print(fio.run(job_spec))
@@ -246,7 +487,8 @@ def cephfs(**kwargs):
               dir_options['bench_dir'],
               dir_options['work_dir'],
               dir_options['log_dir'],
-              dir_options['job_dir'])
+              dir_options['job_dir'],
+              store=_store())
 
     for job_spec in default_collection['fs']:
         print(fio.run(job_spec))
@@ -254,43 +496,55 @@ def cephfs(**kwargs):
     return True
 
 
-def baseline(margin=10, verbose=False, **kwargs):
+def baseline(margin=10, verbose=False, per_host=BENCH_PER_HOST,
+             cluster_max=BENCH_CLUSTER, **kwargs):
     '''
     trigger 'ceph tell osd.$n bench' on all $n OSDs and check the results for
     slow outliers
+
+    Benches run concurrently, at most per_host at a time on each host and
+    cluster_max at a time overall.  Deviations are reported against the average
+    of all OSDs, of the OSDs on the same host and of the OSDs of the same
+    device class.
     '''
+    per_host = int(per_host)
+    cluster_max = int(cluster_max)
+    if per_host < 1 or cluster_max < 1:
+        raise Exception('per_host and cluster_max must be at least 1')
+
     client_glob = kwargs.get('client_glob',
                              'I@roles:storage and I@cluster:ceph')
     log.info('client glob is {}'.format(client_glob))
 
     # gotta get the master_minion...not pretty but works
-    master_minion = local_client.cmd(
+    master_minion = list(local_client.cmd(
         'I@roles:master', 'pillar.get',
-        ['master_minion'], tgt_type='compound').items()[0][1]
-
-    # get all osd ids for a given client_glob
-    osd_list = local_client.cmd(master_minion, 'cmd.shell',
-        ['ceph osd ls'])
+        ['master_minion'], tgt_type='compound').items())[0][1]
 
-    if not osd_list:
+    osds = __osds(master_minion)
+    if not osds:
         raise Exception('No OSDs found for glob {}'.format(client_glob))
 
-    ids = osd_list[master_minion].split("\n")
-
-    sys.stdout.write('\nRunning osd benchmarks')
+    sys.stdout.write('\nRunning osd benchmarks\n')
     sys.stdout.flush()
-    results = []
-    for id in ids:
-        sys.stdout.write('.')
-        sys.stdout.flush()
-        output = local_client.cmd(master_minion, 'cmd.shell',
-                                  ['ceph tell osd.{} bench'.format(id)])
-        results.append(output)
-
-    # minion output is a string, so must be parsed; ditch the key
-    parsed_results = [ast.literal_eval(r[master_minion]) for r in results]
-
-    perf_abs = [r['bytes_per_sec'] for r in parsed_results]
+    perf = OrderedDict()
+    failed = []
+    for count, (id, result) in enumerate(
+            __bench_all(master_minion, osds, per_host, cluster_max)):
+        if result is None:
+            failed.append(id)
+            print('[{}/{}] osd.{} on {} failed'.format(
+                count + 1, len(osds), id, osds[id]['host']))
+            continue
+        perf[id] = result['bytes_per_sec']
+        print('[{}/{}] osd.{} on {}: {}/s'.format(
+            count + 1, len(osds), id, osds[id]['host'],
+            __human_size(perf[id])))
+
+    if not perf:
+        raise Exception('No OSD bench succeeded')
+    ids = sorted(perf, key=int)
+    perf_abs = [perf[id] for id in ids]
 
     avg = reduce(lambda r1, r2: r1 + r2, perf_abs)/len(perf_abs)
 
@@ -304,7 +558,135 @@ def baseline(margin=10, verbose=False, **kwargs):
     else:
         __print_outliers(dev_percent, perf_abs, ids, margin)
 
-    return True
+    hosts = __groups(perf, osds, 'host', float(margin))
+    classes = __groups(perf, osds, 'device_class', float(margin))
+    for title, groups in [('host', hosts), ('device class', classes)]:
+        for name, group in groups.items():
+            if group['outliers']:
+                print('{}Outliers on {} {} (average {}/s): {}{}'.format(
+                    bcolors.WARNING, title, name,
+                    __human_size(group['average']),
+                    ', '.join('osd.{}'.format(id) for id in group['outliers']),
+                    bcolors.ENDC))
+
+    metrics = {'bytes_per_sec': avg}
+    metrics.update(('osd.{}_bytes_per_sec'.format(id), value)
+                   for id, value in perf.items())
+    # Key the series on the bench settings, so that adding or removing OSDs
+    # does not start a new one
+    run = _store().add('baseline', 'osd', 'bench',
+                       ['per_host={}'.format(per_host),
+                        'cluster_max={}'.format(cluster_max)],
+                       _cluster_version(), None, metrics,
+                       {'osds': ','.join(osds)})
+
+    return {'run': run,
+            'average': avg,
+            'osds': perf,
+            'failed': failed,
+            'hosts': hosts,
+            'device_classes': classes}
+
+
+def __osds(master_minion):
+    '''
+    Return the host and device class of every OSD from the osd tree
+    '''
+    output = local_client.cmd(master_minion, 'cmd.shell',
+                              ['ceph osd tree -f json'])
+    tree = json.loads(output[master_minion])
+    osds = OrderedDict()
+    for node in tree['nodes']:
+        if node['type'] == 'host':
+            for child in node.get('children', []):
+                osds.setdefault(str(child), {})['host'] = node['name']
+    for node in tree['nodes']:
+        if node['type'] == 'osd':
+            osd = osds.setdefault(str(node['id']), {'host': 'unknown'})
+            osd['device_class'] = node.get('device_class', 'unknown')
+    for osd in tree.get('stray', []):
+        osds.setdefault(str(osd['id']), {'host': 'unknown'}).setdefault(
+            'device_class', osd.get('device_class', 'unknown'))
+    return OrderedDict(sorted(osds.items(), key=lambda item: int(item[0])))
+
+
+def __bench(master_minion, id):
+    '''
+    Return the parsed result of a single OSD bench, None on failure
+    '''
+    # LocalClient is not safe to share between threads
+    client = salt.client.LocalClient()
+    output = client.cmd(master_minion, 'cmd.shell',
+                        ['ceph tell osd.{} bench -f json'.format(id)])
+    try:
+        return json.loads(output[master_minion])
+    except (KeyError, TypeError, ValueError) as err:
+        log.error('osd.{} bench returned {}: {}'.format(id, output, err))
+        return None
+
+
+def __bench_all(master_minion, osds, per_host, cluster_max):
+    '''
+    Bench all OSDs, at most per_host at a time on each host and cluster_max
+    at a time overall.  Yield the id and result of each OSD as it finishes.
+    '''
+    # Interleave hosts, so that the cluster limit is filled evenly
+    by_host = OrderedDict()
+    for id, osd in osds.items():
+        by_host.setdefault(osd['host'], []).append(id)
+    pending = []
+    while any(by_host.values()):
+        for ids in by_host.values():
+            if ids:
+                pending.append(ids.pop(0))
+
+    def run(id):
+        try:
+            results.put((id, __bench(master_minion, id)))
+        except Exception as err:
+            log.error('osd.{} bench failed: {}'.format(id, err))
+            results.put((id, None))
+
+    results = queue.Queue()
+    running = {}
+    active = 0
+    while pending or active:
+        for id in list(pending):
+            if active >= cluster_max:
+                break
+            host = osds[id]['host']
+            if running.get(host, 0) < per_host:
+                pending.remove(id)
+                running[host] = running.get(host, 0) + 1
+                active += 1
+                thread = threading.Thread(target=run, args=(id,))
+                thread.daemon = True
+                thread.start()
+        id, result = results.get()
+        running[osds[id]['host']] -= 1
+        active -= 1
+        yield id, result
+
+
+def __groups(perf, osds, key, margin):
+    '''
+    Return the average of each group of OSDs and the OSDs deviating more
+    than margin percent from it
+    '''
+    members = OrderedDict()
+    for id in sorted(perf, key=int):
+        members.setdefault(osds[id].get(key, 'unknown'), []).append(id)
+    groups = OrderedDict()
+    for name, ids in members.items():
+        average = sum(perf[id] for id in ids) / float(len(ids))
+        deviation = OrderedDict(
+            (id, (perf[id] - average) / (average * 0.01) if average else 0.0)
+            for id in ids)
+        groups[name] = {'average': average,
+                        'deviation': deviation,
+                        'outliers': [id for id, dev in deviation.items()
+                                     if abs(dev) >= margin]}
+    return groups
 
 
 def blockdev(**kwargs):
@@ -325,7 +707,8 @@ def blockdev(**kwargs):
               dir_options['bench_dir'],
               None,
               dir_options['log_dir'],
-              dir_options['job_dir'])
+              dir_options['job_dir'],
+              store=_store())
 
     for job_spec in default_collection['blockdev']:
         print(fio.run(job_spec))
@@ -351,7 +734,8 @@ def fs(**kwargs):
               dir_options['bench_dir'],
               dir_options['work_dir'],
               dir_options['log_dir'],
-              dir_options['job_dir'])
+              dir_options['job_dir'],
+              store=_store())
 
     for job_spec in default_collection['fs']:
         print(fio.run(job_spec))
@@ -359,6 +743,40 @@ def fs(**kwargs):
     return True
 
 
+def compare(run=None, against=None, rolling=1,
+            threshold=REGRESSION_THRESHOLD, target=None, **kwargs):
+    """
+    Report metrics that changed by more than threshold percent.  Compare
+    run with the run against, or with the average of the rolling previous
+    runs of the same job and clients.  Without run, compare the latest run
+    of every job, optionally only of target.
+    """
+    store = _store()
+    if run:
+        runs = [int(run)]
+    else:
+        runs = store.latest(target)
+    results = []
+    for current in runs:
+        if store.run(current) is None:
+            raise Exception('No benchmark run {}'.format(current))
+        if against:
+            baseline = [int(against)]
+        else:
+            baseline = store.previous(current, int(rolling))
+        if not baseline:
+            log.info('No earlier run to compare run {} with'.format(current))
+            continue
+        result = store.compare(current, baseline, float(threshold))
+        for name, entry in result['regressions'].items():
+            print('{}{} {} {}: {:.1f} -> {:.1f} ({:+.1f}%){}'.format(
+                bcolors.FAIL, result['run']['target'], result['run']['job'],
+                name, entry['baseline'], entry['value'], entry['change'],
+                bcolors.ENDC))
+        results.append(result)
+    return results
+
+
 def __print_verbose(dev_percent, perf_abs, ids, margin):
     for d, pa, id in sorted(zip(dev_percent, perf_abs, ids), reverse=True,
             key = lambda t: t[1]):
@@ -29,6 +29,10 @@ def help_():
     usage = ("""salt-run cephprocesses.check
                    Checks the process status according to assigned role.
 
+                salt-run cephprocesses.check stream=True
+                   Checks the process status and reports each minion as it
+                   answers.
+
                 salt-run cephprocesses.mon
                    Query monitors to determine if Ceph cluster is active.
 
@@ -40,17 +44,18 @@ def help_():
 
 
 # pylint: disable=dangerous-default-value
-def check(cluster='ceph', roles=[], tolerate_down=0, quiet=False):
+def check(cluster='ceph', roles=[], tolerate_down=0, quiet=False, stream=False):
     """
     Query the status of running processes for each role.  Also, verify that
-    all minions assigned roles do respond.  Return False if any fail.
+    all minions assigned roles do respond.  Return False if any fail.  With
+    stream, print the status of each minion as it answers.
     """
     search = "I@cluster:{}".format(cluster)
 
     if not roles:
         roles = _cached_roles(search)
 
-    status = _status(search, roles, quiet)
+    status = _status(search, roles, quiet, stream)
 
     log.debug("roles: {}".format(pprint.pformat(roles)))
     log.debug("status: {}".format(pprint.pformat(status)))
@@ -150,36 +155,74 @@ def need_restart(role=None, cluster='ceph'):
     return False
 
 
-def _status(search, roles, quiet):
+def _status(search, roles, quiet, stream=False):
     """
-    Return a structure of roles with module results
+    Return a structure of roles with module results.  Minions holding the
+    same roles in the master pillar are checked with a single call, the
+    results are regrouped by role.
     """
+    status = dict((role, {}) for role in roles)
+    if not roles:
+        return status
+
+    # Ask each minion for its roles only, so that every requested role is
+    # checked regardless of the pillar data the minion has in memory
+    groups = {}
+    for minion, minion_roles in sorted(_minion_roles(search).items()):
+        wanted = tuple(role for role in roles if role in minion_roles)
+        if wanted:
+            groups.setdefault(wanted, []).append(minion)
+
     # When search matches no minions, salt prints to stdout.  Suppress stdout.
     _stdout = sys.stdout
     sys.stdout = open(os.devnull, 'w')
 
-    status = {}
     local = salt.client.LocalClient()
-
-    for role in roles:
-        role_search = search + " and I@roles:{}".format(role)
-        status[role] = local.cmd(role_search,
-                                 'cephprocesses.check',
-                                 kwarg={'roles': [role]},
-                                 quiet=quiet,
-                                 tgt_type="compound")
+    for wanted, minions in groups.items():
+        target = "{} and L@{}".format(search, ",".join(minions))
+        if stream:
+            for minion_ret in local.cmd_iter(target,
+                                             'cephprocesses.check_roles',
+                                             kwarg={'roles': list(wanted)},
+                                             quiet=quiet,
+                                             tgt_type="compound"):
+                for minion, ret in minion_ret.items():
+                    _regroup(status, minion, ret.get('ret'))
+                    if isinstance(ret.get('ret'), dict):
+                        for role, running in sorted(ret['ret'].items()):
+                            print("{}: {} {}".format(minion, role, "up" if running else "down"),
+                                  file=_stdout)
+        else:
+            results = local.cmd(target,
+                                'cephprocesses.check_roles',
+                                kwarg={'roles': list(wanted)},
+                                quiet=quiet,
+                                tgt_type="compound")
+            for minion, ret in results.items():
+                _regroup(status, minion, ret)
 
     sys.stdout = _stdout
     log.debug(pprint.pformat(status))
     return status
 
 
-def _cached_roles(search):
+def _regroup(status, minion, ret):
     """
-    Return the cached roles in a convenient structure.  Trust the cached
-    values from the master pillar since a downed minion will be absent
-    from any dynamic query.  Also, do not worry about downed minions that
-    are outside of the search criteria.
+    Add the results of a minion by role to the status
+    """
+    if isinstance(ret, dict):
+        for role, running in ret.items():
+            status.setdefault(role, {})[minion] = running
+    else:
+        log.error("cephprocesses.check_roles on {} returned {}".format(minion, ret))
+
+
+def _minion_roles(search):
+    """
+    Return the roles of each minion from the cached master pillar.  Trust
+    the cached values since a downed minion will be absent from any dynamic
+    query.  Also, do not worry about downed minions that are outside of the
+    search criteria.
     """
     pillar_util = salt.utils.master.MasterPillarUtil(search, "compound",
                                                      use_cached_grains=True,
@@ -187,11 +230,18 @@ def _cached_roles(search):
                                                      opts=__opts__)
 
     cached = pillar_util.get_minion_pillar()
+    return dict((minion, cached[minion]['roles'])
+                for minion in cached if 'roles' in cached[minion])
+
+
+def _cached_roles(search):
+    """
+    Return the cached roles in a convenient structure.
+    """
     roles = {}
-    for minion in cached:
-        if 'roles' in cached[minion]:
-            for role in cached[minion]['roles']:
-                roles.setdefault(role, []).append(minion)
+    for minion, minion_roles in _minion_roles(search).items():
+        for role in minion_roles:
+            roles.setdefault(role, []).append(minion)
 
     log.debug(pprint.pformat(roles))
     return list(roles.keys())
@@ -4,20 +4,29 @@
 """
 This runner is here to detect config changes in the
 various configuration files to control service restarts.
+
+The digest of every file is kept in a manifest together with the size,
+mtime and inode of the file.  A file is only read again when one of them
+changed.
 """
 
 from __future__ import absolute_import
 from __future__ import print_function
+import os
 import os.path
 import hashlib
+import json
 import logging
 import glob
+import time
 # pylint: disable=import-error,3rd-party-module-not-gated
 import salt.client
 
 __opts__ = salt.config.client_config('/etc/salt/master')
 log = logging.getLogger(__name__)
 
+MANIFEST = '.manifest'
+
 
 class UnknownRole(Exception):
     """
@@ -34,12 +43,13 @@ class Role(object):
 
     def __init__(self, **kwargs):
         self._role_name = kwargs.get('role_name')
+        configurations = kwargs.get('rgw_configurations')
         self.conf_dir = kwargs.get('conf_dir', '/srv/salt/ceph/configuration/files/ceph.conf.d/')
         self.conf_filename = kwargs.get('conf_filename', self._role_name)
         self.conf_extension = kwargs.get('conf_extension', '.conf')
         self._conf_files = glob.glob(self.conf_dir + self.conf_filename + self.conf_extension)
         self._depends = [self]
-        self.rgw_configurations()
+        self.rgw_configurations(configurations)
 
     @property
     def name(self):
@@ -94,27 +104,99 @@ class Role(object):
         """
         return [dep.name for dep in self.dependencies]
 
-    def rgw_configurations(self):
+    def rgw_configurations(self, roles=None):
         """
         RadosGW allows custom configurations.  Include these roles with a
         dependency on the global.conf.  Default to 'rgw' if not set.
         """
-        # pylint: disable=redefined-outer-name
-        local = salt.client.LocalClient()
-        roles = []
-        try:
-            roles = list(local.cmd("I@roles:master", 'pillar.get',
-                                   ['rgw_configurations'],
-                                   tgt_type="compound").values())[0]
-            log.debug("Querying pillar for rgw_configurations")
-        # pylint: disable=bare-except
-        except:
-            pass
-        if not roles:
-            roles = ['rgw']
+        if roles is None:
+            roles = _rgw_configurations()
         for role in roles:
             if role == self.name:
-                self.add_dependencies(Role(role_name='global'))
+                self.add_dependencies(Role(role_name='global',
+                                           rgw_configurations=roles))
+
+
+def _rgw_configurations():
+    """
+    Return the RadosGW configurations of the pillar
+    """
+    # pylint: disable=redefined-outer-name
+    local = salt.client.LocalClient()
+    roles = []
+    try:
+        roles = list(local.cmd("I@roles:master", 'pillar.get',
+                               ['rgw_configurations'],
+                               tgt_type="compound").values())[0]
+        log.debug("Querying pillar for rgw_configurations")
+    # pylint: disable=bare-except
+    except:
+        pass
+    if not roles:
+        roles = ['rgw']
+    return roles
+
+
+class Manifest(object):
+    """
+    Digests of files keyed by path, valid while the size, mtime and inode
+    of the file are unchanged
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = None
+        self.dirty = False
+
+    def _load(self):
+        """
+        Read the manifest once
+        """
+        if self.entries is None:
+            self.entries = {}
+            try:
+                with open(self.filename, 'r') as _fd:
+                    self.entries = json.load(_fd)
+            except (IOError, OSError, ValueError):
+                log.debug("No usable manifest {}".format(self.filename))
+
+    def digest(self, filename):
+        """
+        Return the md5 of a file, reading it only if it changed
+        """
+        self._load()
+        try:
+            stat = os.stat(filename)
+            signature = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        except OSError:
+            signature = None
+        entry = self.entries.get(filename)
+        if signature and entry and entry[:3] == signature:
+            log.debug("Unchanged {}".format(filename))
+            return entry[3]
+        log.debug("Generating checksum for {}".format(filename))
+        md5 = hashlib.md5(open(filename, 'rb').read()).hexdigest()
+        # A file written within the resolution of its mtime may change
+        # again without a new mtime, so do not trust the signature yet
+        if signature and signature[1] < (time.time() - 2) * 1e9:
+            self.entries[filename] = signature + [md5]
+            self.dirty = True
+        return md5
+
+    def save(self):
+        """
+        Write the manifest if entries were added
+        """
+        if not self.dirty:
+            return
+        tmp = "{}.tmp".format(self.filename)
+        try:
+            with open(tmp, 'w') as _fd:
+                json.dump(self.entries, _fd)
+            os.rename(tmp, self.filename)
+            self.dirty = False
+        except (IOError, OSError) as err:
+            log.warning("Cannot write manifest {}: {}".format(self.filename, err))
 
 
 class Config(object):
@@ -130,6 +212,7 @@ class Config(object):
         self.base_dir = '/srv/salt/ceph/configuration/files/'
         self.checksum_dir = self.base_dir + 'ceph.conf.checksum/'
         self.checksum_file = self.checksum_dir + self.role.conf_filename + self.role.conf_extension
+        self.manifest = kwargs.get('manifest') or Manifest(self.checksum_dir + MANIFEST)
         log.debug("dependencies of role {}: {}".format(self.role.name,
                                                        self.role.dependencies_unwrapped()))
 
@@ -142,10 +225,10 @@ class Config(object):
         checksums = ''
         for _file in self.role.conf_files:
             if os.path.exists(_file):
-                log.debug("Generating checksum for {}".format(_file))
-                md5 = hashlib.md5(open(_file, 'rb').read()).hexdigest()
+                md5 = self.manifest.digest(_file)
                 log.debug("Checksum: {}".format(md5))
                 checksums += md5
+        self.manifest.save()
         if checksums:
             return hashlib.md5(checksums.encode('ascii')).hexdigest()
         log.debug(("No file found to generate a checksum from. Looked for "
@@ -210,6 +293,10 @@ def help_():
              'salt-run changed.global:\n'
              'salt-run changed.client:\n\n'
              '    Shortcuts for many roles\n'
+             '\n\n'
+             'salt-run changed.all:\n\n'
+             '    Checks all roles of the deploy stage and returns whether\n'
+             '    each changed\n'
              '\n\n')
     print(usage)
     return ""
@@ -230,7 +317,7 @@ def requires_conf_change(**kwargs):
     if role not in cfg.role.dependencies:
         return "Role {} not defined".format(role.name)
     for deps in cfg.role.dependencies:
-        if Config(role=deps).has_change():
+        if Config(role=deps, manifest=cfg.manifest).has_change():
             search = 'I@cluster:{} and I@roles:{}'.format(cluster, role.name)
             local.cmd(search, 'grains.setval',
                       ["restart_{}".format(role.name), True],
@@ -299,6 +386,29 @@ def igw():
                                           conf_extension=".cfg"))
 
 
+def all_(**kwargs):
+    """
+    Returns for each role of the deploy stage whether its configuration
+    changed, in the order the deploy stage checks them.  Files shared by
+    several roles are read once.
+    """
+    configurations = _rgw_configurations()
+    roles = [Role(role_name='mon', rgw_configurations=configurations),
+             Role(role_name='storage', conf_filename='osd',
+                  rgw_configurations=configurations),
+             Role(role_name='mgr', rgw_configurations=configurations)]
+    roles.extend(Role(role_name=configuration, rgw_configurations=configurations)
+                 for configuration in configurations)
+    roles.extend([Role(role_name='client', rgw_configurations=configurations),
+                  Role(role_name='global', rgw_configurations=configurations),
+                  Role(role_name='mds', rgw_configurations=configurations)])
+    manifest = Config(role=roles[0]).manifest
+    ret = {}
+    for role in roles:
+        ret[role.name] = requires_conf_change(role=role, manifest=manifest, **kwargs)
+    return ret
+
+
 def config(**kwargs):
     """
     Returns whether the configuration of the specified role changed
@@ -307,6 +417,7 @@ def config(**kwargs):
 
 
 __func_alias__ = {
+                  'all_': 'all',
                   'global_': 'global',
                   'help_': 'help'
                  }
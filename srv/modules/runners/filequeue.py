@@ -10,14 +10,36 @@ logic is moving the problem.
 
 This runner will rely on file existence, creation and removal.  If a system
 is loaded, operations will block but eventually complete.
+
+With backend=journal, a queue is kept in an append-only journal in the queue
+directory instead of one file per item.  Items keep the order in which they
+were added, even when added within the same clock tick, and checking, adding
+or removing an item does not list the directory.  Many items can be added or
+removed with a single write.  The backend must be the same for every caller
+of a queue.
+
+Rather than polling, a consumer can block in wait until a queue is empty or
+holds an item.  On Linux, wait sleeps on inotify events of the queue
+directory.  With coalesce set to a number of seconds, the events of a queue
+are collected and fired as a single batch event per window.  Events are only
+coalesced within one process, such as the master running an orchestration;
+separate salt-run calls each fire their own batch.
 """
 
 from __future__ import absolute_import
 from __future__ import print_function
+import atexit
 import time
 import logging
 import os
 import glob
+import itertools
+import json
+import select
+import threading
+import ctypes
+import ctypes.util
+from collections import OrderedDict
 
 import salt.loader
 import salt.utils.event
@@ -25,6 +47,22 @@ import salt.ext.six as six
 
 log = logging.getLogger(__name__)
 
+JOURNAL = ".journal"
+# Rewrite the journal when it holds this many lines and mostly removed items
+COMPACT_LINES = 1000
+WAIT_TIMEOUT = 3600
+# Used where inotify is not available
+POLL_INTERVAL = 1
+
+# inotify(7)
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+
 
 class FileQueue(object):
     """
@@ -66,22 +104,68 @@ class FileQueue(object):
         dirs = [os.path.basename(d) for d in dirs]
         return dirs
 
+    def _filename(self, item):
+        """
+        Return the file of an item
+        """
+        return "{}/{}".format(self.queue_dir, item)
+
+    def _exists(self, item):
+        """
+        Return whether the item is queued
+        """
+        return os.path.isfile(self._filename(item))
+
+    def _add(self, items):
+        """
+        Create or update the files of the items.  Return whether each was
+        present.
+        """
+        present = []
+        for item in items:
+            filename = self._filename(item)
+            present.append(os.path.isfile(filename))
+            with open(filename, "w") as entry:
+                log.info("creating {}".format(filename))
+                entry.write("")
+        return present
+
+    def _delete(self, items):
+        """
+        Remove the files of the items.  Return whether each was present.
+        """
+        present = []
+        for item in items:
+            filename = self._filename(item)
+            if os.path.isfile(filename):
+                log.debug("removing {}".format(filename))
+                os.remove(filename)
+                present.append(True)
+            else:
+                present.append(False)
+        return present
+
     def touch(self, item):
         """
         Create or update filename.  Return based on duplicate_fail.
         """
-        filename = "{}/{}".format(self.queue_dir, item)
-        ret = os.path.isfile(filename)
-        with open(filename, "w") as entry:
-            log.info("creating {}".format(filename))
-            entry.write("")
+        return self.touch_many([item])[item]
 
-        if (ret and 'duplicate_fail' in self.settings and
-            self.settings['duplicate_fail']):
-            self._fire_event(False, [item, "present"])
-            return False
-        self._fire_event(True, [item, "added"])
-        return True
+    def touch_many(self, items):
+        """
+        Add several items in one operation.  Return the result of each as
+        touch would.
+        """
+        ret = {}
+        for item, present in zip(items, self._add(items)):
+            if (present and 'duplicate_fail' in self.settings and
+                self.settings['duplicate_fail']):
+                self._fire_event(False, [item, "present"])
+                ret[item] = False
+            else:
+                self._fire_event(True, [item, "added"])
+                ret[item] = True
+        return ret
 
     # pylint: disable=invalid-name
     def ls(self):
@@ -96,11 +180,25 @@ class FileQueue(object):
         """
         List filenames in modification time order
         """
-        mtime = {}
+        mtime = []
         for filename in os.listdir(self.queue_dir):
-            mtime[os.stat("{}/{}".format(self.queue_dir, filename)).st_mtime] = filename
-        files = [mtime[k] for k in sorted(mtime.keys())]
-        return files
+            if filename.startswith('.'):
+                continue
+            stat = os.stat("{}/{}".format(self.queue_dir, filename))
+            mtime.append((stat.st_mtime_ns, filename))
+        return [filename for _, filename in sorted(mtime)]
+
+    def oldest(self, count=1):
+        """
+        List the count oldest items
+        """
+        return self.items()[:count]
+
+    def newest(self):
+        """
+        Return the newest item
+        """
+        return self.items()[-1]
 
     def empty(self):
         """
@@ -120,14 +218,21 @@ class FileQueue(object):
         """
         Remove file
         """
-        filename = "{}/{}".format(self.queue_dir, item)
-        if os.path.isfile(filename):
-            log.debug("removing {}".format(filename))
-            os.remove(filename)
-            self._fire_event(True, [item, "remove"])
-            return True
-        self._fire_event(False, [item, "absent"])
-        return False
+        return self.remove_many([item])[item]
+
+    def remove_many(self, items):
+        """
+        Remove several items in one operation.  Return the result of each as
+        remove would.
+        """
+        ret = {}
+        for item, present in zip(items, self._delete(items)):
+            if present:
+                self._fire_event(True, [item, "remove"])
+            else:
+                self._fire_event(False, [item, "absent"])
+            ret[item] = present
+        return ret
 
     def vacate(self, item):
         """
@@ -138,11 +243,9 @@ class FileQueue(object):
         """
         files = self.ls()
         log.debug("queue {} contains {}".format(self.queue_dir, files))
-        filename = "{}/{}".format(self.queue_dir, item)
+        filename = self._filename(item)
 
-        if os.path.isfile(filename):
-            log.debug("deleting {}".format(filename))
-            os.remove(filename)
+        self._delete([item])
 
         if len(files) == 1:
             if files[0] == item:
@@ -161,8 +264,8 @@ class FileQueue(object):
         """
         Return whether the file exists
         """
-        filename = "{}/{}".format(self.queue_dir, item)
-        ret = os.path.isfile(filename)
+        filename = self._filename(item)
+        ret = self._exists(item)
         if ret:
             log.info("file {} exists".format(filename))
             self._fire_event(True, [item, "exists"])
@@ -188,9 +291,304 @@ class FileQueue(object):
 
         if ('fire_on' not in settings or
             'fire_on' in settings and settings['fire_on'] == result):
+            if settings.get('coalesce'):
+                _events.add(settings, float(settings['coalesce']),
+                            {'tag': "/".join(tags), 'result': result})
+                return
             event = salt.utils.event.SaltEvent('master', __opts__['sock_dir'])
             event.fire_event(settings, "/".join(tags))
 
+    def _satisfied(self, until, item):
+        """
+        Return whether the queue is empty, holds the item or, without an
+        item, holds anything
+        """
+        if until == 'empty':
+            return not self.ls()
+        if item is not None:
+            return self._exists(item)
+        return bool(self.ls())
+
+    def wait(self, until='empty', item=None, timeout=WAIT_TIMEOUT):
+        """
+        Block until the condition is met or timeout seconds passed.  Return
+        whether the condition is met.
+        """
+        if until not in ['empty', 'item']:
+            raise ValueError("until must be empty or item, not {}".format(until))
+        deadline = time.time() + float(timeout)
+        # Watch before checking, so that no change is missed
+        watch = _watch(self.queue_dir)
+        try:
+            while not self._satisfied(until, item):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    log.info("queue {} timed out waiting for {}".format(self.queue_dir, until))
+                    return False
+                if watch:
+                    watch.wait(remaining)
+                else:
+                    time.sleep(min(POLL_INTERVAL, remaining))
+        finally:
+            if watch:
+                watch.close()
+        log.info("queue {} satisfied {}".format(self.queue_dir, until))
+        return True
+
+
+class _Watch(object):
+    """
+    inotify watch of a directory through libc
+    """
+
+    def __init__(self, libc, path):
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+                IN_MOVED_TO | IN_CREATE | IN_DELETE)
+        if libc.inotify_add_watch(self.fd, path.encode('utf-8'), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch {} failed".format(path))
+
+    def wait(self, timeout):
+        """
+        Sleep until the directory changes or timeout seconds passed
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            # Drain all pending events, one change is enough
+            os.read(self.fd, 65536)
+
+    def close(self):
+        """
+        Remove the watch
+        """
+        os.close(self.fd)
+
+
+def _watch(path):
+    """
+    Return an inotify watch of path, None where inotify is unavailable
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        return _Watch(libc, path)
+    except (OSError, AttributeError) as err:
+        log.debug("inotify unavailable, polling {}: {}".format(path, err))
+        return None
+
+
+class _EventBuffer(object):
+    """
+    Collect the events of a queue and fire them as one event after a time
+    window.  The window starts with the first event.  The buffer lives in the
+    process, so only events fired by the same process are coalesced.  Pending
+    events are fired when the process exits.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def add(self, settings, window, event):
+        """
+        Queue an event, starting the window if needed
+        """
+        tag = settings['event']
+        with self.lock:
+            if tag not in self.pending:
+                self.pending[tag] = (settings, __opts__['sock_dir'], [])
+                timer = threading.Timer(window, self.flush, [tag])
+                timer.daemon = True
+                timer.start()
+            self.pending[tag][2].append(event)
+
+    def flush(self, tag):
+        """
+        Fire the collected events of a queue as a single event
+        """
+        with self.lock:
+            if tag not in self.pending:
+                return
+            settings, sock_dir, events = self.pending.pop(tag)
+        data = dict(settings)
+        data['events'] = events
+        log.info("firing {} events as {}/batch".format(len(events), tag))
+        event = salt.utils.event.SaltEvent('master', sock_dir)
+        event.fire_event(data, "{}/batch".format(tag))
+
+    def flush_all(self):
+        """
+        Fire the collected events of every queue
+        """
+        with self.lock:
+            tags = list(self.pending)
+        for tag in tags:
+            self.flush(tag)
+
+
+_events = _EventBuffer()
+atexit.register(_events.flush_all)
+
+
+class JournalQueue(FileQueue):
+    """
+    Keep the queue in an append-only journal.  Each line adds or removes an
+    item and replaying the lines gives the items in the order they were last
+    added.  The replayed state is kept per process and only lines appended
+    since the last operation are read.
+    """
+
+    _replayed = {}
+
+    def __init__(self, **kwargs):
+        """
+        Locate the journal in the queue directory
+        """
+        super(JournalQueue, self).__init__(**kwargs)
+        self.journal = "{}/{}".format(self.queue_dir, JOURNAL)
+
+    def _entries(self):
+        """
+        Return the queued items, reading new lines of the journal
+        """
+        try:
+            stat = os.stat(self.journal)
+        except OSError:
+            self._replayed[self.journal] = (None, 0, 0, OrderedDict())
+            return self._replayed[self.journal][3]
+        inode, offset, lines, entries = self._replayed.get(
+            self.journal, (None, 0, 0, None))
+        if entries is None or inode != stat.st_ino or stat.st_size < offset:
+            # New or rewritten journal
+            offset, lines, entries = 0, 0, OrderedDict()
+        if stat.st_size > offset:
+            with open(self.journal, "rb") as journal:
+                journal.seek(offset)
+                for line in journal:
+                    if not line.endswith(b"\n"):
+                        # Incomplete write, read it next time
+                        break
+                    offset += len(line)
+                    lines += 1
+                    operation, item = json.loads(line.decode('utf-8'))
+                    entries.pop(item, None)
+                    if operation == '+':
+                        entries[item] = None
+        self._replayed[self.journal] = (stat.st_ino, offset, lines, entries)
+        return entries
+
+    def _append(self, operation, items):
+        """
+        Write a line per item with a single write and apply it
+        """
+        entries = self._entries()
+        inode, offset, lines, _ = self._replayed[self.journal]
+        data = "".join(json.dumps([operation, item]) + "\n" for item in items)
+        data = data.encode('utf-8')
+        with open(self.journal, "ab") as journal:
+            journal.write(data)
+        if inode is None:
+            inode = os.stat(self.journal).st_ino
+        for item in items:
+            entries.pop(item, None)
+            if operation == '+':
+                entries[item] = None
+        self._replayed[self.journal] = (inode, offset + len(data),
+                                        lines + len(items), entries)
+
+    def _compact(self):
+        """
+        Rewrite the journal with the queued items only
+        """
+        entries = self._entries()
+        lines = self._replayed[self.journal][2]
+        if lines < COMPACT_LINES or lines < 2 * len(entries):
+            return
+        log.debug("compacting {}".format(self.journal))
+        data = "".join(json.dumps(['+', item]) + "\n" for item in entries)
+        data = data.encode('utf-8')
+        tmp = "{}.tmp".format(self.journal)
+        with open(tmp, "wb") as journal:
+            journal.write(data)
+        os.rename(tmp, self.journal)
+        self._replayed[self.journal] = (os.stat(self.journal).st_ino, len(data),
+                                        len(entries), entries)
+
+    def _exists(self, item):
+        """
+        Return whether the item is queued
+        """
+        return item in self._entries()
+
+    def _add(self, items):
+        """
+        Append the items.  Return whether each was present.
+        """
+        entries = self._entries()
+        present = []
+        added = set()
+        for item in items:
+            present.append(item in entries or item in added)
+            added.add(item)
+        self._append('+', items)
+        return present
+
+    def _delete(self, items):
+        """
+        Append the removal of the queued items.  Return whether each was
+        present.
+        """
+        entries = self._entries()
+        present = []
+        removed = OrderedDict()
+        for item in items:
+            present.append(item in entries and item not in removed)
+            if present[-1]:
+                removed[item] = None
+        if removed:
+            self._append('-', list(removed))
+            self._compact()
+        return present
+
+    # pylint: disable=invalid-name
+    def ls(self):
+        """
+        List items in alpha-numeric order
+        """
+        return sorted(self._entries())
+
+    def items(self):
+        """
+        List items in the order they were added
+        """
+        return list(self._entries())
+
+    def oldest(self, count=1):
+        """
+        List the count oldest items without copying the others
+        """
+        return list(itertools.islice(self._entries(), count))
+
+    def newest(self):
+        """
+        Return the newest item
+        """
+        entries = self._entries()
+        if not entries:
+            raise IndexError("queue {} is empty".format(self.queue_dir))
+        return next(reversed(entries))
+
+
+def _filequeue(**kwargs):
+    """
+    Return the queue of the configured backend
+    """
+    if kwargs.get('backend', 'files') == 'journal':
+        return JournalQueue(**kwargs)
+    return FileQueue(**kwargs)
+
 
 class Lock(object):
     """
@@ -235,7 +633,10 @@ def help_():
     """
     Usage
     """
-    usage = ('filequeue.queues:\n\n'
+    usage = ('All commands accept backend=journal to keep the queue in a\n'
+             'journal rather than a file per item, and coalesce=seconds to\n'
+             'fire a single batch event per time window.\n\n'
+             'filequeue.queues:\n\n'
              '    List the existing queues\n\n'
              '    CLI Example:\n\n'
              '        salt-run filequeue.queues\n'
@@ -254,12 +655,14 @@ def help_():
              '        salt-run filequeue.push abc\n'
              '        salt-run filequeue.push abc queue=prep\n'
              '        salt-run filequeue.push item=abc queue=prep\n'
+             '        salt-run filequeue.enqueue items=abc,def queue=prep\n'
              '\n\n'
              'filequeue.dequeue:\n\n'
              '    Remove and return oldest item from a queue\n\n'
              '    CLI Example:\n\n'
              '        salt-run filequeue.dequeue\n'
              '        salt-run filequeue.dequeue queue=prep\n'
+             '        salt-run filequeue.dequeue count=10 queue=prep\n'
              '\n\n'
              'filequeue.pop:\n\n'
              '    Remove and return newest item from a queue\n\n'
@@ -296,6 +699,14 @@ def help_():
              '        salt-run filequeue.remove abc queue=prep\n'
              '        salt-run filequeue.remove item=abc queue=prep\n'
              '\n\n'
+             'filequeue.wait:\n\n'
+             '    Block until a queue is empty, or contains an item, or\n'
+             '    until timeout seconds passed\n\n'
+             '    CLI Example:\n\n'
+             '        salt-run filequeue.wait queue=prep\n'
+             '        salt-run filequeue.wait queue=prep until=item timeout=60\n'
+             '        salt-run filequeue.wait queue=master until=item item=complete\n'
+             '\n\n'
              'filequeue.vacant:\n\n'
              '    Remove an item and check if queue is empty\n\n'
              '    CLI Example:\n\n'
@@ -311,19 +722,33 @@ def queues(**kwargs):
     List queues
     """
     log.debug("queues: kwargs = {}".format(_skip_dunder(kwargs)))
-    filequeue = FileQueue(**kwargs)
+    filequeue = _filequeue(**kwargs)
     with Lock(filequeue.settings):
         return "\n".join(filequeue.dirs())
 
 
+def _list(items):
+    """
+    Accept a list or a comma separated string
+    """
+    if isinstance(items, list):
+        return items
+    return [item.strip() for item in items.split(',') if item.strip()]
+
+
 def enqueue(queue=None, **kwargs):
     """
-    Add item
+    Add item, or a list of items
     """
     log.debug("enqueue: queue = {}, kwargs = {}".format(queue, _skip_dunder(kwargs)))
-    filequeue = FileQueue(**kwargs)
+    if 'items' in kwargs and queue:
+        # With a list of items, queue names the queue
+        kwargs['queue'] = queue
+    filequeue = _filequeue(**kwargs)
     with Lock(filequeue.settings):
-        if queue:
+        if 'items' in kwargs:
+            ret = filequeue.touch_many(_list(kwargs['items']))
+        elif queue:
             ret = filequeue.touch(queue)
         elif 'item' in kwargs:
             ret = filequeue.touch(kwargs['item'])
@@ -348,14 +773,18 @@ def push(queue=None, **kwargs):
 
 
 # pylint: disable=invalid-name
-def dequeue(**kwargs):
+def dequeue(count=None, **kwargs):
     """
-    Remove oldest item
+    Remove oldest item, or a list of the count oldest items
     """
-    log.debug("dequeue: kwargs = {}".format(_skip_dunder(kwargs)))
-    filequeue = FileQueue(**kwargs)
+    log.debug("dequeue: count = {}, kwargs = {}".format(count, _skip_dunder(kwargs)))
+    filequeue = _filequeue(**kwargs)
     with Lock(filequeue.settings):
-        oldest = list(filequeue.items())[0]
+        if count is not None:
+            oldest = filequeue.oldest(int(count))
+            filequeue.remove_many(oldest)
+            return oldest
+        oldest = filequeue.oldest()[0]
         filequeue.remove(oldest)
     return oldest
 
@@ -365,9 +794,9 @@ def pop(**kwargs):
     Remove newest item
     """
     log.debug("pop: kwargs = {}".format(_skip_dunder(kwargs)))
-    filequeue = FileQueue(**kwargs)
+    filequeue = _filequeue(**kwargs)
     with Lock(filequeue.settings):
-        newest = list(filequeue.items())[-1]
+        newest = filequeue.newest()
         filequeue.remove(newest)
     return newest
 
@@ -378,7 +807,7 @@ def ls(**kwargs):
     List items
     """
     log.debug("ls: kwargs = {}".format(_skip_dunder(kwargs)))
-    filequeue = FileQueue(**kwargs)
+    filequeue = _filequeue(**kwargs)
     with Lock(filequeue.settings):
         return "\n".join(filequeue.ls())
 
@@ -388,7 +817,7 @@ def items(**kwargs):
     List items in time order
     """
     log.debug("items: kwargs = {}".format(_skip_dunder(kwargs)))
-    filequeue = FileQueue(**kwargs)
+    filequeue = _filequeue(**kwargs)
     with Lock(filequeue.settings):
         return "\n".join(list(filequeue.items()))
 
@@ -398,7 +827,7 @@ def empty(**kwargs):
     Check if queue is empty
     """
     log.debug("empty: kwargs = {}".format(_skip_dunder(kwargs)))
-    filequeue = FileQueue(**kwargs)
+    filequeue = _filequeue(**kwargs)
     with Lock(filequeue.settings):
         return filequeue.empty()
 
@@ -408,7 +837,7 @@ def check(queue=None, **kwargs):
     Check if item exists
     """
     log.debug("check: queue = {}, kwargs = {}".format(queue, _skip_dunder(kwargs)))
-    filequeue = FileQueue(**kwargs)
+    filequeue = _filequeue(**kwargs)
     with Lock(filequeue.settings):
         if queue:
             return filequeue.check(queue)
@@ -425,7 +854,7 @@ def remove(queue=None, **kwargs):
     """
     log.debug("remove: queue = {}, kwargs = {}".format(queue, _skip_dunder(kwargs)))
 
-    filequeue = FileQueue(**kwargs)
+    filequeue = _filequeue(**kwargs)
     with Lock(filequeue.settings):
         if queue:
             return filequeue.remove(queue)
@@ -442,7 +871,7 @@ def vacate(queue=None, **kwargs):
     """
     log.debug("vacate: queue = {}, kwargs = {}".format(queue, _skip_dunder(kwargs)))
 
-    filequeue = FileQueue(**kwargs)
+    filequeue = _filequeue(**kwargs)
     with Lock(filequeue.settings):
         if queue:
             return filequeue.vacate(queue)
@@ -452,6 +881,16 @@ def vacate(queue=None, **kwargs):
             help()
             return None
 
+
+def wait(until='empty', timeout=WAIT_TIMEOUT, **kwargs):
+    """
+    Block until the queue is empty or holds an item.  Does not hold the
+    lock, so that others can change the queue meanwhile.
+    """
+    log.debug("wait: until = {}, kwargs = {}".format(until, _skip_dunder(kwargs)))
+    filequeue = _filequeue(**kwargs)
+    return filequeue.wait(until, kwargs.get('item'), timeout)
+
 __func_alias__ = {
                  'help_': 'help',
                  }
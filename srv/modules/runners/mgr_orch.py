@@ -3,18 +3,34 @@
 # pylint: disable=too-few-public-methods,modernize-parse-error
 """
 Runner endpoints for integration specifically with the ceph-mgr orchestrator
+
+The device inventory of every minion is kept in the master cachedir.  Queries
+are answered from there and only minions without a recent inventory are
+asked.  To keep the store warm, schedule a refresh on the master:
+
+    schedule:
+      refresh_inventory:
+        function: mgr_orch.refresh_inventory
+        minutes: 10
 """
 
 from __future__ import absolute_import
+import json
 import logging
 import ipaddress
 import os
 import sys
+import time
 # pylint: disable=import-error,3rd-party-module-not-gated,redefined-builtin
 import salt.client
+import salt.utils.minions
 
 log = logging.getLogger(__name__)
 
+INVENTORY_FILE = "mgr_orch/inventory.json"
+# Seconds a stored inventory is served without asking the minion
+INVENTORY_MAX_AGE = 300
+
 
 def _run_master_module_function(function, *args, **kwargs):
     """
@@ -29,22 +45,67 @@ def _run_master_module_function(function, *args, **kwargs):
     return __salt__[function](*args, **kwargs)
 
 
-def get_inventory(nodes=None, roles=None):
+class InventoryStore(object):
     """
-    Return an inventory of all devices on all nodes, optionally limited
-    to nodes with particular hostnames or roles.  Criteria are OR'd, e.g.
-    if multiple roles are passed in, this will inventory all nodes assigned
-    to _any_ of the listed roles.  Likewise if multiple nodes are passed,
-    all those nodes will be inventoried.
-
-    Examples:
-
-    salt-run mgr_orch.get_inventory roles=mon
-    salt-run mgr_orch.get_inventory roles=[mgr,mds]
-    salt-run mgr_orch.get_inventory nodes=data1.example.com
-    salt-run mgr_orch.get_inventory nodes=[data1.example.com,data5.example.com]
+    The last cephdisks.all result of each minion with its time
     """
 
+    def __init__(self, filename=None):
+        if filename is None:
+            filename = os.path.join(
+                __opts__.get('cachedir', '/var/cache/salt/master'), INVENTORY_FILE)
+        self.filename = filename
+        self.entries = self._load()
+
+    def _load(self):
+        """
+        Return the stored entries, none if the store is missing or broken
+        """
+        try:
+            with open(self.filename, 'r') as store:
+                return json.load(store)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def fresh(self, minion, max_age):
+        """
+        Return whether the inventory of a minion is younger than max_age
+        """
+        entry = self.entries.get(minion)
+        return entry is not None and time.time() - entry['time'] <= max_age
+
+    def devices(self, minion):
+        """
+        Return the stored inventory of a minion
+        """
+        return self.entries[minion]['devices']
+
+    def update(self, results):
+        """
+        Store the inventories returned by minions, keeping the entries
+        other runners stored meanwhile
+        """
+        now = time.time()
+        self.entries = self._load()
+        for minion, devices in results.items():
+            if isinstance(devices, list):
+                self.entries[minion] = {'time': now, 'devices': devices}
+            else:
+                log.warning("Inventory of {} failed: {}".format(minion, devices))
+        directory = os.path.dirname(self.filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = "{}.{}".format(self.filename, os.getpid())
+        with open(tmp, 'w') as store:
+            json.dump(self.entries, store)
+        os.rename(tmp, self.filename)
+
+
+def _search(nodes, roles):
+    """
+    Return the compound target of the nodes with any of the hostnames or
+    roles
+    """
     # The cluster is always named 'ceph'
     search = "I@cluster:ceph"
 
@@ -65,17 +126,95 @@ def get_inventory(nodes=None, roles=None):
         criteria.append("I@roles:{}".format(role))
     if criteria:
         search = "{} and ( {} )".format(search, " or ".join(criteria))
+    return search
 
+
+def _minions(search):
+    """
+    Return the minions matching a compound target from the master's cache
+    """
+    ckminions = salt.utils.minions.CkMinions(__opts__)
+    matched = ckminions.check_minions(search, tgt_type='compound')
+    if isinstance(matched, dict):
+        matched = matched.get('minions', [])
+    return sorted(matched)
+
+
+def _ask(search, minions):
+    """
+    Return the inventories of the listed minions, or of all minions
+    matching search if the list is empty
+    """
     # When search matches no minions, salt prints to stdout.  Suppress stdout.
     _stdout = sys.stdout
     sys.stdout = open(os.devnull, 'w')
 
     local = salt.client.LocalClient()
-    minions = local.cmd(search, 'cephdisks.all', [], tgt_type="compound")
+    if minions:
+        results = local.cmd(minions, 'cephdisks.all', [], tgt_type="list")
+    else:
+        results = local.cmd(search, 'cephdisks.all', [], tgt_type="compound")
 
     sys.stdout = _stdout
 
-    return minions
+    return results
+
+
+def get_inventory(nodes=None, roles=None, max_age=INVENTORY_MAX_AGE, refresh=False):
+    """
+    Return an inventory of all devices on all nodes, optionally limited
+    to nodes with particular hostnames or roles.  Criteria are OR'd, e.g.
+    if multiple roles are passed in, this will inventory all nodes assigned
+    to _any_ of the listed roles.  Likewise if multiple nodes are passed,
+    all those nodes will be inventoried.
+
+    Inventories stored less than max_age seconds ago are returned without
+    asking the minions.  Set refresh to ask all of them.
+
+    Examples:
+
+    salt-run mgr_orch.get_inventory roles=mon
+    salt-run mgr_orch.get_inventory roles=[mgr,mds]
+    salt-run mgr_orch.get_inventory nodes=data1.example.com
+    salt-run mgr_orch.get_inventory nodes=[data1.example.com,data5.example.com]
+    salt-run mgr_orch.get_inventory max_age=60
+    salt-run mgr_orch.get_inventory refresh=True
+    """
+    search = _search(nodes, roles)
+    store = InventoryStore()
+    minions = _minions(search)
+    max_age = float(max_age)
+    stale = [minion for minion in minions
+             if refresh or not store.fresh(minion, max_age)]
+    if minions and not stale:
+        results = {}
+    elif len(stale) < len(minions):
+        results = _ask(search, stale)
+    else:
+        # Nothing stored or no matches in the master's cache
+        results = _ask(search, [])
+    if results:
+        store.update(results)
+
+    inventory = dict((minion, store.devices(minion))
+                     for minion in minions if minion not in stale)
+    inventory.update(results)
+    return inventory
+
+
+def refresh_inventory(nodes=None, roles=None):
+    """
+    Ask the nodes, optionally limited like get_inventory, for their
+    devices and store the result.  Returns the number of inventories stored.
+
+    Examples:
+
+    salt-run mgr_orch.refresh_inventory
+    salt-run mgr_orch.refresh_inventory roles=storage
+    """
+    results = _ask(_search(nodes, roles), [])
+    InventoryStore().update(results)
+    return len([devices for devices in results.values() if isinstance(devices, list)])
 
 
 def describe_service(role=None, service_id=None, node=None):
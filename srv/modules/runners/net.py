@@ -10,8 +10,11 @@ from __future__ import absolute_import
 from __future__ import print_function
 import time
 import logging
+import json
 import operator
+import os
 import re
+from collections import OrderedDict
 # pylint: disable=import-error,3rd-party-module-not-gated
 from netaddr import IPNetwork, IPAddress
 import ipaddress
@@ -21,10 +24,20 @@ import pprint
 from six.moves import range
 # pylint: disable=incompatible-py3-code
 
+from stats import percentile
+
 log = logging.getLogger(__name__)
 
+# Seconds to wait for all iperf clients, each runs for 10 seconds
+IPERF_TIMEOUT = 120
+IPERF_PORT = 5200
+# Bandwidth below this fraction of the median is reported
+OUTLIER_RATIO = 0.75
+LATENCY_FILE = "latency.json"
+
 try:
     import salt.client
+    import salt.utils.event
 except ImportError:
     log.error('Could not import salt.client')
 
@@ -48,6 +61,11 @@ def help_():
              'salt-run net.ping remove=192.168.128.0/24:\n\n'
              '    Summarizes network connectivity between minion interfaces\n'
              '\n\n'
+             'salt-run net.latency cluster=ceph:\n'
+             'salt-run net.latency cluster=ceph count=20 max_age=600:\n\n'
+             '    Returns the rtt between all minions and interfaces with\n'
+             '    percentiles per minion and jumbo frame reachability\n'
+             '\n\n'
              'salt-run net.jumbo_ping:\n\n'
              '    Summarizes network connectivity between minion interfaces for jumbo packets\n'
              '\n\n'
@@ -57,6 +75,11 @@ def help_():
              'salt-run net.iperf exclude=target:\n\n'
              'salt-run net.ping remove=192.168.128.0/24:\n\n'
              '    Summarizes bandwidth throughput between minion interfaces\n'
+             '\n\n'
+             'salt-run net.iperf_matrix cluster=ceph:\n'
+             'salt-run net.iperf_matrix cluster=ceph filename=/root/iperf.json:\n\n'
+             '    Measures the bandwidth between every pair of minion interfaces\n'
+             '    and saves the matrix\n'
              '\n\n')
     print(usage)
     return ""
@@ -94,6 +117,48 @@ def iperf(cluster=None, exclude=None, remove=None, output=None, **kwargs):
     To get all host iperf result
         sudo salt-run net.iperf cluster=ceph output=full
 
+    """
+    networks = _iperf_addresses(cluster, exclude, remove)
+    addresses = [address for network in networks.values() for address in network]
+    hosts = _hosts(addresses)
+    _create_server(addresses, hosts)
+    if cluster:
+        result = {}
+        p_result = _create_client(networks['Public Network'], hosts)
+        c_result = _create_client(networks['Cluster Network'], hosts)
+        p_sort = _add_unit(sorted(list(p_result.items()),
+                                  key=operator.itemgetter(1), reverse=True))
+        c_sort = _add_unit(sorted(list(c_result.items()),
+                                  key=operator.itemgetter(1), reverse=True))
+
+        if output:
+            result.update({'Public Network': p_sort})
+            result.update({'Cluster Network': c_sort})
+            return result
+        else:
+            result.update({'Public Network':
+                           {"Slowest 2 hosts": p_sort[-2:],
+                            "Fastest 2 hosts": p_sort[:2]}})
+            result.update({'Cluster Network':
+                           {"Slowest 2 hosts": c_sort[-2:],
+                            "Fastest 2 hosts": c_sort[:2]}})
+            return result
+    else:
+        result = _create_client(addresses, hosts)
+        sort_result = _add_unit(sorted(list(result.items()),
+                                       key=operator.itemgetter(1),
+                                       reverse=True))
+        if output:
+            return sort_result
+        else:
+            return {"Slowest 2 hosts": sort_result[-2:],
+                    "Fastest 2 hosts": sort_result[:2]}
+
+
+def _iperf_addresses(cluster=None, exclude=None, remove=None):
+    """
+    Return the addresses to test by network.  With a cluster, these are the
+    addresses in the public and cluster networks.
     """
     exclude_string = exclude_iplist = None
     if exclude:
@@ -138,28 +203,8 @@ def iperf(cluster=None, exclude=None, remove=None, output=None, **kwargs):
                              cluster_networks[host]['cluster_network']))
             log.debug("iperf: public_network {} ".format(public_addresses))
             log.debug("iperf: cluster_network {} ".format(cluster_addresses))
-        result = {}
-        _create_server(public_addresses)
-        p_result = _create_client(public_addresses)
-        _create_server(cluster_addresses)
-        c_result = _create_client(cluster_addresses)
-        p_sort = _add_unit(sorted(list(p_result.items()),
-                                  key=operator.itemgetter(1), reverse=True))
-        c_sort = _add_unit(sorted(list(c_result.items()),
-                                  key=operator.itemgetter(1), reverse=True))
-
-        if output:
-            result.update({'Public Network': p_sort})
-            result.update({'Cluster Network': c_sort})
-            return result
-        else:
-            result.update({'Public Network':
-                           {"Slowest 2 hosts": p_sort[-2:],
-                            "Fastest 2 hosts": p_sort[:2]}})
-            result.update({'Cluster Network':
-                           {"Slowest 2 hosts": c_sort[-2:],
-                            "Fastest 2 hosts": c_sort[:2]}})
-            return result
+        return OrderedDict([('Public Network', public_addresses),
+                            ('Cluster Network', cluster_addresses)])
     else:
         # pylint: disable=redefined-variable-type
         search = __utils__['deepsea_minions.show']()
@@ -173,7 +218,8 @@ def iperf(cluster=None, exclude=None, remove=None, output=None, **kwargs):
 
         addresses = _remove_minion_not_found(addresses)
         addresses = _flatten(list(addresses.values()))
-        addresses = _remove_minion_exclude(addresses, remove)
+        if remove:
+            addresses = _remove_minion_exclude(addresses, remove)
         # Lazy loopback removal - use ipaddress when adding IPv6
         try:
             if ipversion == 'ipv4':
@@ -187,16 +233,7 @@ def iperf(cluster=None, exclude=None, remove=None, output=None, **kwargs):
                     addresses.remove(ex_ip)
         except ValueError:
             log.debug("iperf: remove {} ip doesn't exist".format(ex_ip))
-        _create_server(addresses)
-        result = _create_client(addresses)
-        sort_result = _add_unit(sorted(list(result.items()),
-                                       key=operator.itemgetter(1),
-                                       reverse=True))
-        if output:
-            return sort_result
-        else:
-            return {"Slowest 2 hosts": sort_result[-2:],
-                    "Fastest 2 hosts": sort_result[:2]}
+        return OrderedDict([('Network', sorted(addresses))])
 
 
 def _add_unit(records):
@@ -210,74 +247,305 @@ def _add_unit(records):
     return stuff
 
 
-def _create_server(addresses):
+def _hosts(addresses):
     """
-    Start iperf server
+    Return the minion and number of cpus of each address, queried once for
+    all addresses
     """
-    start_service = []
+    hosts = {}
+    if not addresses:
+        return hosts
     local = salt.client.LocalClient()
-    log.debug("net.iperf._create_server: address list {} ".format(addresses))
-    for server in addresses:
-        cpu_core = get_cpu_count(server)
-        log.debug("net.iperf._create_server: server {} cpu count {} "
-                  .format(server, cpu_core))
-        for count in range(cpu_core):
-            log.debug("net.iperf._create_server: server {} count {} port {} "
-                      .format(server, count, 5200+count))
-            start_service.append(local.cmd("S@{}".format(server),
-                                           'multi.iperf_server_cmd',
-                                           [count, 5200+count], tgt_type="compound"))
+    search = " or ".join("S@{}".format(address) for address in sorted(set(addresses)))
+    grains = local.cmd(search, 'grains.item', ['num_cpus', 'ipv4', 'ipv6'],
+                       tgt_type="compound")
+    for minion, items in six.iteritems(grains):
+        if not isinstance(items, dict):
+            continue
+        for address in items.get('ipv4', []) + items.get('ipv6', []):
+            hosts[address] = (minion, items.get('num_cpus', 1))
+    for address in addresses:
+        if address not in hosts:
+            log.debug("net.iperf._hosts: no minion for {}".format(address))
+            hosts[address] = (None, get_cpu_count(address))
+    return hosts
 
 
-def _create_client(addresses):
+def _create_server(addresses, hosts):
     """
-    Start iperf client
+    Start an iperf server per cpu on every host with a single call
     """
-    results = []
-    jid = []
     local = salt.client.LocalClient()
-    for server in addresses:
-        cpu_core = get_cpu_count(server)
-        log.debug("net.iperf._create_client: server {} cpu count {} "
-                  .format(server, cpu_core))
-        clients = list(addresses)
-        clients.remove(server)
+    log.debug("net.iperf._create_server: address list {} ".format(addresses))
+    minions = sorted(set(hosts[address][0] for address in addresses
+                         if hosts[address][0]))
+    if minions:
+        local.cmd(minions, 'multi.prepare_iperf_server', [], tgt_type="list")
+    for address in addresses:
+        if not hosts[address][0]:
+            for count in range(hosts[address][1]):
+                local.cmd("S@{}".format(address), 'multi.iperf_server_cmd',
+                          [count, IPERF_PORT+count], tgt_type="compound")
+
+
+def _host(address, hosts):
+    """
+    Return the minion of an address, or the address when no minion has it
+    """
+    return hosts[address][0] or address
+
+
+def _waves(addresses, hosts):
+    """
+    Return the addresses in waves holding at most one address of each host.
+    The iperf servers of a host listen on the same ports for all of its
+    addresses, so only one of them can be tested at a time.
+    """
+    waves = []
+    seen = {}
+    for address in addresses:
+        host = _host(address, hosts)
+        index = seen.get(host, 0)
+        seen[host] = index + 1
+        if index == len(waves):
+            waves.append([])
+        waves[index].append(address)
+    return waves
+
+
+def _client_jobs(addresses, hosts, servers=None):
+    """
+    Return the client, server, cpu and port of every iperf client.  Each
+    server gets one client per cpu, spread over the addresses of the other
+    hosts.
+    """
+    jobs = []
+    for server in addresses if servers is None else servers:
+        cpu_core = hosts[server][1]
+        clients = [client for client in addresses
+                   if _host(client, hosts) != _host(server, hosts)]
         clients_size = len(clients)
+        if not clients_size:
+            continue
         # pylint: disable=invalid-name
         for x in range(0, cpu_core, clients_size):
             # pylint: disable=invalid-name
             for y, client in enumerate(clients):
-                log.debug("net.iperf._create_client:")
-                log.debug("server port:{}, x:{} client:{} to server:{}"
-                          .format(5200+x+y, x/clients_size, client, server))
                 if x+y < cpu_core:
-                    jid.append(
-                        local.cmd_async(
-                            "S@"+client,
-                            'multi.iperf',
-                            [server, x/clients_size, 5200+x+y],
-                            tgt_type="compound"))
-                    log.debug("net.iperf._create_client:")
-                    log.debug("calling from client:{} ".format(client))
-                    log.debug("to server:{} ".format(server))
-                    log.debug("cpu:{} port:{}".format(x/clients_size, 5200+x+y))
-        log.debug("net.iperf._create_client:")
-        log.debug("Server {} iperf client count {}".format(server, len(jid)))
-        time.sleep(8)
-
-    log.debug("iperf: All Async iperf client count {}".format(len(jid)))
-    not_done = True
-    while not_done:
-        not_done = False
-        for job in jid:
-            if not __salt__['jobs.lookup_jid'](job):
-                log.debug("iperf: job not done {} ".format(job))
-                time.sleep(1)
-                not_done = True
-    results = []
-    for job in jid:
-        results.append(__salt__['jobs.lookup_jid'](job))
-    return _summarize_iperf(results)
+                    jobs.append((client, server, x//clients_size, IPERF_PORT+x+y))
+    return jobs
+
+
+def _create_client(addresses, hosts, timeout=IPERF_TIMEOUT):
+    """
+    Start the iperf clients of one address per host at once and collect
+    their results from the return events, wave after wave
+    """
+    if len(addresses) < 2:
+        return {}
+    local = salt.client.LocalClient()
+    # Listen before starting the jobs, so that no return is missed
+    event = salt.utils.event.get_event('master', __opts__['sock_dir'],
+                                       __opts__['transport'], opts=__opts__,
+                                       listen=True)
+    results = OrderedDict()
+    try:
+        for servers in _waves(addresses, hosts):
+            jids = []
+            for client, server, cpu, port in _client_jobs(addresses, hosts, servers):
+                log.debug("net.iperf._create_client: client:{} server:{} cpu:{} port:{}"
+                          .format(client, server, cpu, port))
+                jid = local.cmd_async("S@"+client, 'multi.iperf', [server, cpu, port],
+                                      tgt_type="compound")
+                if jid:
+                    jids.append(jid)
+            log.debug("iperf: Async iperf client count {}".format(len(jids)))
+            results.update(_collect(event, jids, timeout))
+    finally:
+        event.destroy()
+    return _summarize_iperf(list(results.values()))
+
+
+def iperf_matrix(cluster=None, exclude=None, remove=None, filename=None,
+                 timeout=IPERF_TIMEOUT, **kwargs):
+    """
+    Measure the bandwidth between every pair of addresses, one direction at
+    a time.  The tests run in rounds where each address either sends or
+    receives, and all tests of a round run in parallel.  Returns the
+    src -> dst matrix in Mbits/sec per network, the median send and receive
+    bandwidth of each address and the addresses and links well below the
+    median.  The result is also saved as JSON to filename, by default in the
+    master cachedir, so that runs can be compared.
+
+    CLI Example:
+    .. code-block:: bash
+        sudo salt-run net.iperf_matrix cluster=ceph
+        sudo salt-run net.iperf_matrix cluster=ceph filename=/root/before.json
+
+    """
+    networks = _iperf_addresses(cluster, exclude, remove)
+    addresses = [address for network in networks.values() for address in network]
+    hosts = _hosts(addresses)
+    _create_server(addresses, hosts)
+    result = OrderedDict()
+    for name, network in networks.items():
+        matrix = _bandwidth(network, float(timeout))
+        result[name] = _analyze(matrix, hosts)
+    if not filename:
+        filename = "{}/net/iperf-{}.json".format(__opts__['cachedir'],
+                                                time.strftime("%Y%m%d-%H%M%S"))
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    with open(filename, "w") as _fd:
+        json.dump(result, _fd, indent=2, sort_keys=True)
+    log.info("iperf_matrix: saved to {}".format(filename))
+    result['file'] = filename
+    return result
+
+
+def _rounds(addresses):
+    """
+    Return rounds of (sender, receiver) pairs covering every ordered pair of
+    addresses once.  No address is in more than one pair of a round.
+    """
+    members = list(addresses)
+    if len(members) % 2:
+        # Sits out the round
+        members.append(None)
+    count = len(members)
+    rounds = []
+    for _ in range(count - 1):
+        pairs = [(members[i], members[count - 1 - i]) for i in range(count // 2)]
+        pairs = [pair for pair in pairs if None not in pair]
+        if pairs:
+            rounds.append(pairs)
+        # Circle method, the first member stays in place
+        members = [members[0], members[-1]] + members[1:-1]
+    return rounds + [[(receiver, sender) for sender, receiver in pairs]
+                     for pairs in rounds]
+
+
+def _speed(result):
+    """
+    Return the Mbits/sec of a multi.iperf result, None if it failed
+    """
+    for msg in result.values():
+        if isinstance(msg, dict) and msg.get('succeeded'):
+            try:
+                return float(msg['filter'].split()[0])
+            except (KeyError, ValueError, IndexError):
+                return None
+    return None
+
+
+def _bandwidth(addresses, timeout):
+    """
+    Return the src -> dst Mbits/sec of all pairs of addresses, None for
+    failed tests
+    """
+    local = salt.client.LocalClient()
+    matrix = OrderedDict((address, OrderedDict()) for address in addresses)
+    for number, pairs in enumerate(_rounds(addresses)):
+        log.info("iperf_matrix: round {} with {} tests".format(number + 1, len(pairs)))
+        event = salt.utils.event.get_event('master', __opts__['sock_dir'],
+                                           __opts__['transport'], opts=__opts__,
+                                           listen=True)
+        try:
+            jobs = {}
+            for sender, receiver in pairs:
+                jid = local.cmd_async("S@"+sender, 'multi.iperf',
+                                      [receiver, 0, IPERF_PORT],
+                                      tgt_type="compound")
+                if jid:
+                    jobs[jid] = (sender, receiver)
+                else:
+                    matrix[sender][receiver] = None
+            results = _collect(event, list(jobs), timeout)
+        finally:
+            event.destroy()
+        for jid, (sender, receiver) in jobs.items():
+            matrix[sender][receiver] = _speed(results.get(jid, {}))
+    return matrix
+
+
+def _median(values):
+    """
+    Return the median, None without values
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def _analyze(matrix, hosts, ratio=OUTLIER_RATIO):
+    """
+    Summarize the matrix by address and list the addresses and links below
+    ratio times the median
+    """
+    summary = OrderedDict()
+    for address in matrix:
+        sent = list(matrix[address].values())
+        received = [row[address] for row in matrix.values() if address in row]
+        summary[address] = {
+            'minion': hosts.get(address, (None, 0))[0],
+            'send': _median([speed for speed in sent if speed is not None]),
+            'receive': _median([speed for speed in received if speed is not None]),
+            'failed': len([speed for speed in sent + received if speed is None])}
+
+    medians = {}
+    for direction in ['send', 'receive']:
+        medians[direction] = _median([entry[direction] for entry in summary.values()
+                                      if entry[direction] is not None])
+    outliers = []
+    for address, entry in summary.items():
+        slow = [direction for direction in ['send', 'receive']
+                if medians[direction] and entry[direction] is not None and
+                entry[direction] < ratio * medians[direction]]
+        if entry['failed'] or slow:
+            outliers.append(address)
+
+    links = [speed for row in matrix.values() for speed in row.values()
+             if speed is not None]
+    median = _median(links)
+    slow_links = ["{} -> {}: {}".format(sender, receiver,
+                                        "failed" if speed is None else
+                                        "{} Mbits/sec".format(speed))
+                  for sender, row in matrix.items()
+                  for receiver, speed in row.items()
+                  if speed is None or (median and speed < ratio * median)]
+    return OrderedDict([('matrix', matrix), ('hosts', summary),
+                        ('outliers', outliers), ('slow links', slow_links)])
+
+
+def _collect(event, jids, timeout):
+    """
+    Return the results of the jobs by jid as their return events arrive.
+    Jobs without an event before the timeout are looked up in the job cache.
+    """
+    pending = set(jids)
+    results = OrderedDict()
+    deadline = time.time() + timeout
+    while pending and time.time() < deadline:
+        ret = event.get_event(wait=min(1, max(0, deadline - time.time())),
+                              tag='salt/job/', full=True)
+        if not ret:
+            continue
+        tag = ret['tag'].split('/')
+        data = ret['data']
+        if len(tag) > 3 and tag[3] == 'ret' and tag[2] in pending:
+            pending.discard(tag[2])
+            results[tag[2]] = {data['id']: data['return']}
+    for jid in sorted(pending):
+        result = __salt__['jobs.lookup_jid'](jid)
+        if result:
+            results[jid] = result
+        else:
+            log.warning("iperf: job {} did not return".format(jid))
+    return results
 
 
 def jumbo_ping(cluster=None, exclude=None, remove=None, **kwargs):
@@ -347,7 +615,27 @@ def ping(cluster=None, exclude=None, remove=None, ping_type=None, **kwargs):
         print(text)
         return ""
 
+    search, addresses, _ = _ping_addresses(cluster, exclude_string, exclude_iplist, remove)
     local = salt.client.LocalClient()
+    if ping_type == "jumbo":
+        results = local.cmd(search, 'multi.jumbo_ping',
+                            addresses, tgt_type="compound")
+    else:
+        results = local.cmd(search, 'multi.ping',
+                            addresses, tgt_type="compound")
+    results = _remove_minion_not_found(results)
+    _summarize(len(addresses), results)
+    return ""
+
+
+def _ping_addresses(cluster, exclude_string, exclude_iplist, remove):
+    """
+    Return the target, the addresses to ping and the addresses of each
+    minion.  If cluster is passed, restrict addresses to public and cluster
+    networks.
+    """
+    local = salt.client.LocalClient()
+    owned = {}
     if cluster:
         search = "I@cluster:{}".format(cluster)
         if exclude_string:
@@ -367,6 +655,7 @@ def ping(cluster=None, exclude=None, remove=None, ping_type=None, **kwargs):
         total = local.cmd(search, 'grains.get', [ipversion], tgt_type="compound")
         addresses = []
         for host in sorted(six.iterkeys(total)):
+            owned[host] = total[host]
             if 'cluster_network' in networks[host]:
                 addresses.extend(_address(total[host],
                                           networks[host]['cluster_network']))
@@ -384,8 +673,10 @@ def ping(cluster=None, exclude=None, remove=None, ping_type=None, **kwargs):
         addresses = local.cmd(search, 'grains.get',
                               [ipversion], tgt_type="compound")
         addresses = _remove_minion_not_found(addresses)
+        owned.update(addresses)
         addresses = _flatten(list(addresses.values()))
-        addresses = _remove_minion_exclude(addresses, remove)
+        if remove:
+            addresses = _remove_minion_exclude(addresses, remove)
         # Lazy loopback removal - use ipaddress when adding IPv6
         try:
             if addresses:
@@ -403,15 +694,116 @@ def ping(cluster=None, exclude=None, remove=None, ping_type=None, **kwargs):
                     addresses.remove(ex_ip)
         except ValueError:
             log.debug("ping: remove {} ip doesn't exist".format(ex_ip))
-    if ping_type == "jumbo":
-        results = local.cmd(search, 'multi.jumbo_ping',
-                            addresses, tgt_type="compound")
-    else:
-        results = local.cmd(search, 'multi.ping',
-                            addresses, tgt_type="compound")
+    return search, addresses, owned
+
+
+def latency(cluster=None, exclude=None, remove=None, count=5, jumbo=True,
+            max_age=0, **kwargs):
+    """
+    Ping all addresses from all minions with count packets each and return
+    the rtt of every minion to address pair, the median and 99th percentile
+    rtt of each minion and, with jumbo, whether each pair passes 9000 byte
+    frames.  The measurement is saved in the master cachedir.  With max_age,
+    a saved measurement of the same addresses that is at most max_age
+    seconds old is returned instead of pinging again.
+
+    CLI Example:
+    .. code-block:: bash
+        sudo salt-run net.latency cluster=ceph
+        sudo salt-run net.latency cluster=ceph count=20 jumbo=False
+        sudo salt-run net.latency cluster=ceph max_age=600
+    """
+    exclude_string = exclude_iplist = None
+    if exclude:
+        exclude_string, exclude_iplist = _exclude_filter(exclude)
+    params = {'cluster': cluster, 'exclude': exclude, 'remove': remove,
+              'count': int(count), 'jumbo': bool(jumbo)}
+    filename = "{}/net/{}".format(__opts__['cachedir'], LATENCY_FILE)
+    if max_age:
+        cached = _cached_latency(filename, params, float(max_age))
+        if cached:
+            return cached
+
+    search, addresses, owned = _ping_addresses(cluster, exclude_string,
+                                               exclude_iplist, remove)
+    local = salt.client.LocalClient()
+    results = local.cmd(search, 'multi.ping', addresses, tgt_type="compound",
+                        kwarg={'count': int(count)})
     results = _remove_minion_not_found(results)
-    _summarize(len(addresses), results)
-    return ""
+    result = OrderedDict([('time', time.time()), ('params', params)])
+    result.update(_latency_matrix(results, owned))
+    if jumbo:
+        jumbo_results = local.cmd(search, 'multi.jumbo_ping', addresses,
+                                  tgt_type="compound")
+        jumbo_results = _remove_minion_not_found(jumbo_results)
+        result['mtu'] = _mtu_matrix(jumbo_results, owned)
+
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    with open(filename, "w") as _fd:
+        json.dump(result, _fd, indent=2, sort_keys=True)
+    result['cached'] = False
+    return result
+
+
+def _cached_latency(filename, params, max_age):
+    """
+    Return the saved measurement if it used the same parameters and is
+    recent enough
+    """
+    try:
+        with open(filename, "r") as _fd:
+            cached = json.load(_fd)
+    except (IOError, OSError, ValueError):
+        return None
+    if cached.get('params') != params:
+        log.debug("latency: saved measurement used {}".format(cached.get('params')))
+        return None
+    if time.time() - cached.get('time', 0) > max_age:
+        log.debug("latency: saved measurement expired")
+        return None
+    cached['cached'] = True
+    return cached
+
+
+def _latency_matrix(results, owned):
+    """
+    Return the rtt statistics of each minion to each address, without the
+    minion's own addresses, and p50/p99 of the average rtts per minion
+    """
+    matrix = OrderedDict()
+    hosts = OrderedDict()
+    for minion in sorted(results):
+        if not isinstance(results[minion], dict):
+            continue
+        pairs = OrderedDict(
+            (address, stats) for address, stats in
+            sorted(results[minion].get('hosts', {}).items())
+            if address not in owned.get(minion, []))
+        matrix[minion] = pairs
+        rtts = sorted(stats['avg'] for stats in pairs.values() if 'avg' in stats)
+        hosts[minion] = {
+            'p50': percentile(rtts, 50),
+            'p99': percentile(rtts, 99),
+            'max loss': max([stats.get('loss', 0) for stats in pairs.values()] or [0]),
+            'unreachable': [address for address, stats in pairs.items()
+                            if 'avg' not in stats]}
+    return OrderedDict([('latency', matrix), ('hosts', hosts)])
+
+
+def _mtu_matrix(results, owned):
+    """
+    Return whether each minion reached each address with jumbo frames
+    """
+    matrix = OrderedDict()
+    for minion in sorted(results):
+        if not isinstance(results[minion], dict):
+            continue
+        matrix[minion] = OrderedDict(
+            (address, 'avg' in stats) for address, stats in
+            sorted(results[minion].get('hosts', {}).items())
+            if address not in owned.get(minion, []))
+    return matrix
 
 
 def _ipversion(_network):
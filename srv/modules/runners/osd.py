@@ -7,6 +7,7 @@ Runner to remove and replace osds
 from __future__ import absolute_import
 from __future__ import print_function
 import json
+import time
 # pylint: disable=import-error,3rd-party-module-not-gated,redefined-builtin
 import salt.client
 import salt.runner
@@ -16,6 +17,11 @@ import tee
 
 log = tee.console(__name__)
 
+# Seconds between polls of a batch drain
+DRAIN_DELAY = 6
+# Seconds per retry a batch drain may go without progress
+DRAIN_WINDOW = 60
+
 
 def help_():
     """
@@ -23,6 +29,11 @@ def help_():
     """
     usage = ('salt-run remove.osd id [id ...][force=True]:\n\n'
              '    Removes an OSD\n'
+             '\n\n'
+             'salt-run osd.remove id [id ...] batch=True:\n'
+             'salt-run osd.replace id [id ...] batch=True:\n\n'
+             '    Empties all OSDs at once and removes each as soon as it\n'
+             '    is safe to destroy\n'
              '\n\n')
     print(usage)
     return ""
@@ -96,10 +107,11 @@ class OSDUtil(Util):
         self.osd_id = int(args[0])
         self.osd_list = args
         self.local = Util.local
-        self.host_osds = self._host_osds()
+        self.host_osds = kwargs.get('host_osds') or self._host_osds()
         self.host = self._find_host()
-        self.osd_state = self._get_osd_state()
+        self.osd_state = self._get_osd_state(kwargs.get('osd_dump'))
         self.force: bool = kwargs.get('force', False)
+        self.drained: bool = kwargs.get('drained', False)
         self.operation: str = kwargs.get('operation', 'None')
         self.retries: int = kwargs.get('retries', 60)  # ~1 hour
         self.osd_metadata = self.get_osd_metadata()
@@ -200,7 +212,7 @@ class OSDUtil(Util):
             log.error("No host found")
             return False
 
-        if not self.force:
+        if not self.force and not self.drained:
             log.info("Checking if OSD can be destroyed")
             if self._wait_until_empty() is False:
                 return False
@@ -301,15 +313,10 @@ class OSDUtil(Util):
             if self.osd_state.get('out', False):
                 self._mark_osd('out')
 
-    def _get_osd_state(self):
+    def _get_osd_state(self, all_osds=None):
         """ Method to get the current osd_state """
-        cmd = 'ceph osd dump --format=json'
-        log.debug("Executing: {}".format(cmd))
-        ret = self.local.cmd(
-            Util.master_minion(), "cmd.run", [cmd], tgt_type="glob")
-        message = list(ret.values())[0]
-        message_json = json.loads(message)
-        all_osds = message_json.get('osds', [])
+        if all_osds is None:
+            all_osds = osd_dump()
         try:
             osd_info = [
                 x for x in all_osds if x.get('osd', '') == self.osd_id
@@ -332,6 +339,8 @@ class OSDUtil(Util):
         cmd = 'ceph-volume lvm zap --osd-id {} --destroy'.format(self.osd_id)
         log.debug("Executing: {}".format(cmd))
         ret = self.local.cmd(self.host, "cmd.run", [cmd], tgt_type="glob")
+        # The devices changed, do not serve the reports kept on disk
+        self.local.cmd(self.host, "cephdisks.invalidate", tgt_type="glob")
         message = list(ret.values())[0]
         if 'Zapping successful for OSD' not in message:
             log.error("Zapping the osd failed: {}".format(message))
@@ -428,6 +437,111 @@ class OSDUtil(Util):
         return Util.get_osd_list_for("I@roles:storage")
 
 
+def osd_dump():
+    """ Return the osds of 'ceph osd dump' """
+    cmd = 'ceph osd dump --format=json'
+    log.debug("Executing: {}".format(cmd))
+    ret = Util.local.cmd(
+        Util.master_minion(), "cmd.run", [cmd], tgt_type="glob")
+    message = list(ret.values())[0]
+    message_json = json.loads(message)
+    return message_json.get('osds', [])
+
+
+class Drain(object):
+    """
+    Watch the drain of several OSDs.  Every cycle asks for the remaining PGs
+    and the safe-to-destroy state of all OSDs with one call and reads the
+    OSD map once.
+    """
+
+    def __init__(self, osd_ids, retries=60, delay=DRAIN_DELAY):
+        self.remaining = [int(osd_id) for osd_id in osd_ids]
+        self.timeout = int(retries) * DRAIN_WINDOW
+        self.delay = delay
+        self.local = Util.local
+
+    def _status(self):
+        """ Remote call to osd.py for the drain status of all remaining OSDs """
+        ret = self.local.cmd(
+            Util.master_minion(),
+            'osd.drain_status',
+            list(self.remaining),
+            tgt_type="glob")
+        return list(ret.values())[0]
+
+    def safe(self):
+        """
+        Yield each OSD as soon as it is safe to destroy, along with the
+        osds of the OSD map of that cycle.  Stops when all OSDs are done or
+        no PGs moved for the timeout; the OSDs left are in remaining.
+        """
+        last_pgs = None
+        last_progress = time.time()
+        while self.remaining:
+            status = self._status()
+            if not isinstance(status, dict):
+                log.error("Querying the drain status failed: {}".format(status))
+                return
+            all_osds = osd_dump()
+            pgs = 0
+            for osd_id in list(self.remaining):
+                entry = status.get(str(osd_id), {})
+                if entry.get('safe'):
+                    print("osd.{} is safe to destroy".format(osd_id))
+                    self.remaining.remove(osd_id)
+                    yield osd_id, all_osds
+                elif entry.get('pgs') is None:
+                    log.error("osd.{} does not exist".format(osd_id))
+                    self.remaining.remove(osd_id)
+                else:
+                    pgs += entry['pgs']
+            if not self.remaining:
+                return
+            print("Waiting for {} PGs on osd {}".format(
+                pgs, ", ".join(map(str, self.remaining))))
+            if last_pgs is None or pgs < last_pgs:
+                # Making progress, reset countdown
+                last_pgs = pgs
+                last_progress = time.time()
+            elif time.time() - last_progress > self.timeout:
+                log.error("Timeout expired - {} PGs remaining".format(pgs))
+                return
+            time.sleep(self.delay)
+
+
+def _batch(osd_list, **kwargs):
+    """
+    Remove or replace the emptied OSDs one by one as they become safe to
+    destroy
+    """
+    results = dict()
+    host_osds = OSDUtil._host_osds()
+    drain = Drain(osd_list, kwargs.get('retries', 60))
+    if kwargs.get('force', False):
+        all_osds = osd_dump()
+        safe = [(osd_id, all_osds) for osd_id in osd_list]
+        drain.remaining = []
+    else:
+        safe = drain.safe()
+    for osd_id, all_osds in safe:
+        osd_obj = OSDUtil(osd_id, host_osds=host_osds, osd_dump=all_osds,
+                          drained=True, **kwargs)
+        if kwargs['operation'] == 'replace':
+            _rc = osd_obj.replace()
+        else:
+            _rc = osd_obj.remove()
+        results[str(osd_id)] = {
+            'returncode': _rc,
+            'path': osd_obj.path_for_osd,
+            'model': osd_obj.model_for_osd
+        }
+    for osd_id in osd_list:
+        if str(osd_id) not in results:
+            results[str(osd_id)] = {'returncode': False, 'path': 'n/a', 'model': 'n/a'}
+    return results
+
+
 def ok_to_stop_osds(osd_list):
     """ Ask ceph is all given osds are ok-to-stop """
     cmd = "ceph osd ok-to-stop {}".format(osd_list)
@@ -495,6 +609,8 @@ def remove(*args, **kwargs):
         return False
     pre_check(osd_list, kwargs.get('force', False))
     osd_list = OSDUtil(*osd_list, **kwargs).vacate()
+    if kwargs.get('batch', False):
+        return _batch(osd_list, **kwargs)
     for osd_id in osd_list:
         osd_obj = OSDUtil(osd_id, **kwargs)
         _rc = osd_obj.remove()
@@ -517,6 +633,10 @@ def replace(*args, **kwargs):
         return False
     pre_check(osd_list, kwargs.get('force', False))
     osd_list = OSDUtil(*osd_list, **kwargs).vacate()
+    if kwargs.get('batch', False):
+        results = _batch(osd_list, **kwargs)
+        OSDUtil(*osd_list, **kwargs).restore_weights()
+        return results
     for osd_id in osd_list:
         osd_obj = OSDUtil(osd_id, **kwargs)
         _rc = osd_obj.replace()
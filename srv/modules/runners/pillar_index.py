@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=modernize-parse-error
+#
+# The salt-api calls functions with keywords that are not needed
+# pylint: disable=unused-argument
+"""
+Query the dependency index written by the PillarStack ext_pillar.
+
+For every minion, stack.py records the ordered list of files its pillar was
+built from and the stack files that were looked for but did not exist.  After
+editing a file under /srv/pillar/ceph/stack, only the minions depending on it
+need a pillar refresh.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import json
+import logging
+import os
+# pylint: disable=import-error,3rd-party-module-not-gated,redefined-builtin
+import salt.client
+
+log = logging.getLogger(__name__)
+
+STACK_DIR = '/srv/pillar/ceph/stack'
+INDEX_DIR = 'pillar_index'
+
+
+def help_():
+    """
+    Usage
+    """
+    usage = ('salt-run pillar_index.affected file=path:\n\n'
+             '    Returns the minions whose pillar depends on the file.\n'
+             '    Relative paths are relative to {}\n'
+             '\n\n'
+             'salt-run pillar_index.files minion=id:\n\n'
+             '    Returns the ordered list of files the pillar of a minion\n'
+             '    was built from\n'
+             '\n\n'
+             'salt-run pillar_index.refresh file=path:\n\n'
+             '    Refreshes the pillar of the minions depending on the file\n'
+             '\n\n'.format(STACK_DIR))
+    print(usage)
+    return ""
+
+
+class PillarIndex(object):
+    """
+    Read access to the per minion index files
+    """
+
+    def __init__(self, index_dir=None):
+        """
+        Default to the pillar_index directory in the master cachedir
+        """
+        if index_dir is None:
+            cachedir = __opts__.get('cachedir', '/var/cache/salt/master')
+            index_dir = os.path.join(cachedir, INDEX_DIR)
+        self.index_dir = index_dir
+
+    def minions(self):
+        """
+        Return the sorted list of indexed minions
+        """
+        if not os.path.isdir(self.index_dir):
+            return []
+        return sorted(entry[:-len('.json')] for entry in os.listdir(self.index_dir)
+                      if entry.endswith('.json'))
+
+    def entry(self, minion):
+        """
+        Return the recorded dependencies of a minion
+        """
+        filename = os.path.join(self.index_dir, "{}.json".format(minion))
+        try:
+            with open(filename, 'r') as index:
+                return json.load(index)
+        except (IOError, OSError, ValueError) as err:
+            log.warning("Cannot read pillar index {}: {}".format(filename, err))
+            return {'files': [], 'missing': []}
+
+    def affected(self, filename):
+        """
+        Return the minions which loaded the file or looked for it
+        """
+        filename = _normalize(filename)
+        result = []
+        for minion in self.minions():
+            entry = self.entry(minion)
+            paths = entry.get('files', []) + entry.get('missing', [])
+            if filename in [os.path.normpath(path) for path in paths]:
+                result.append(minion)
+        return result
+
+
+def _normalize(filename):
+    """
+    Resolve paths relative to the stack directory
+    """
+    return os.path.normpath(os.path.join(STACK_DIR, filename))
+
+
+def affected(**kwargs):
+    """
+    List the minions whose pillar depends on a file
+    """
+    if 'file' not in kwargs:
+        help_()
+        return ""
+    return PillarIndex().affected(kwargs['file'])
+
+
+def files(**kwargs):
+    """
+    List the files the pillar of a minion was built from
+    """
+    if 'minion' not in kwargs:
+        help_()
+        return ""
+    return PillarIndex().entry(kwargs['minion']).get('files', [])
+
+
+def refresh(**kwargs):
+    """
+    Refresh the pillar of the minions depending on a file
+    """
+    minions = affected(**kwargs)
+    if not minions:
+        return minions
+    local = salt.client.LocalClient()
+    return local.cmd(minions, 'saltutil.refresh_pillar', [], tgt_type="list")
+
+
+__func_alias__ = {
+                 'help_': 'help',
+                 }
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=modernize-parse-error
+#
+# The salt-api calls functions with keywords that are not needed
+# pylint: disable=unused-argument
+"""
+Render the PillarStack pillar of many minions ahead of a bulk refresh.
+
+The master compiles the pillar of one minion after another when a whole
+cluster refreshes.  prerender compiles the pillars of the targeted minions in
+a pool of processes instead and stages the PillarStack part of each result
+under the master cachedir.  The stack ext_pillar serves a staged result as
+long as it is recent and neither the minion's pillar, its grains nor any of
+the stack files it was built from changed.
+
+The first minion is rendered before the pool is started, so the workers
+inherit the parsed files common to all minions, such as global.yml and
+cluster.yml, from the runner process.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import logging
+import multiprocessing
+import time
+# pylint: disable=import-error,3rd-party-module-not-gated,redefined-builtin
+import salt.pillar
+import salt.utils.minions
+
+log = logging.getLogger(__name__)
+
+
+def help_():
+    """
+    Usage
+    """
+    usage = ('salt-run pillarstack.prerender:\n'
+             'salt-run pillarstack.prerender target=\'I@roles:storage\'\n'
+             'salt-run pillarstack.prerender minions=\'[a.ceph, b.ceph]\'\n\n'
+             '    Compiles the pillar of the minions in a pool of processes\n'
+             '    and stages the PillarStack results for the following\n'
+             '    saltutil.refresh_pillar.  Optionally, set processes.\n'
+             '\n\n')
+    print(usage)
+    return ""
+
+
+def _minions(target):
+    """
+    Return the minions matching a compound target
+    """
+    ckminions = salt.utils.minions.CkMinions(__opts__)
+    matched = ckminions.check_minions(target, tgt_type='compound')
+    if isinstance(matched, dict):
+        matched = matched.get('minions', [])
+    return sorted(matched)
+
+
+def _render(minion):
+    """
+    Compile the pillar of a minion with staging enabled.  Returns the minion
+    and an error message, if any.
+    """
+    opts = dict(__opts__)
+    opts['pillarstack_stage'] = True
+    try:
+        _, grains, _ = salt.utils.minions.get_minion_data(minion, opts)
+        if grains is None:
+            grains = {'fqdn': minion}
+        pillar = salt.pillar.Pillar(opts, grains, minion, 'base')
+        pillar.compile_pillar()
+    # pylint: disable=broad-except
+    except Exception as err:
+        log.error("Prerendering pillar of {} failed: {}".format(minion, err))
+        return minion, str(err)
+    return minion, None
+
+
+def prerender(target='*', minions=None, processes=None, **kwargs):
+    """
+    Stage the PillarStack pillar of the minions matching target, or of the
+    list of minions
+    """
+    start = time.time()
+    if minions is None:
+        minions = _minions(target)
+    elif not isinstance(minions, list):
+        minions = minions.split(',')
+    if not minions:
+        return {'staged': 0, 'failed': {}, 'seconds': 0}
+    processes = int(processes or multiprocessing.cpu_count())
+
+    results = [_render(minions[0])]
+    remaining = minions[1:]
+    if remaining:
+        try:
+            pool = multiprocessing.Pool(min(processes, len(remaining)))
+            try:
+                results.extend(pool.map(_render, remaining))
+            finally:
+                pool.close()
+                pool.join()
+        except AssertionError:
+            # Runners started by the master daemon may not fork children
+            log.warning("Cannot start process pool, rendering serially")
+            results.extend(_render(minion) for minion in remaining)
+
+    failed = dict((minion, error) for minion, error in results if error)
+    return {'staged': len(results) - len(failed),
+            'failed': failed,
+            'seconds': round(time.time() - start, 2)}
+
+
+__func_alias__ = {
+                 'help_': 'help',
+                 }
@@ -39,7 +39,9 @@ Customization:
     desired values in /srv/pillar/ceph/stack directory tree and likely
     unnecessary.  This will still work and may prove useful for some.
 
-All files are overwritten in the destination tree /srv/pillar/ceph/stack/default.sls
+The merged files are compared with the destination tree
+/srv/pillar/ceph/stack/default by content.  Only files that differ are
+rewritten and files no longer produced by the policy.cfg are removed.
 
 """
 
@@ -47,15 +49,15 @@ from __future__ import absolute_import
 from __future__ import print_function
 import os
 import errno
-import glob
+import hashlib
 import logging
 import re
-import shutil
 import sys
 import yaml
 sys.path.append('/srv/modules/pillar')
 # pylint: disable=import-error,3rd-party-module-not-gated,redefined-builtin,wrong-import-position
 from stack import _merge_dict
+import policy
 
 
 log = logging.getLogger(__name__)
@@ -75,15 +77,15 @@ def help_():
 def proposal(filename="/srv/pillar/ceph/proposals/policy.cfg", dryrun=False):
     """
     Read the passed filename, organize the files with common subdirectories
-    and output the merged contents into the pillar.
+    and output the merged contents into the pillar.  Returns the number of
+    written, unchanged and removed files.
     """
     if not os.path.isfile(filename):
         log.warning("{} is missing - nothing to push".format(filename))
         return True
     pillar_data = PillarData(dryrun)
     common = pillar_data.organize(filename)
-    pillar_data.output(common)
-    return True
+    return pillar_data.output(common)
 
 
 def organize(filename="/srv/pillar/ceph/proposals/policy.cfg"):
@@ -137,13 +139,16 @@ class PillarData(object):
         Write the merged YAML files to the correct locations,
         /srv/pillar/ceph/cluster and /srv/pillar/ceph/stack/default.
         """
-
-        self._clean()
-
+        counts = {'written': 0, 'unchanged': 0, 'removed': 0}
+        filenames = set()
         for pathname in common.keys():
             merged = _merge(pathname, common)
             filename = self.pillar_dir + "/" + pathname
-            self._default(filename, merged)
+            filenames.add(filename)
+            if self._default(filename, merged):
+                counts['written'] += 1
+            else:
+                counts['unchanged'] += 1
 
             if pathname.startswith("cluster"):
                 # Use the entire list of minions under cluster to populate
@@ -161,28 +166,54 @@ class PillarData(object):
                 custom = self.pillar_dir + "/" + default_path
                 self._custom(custom)
 
-    def _clean(self):
+        counts['removed'] = self._clean(filenames)
+        log.info("Pushed proposals: {written} written, {unchanged} unchanged, "
+                 "{removed} removed".format(**counts))
+        return counts
+
+    def _clean(self, filenames):
         """
-        Remove the stack/default tree to remove any leftover files from a
-        previous removal
+        Remove any leftover files from a previous removal in the
+        stack/default tree and the directories left empty.  Returns the
+        number of removed files.
         """
+        removed = 0
         stack_default = "{}/stack/default".format(self.pillar_dir)
-        if os.path.isdir(stack_default):
-            shutil.rmtree(stack_default)
+        for path_dir, _, files in os.walk(stack_default, topdown=False):
+            for name in files:
+                filename = os.path.join(path_dir, name)
+                if filename in filenames:
+                    continue
+                log.info("Removing {}".format(filename))
+                removed += 1
+                if not self.dryrun:
+                    os.remove(filename)
+            if not self.dryrun and not os.listdir(path_dir):
+                os.rmdir(path_dir)
+        return removed
 
     def _default(self, filename, merged):
         """
-        Output the merged contents to the default tree
+        Output the merged contents to the default tree unless the file
+        already has the same content.  Returns whether the file was written.
         """
+        content = yaml.dump(merged,
+                            Dumper=self.friendly_dumper,
+                            default_flow_style=False)
+        if _digest(filename) == hashlib.md5(content.encode('utf-8')).hexdigest():
+            log.debug("Unchanged {}".format(filename))
+            return False
         path_dir = os.path.dirname(filename)
         if not os.path.isdir(path_dir):
             _create_dirs(path_dir, self.pillar_dir)
         log.info("Writing {}".format(filename))
         if not self.dryrun:
-            with open(filename, "w") as yml:
-                yml.write(yaml.dump(merged,
-                          Dumper=self.friendly_dumper,
-                          default_flow_style=False))
+            # Replace atomically, readers never see a partial file
+            tmp = "{}/.{}.tmp".format(path_dir, os.path.basename(filename))
+            with open(tmp, "w") as yml:
+                yml.write(content)
+            os.rename(tmp, filename)
+        return True
 
     def _custom(self, custom):
         """
@@ -207,41 +238,34 @@ class PillarData(object):
 
     def organize(self, policy_filename):
         """
-        Associate all filenames with their common subdirectory.
+        Associate all filenames with their common subdirectory.  The
+        policy.cfg is compiled by the policy utility shared with validate.
         """
         common = {}
-        with open(policy_filename, "r") as policy:
-            for line in policy:
-                log.debug(line)
-                # strip comments from the end of the line
-                line = re.sub(r'\s+#.*$', '', line)
-                line = line.strip()
-                if line.startswith('#') or not line:
-                    log.debug("Ignoring '{}'".format(line))
+        compiled = policy.compile_policy(policy_filename, self.proposals_dir)
+        for entry in compiled.lines:
+            if entry.error:
+                log.error('''
+                ERROR: Mailformed {}: {}
+                {}
+                '''.format(policy_filename, entry.line, entry.error))
+            proposal_files = entry.files
+            if not proposal_files:
+                log.warning("{} matched no files".format(entry.line))
+            log.debug(entry.line)
+            log.debug(proposal_files)
+            for proposal_file in proposal_files:
+                if os.stat(proposal_file).st_size == 0:
+                    log.warning("Skipping empty file {}".format(proposal_file))
                     continue
-                try:
-                    proposal_files = _parse(self.proposals_dir + "/" + line)
-                except ValueError:
-                    log.exception('''
-                    ERROR: Mailformed {}: {}
-                    '''.format(policy_filename, line))
-                    proposal_files = []
-                if not proposal_files:
-                    log.warning("{} matched no files".format(line))
-                log.debug(line)
-                log.debug(proposal_files)
-                for proposal_file in proposal_files:
-                    if os.stat(proposal_file).st_size == 0:
-                        log.warning("Skipping empty file {}".format(proposal_file))
-                        continue
-                    if os.path.isfile(proposal_file):
-                        pathname = _shift_dir(proposal_file.replace(
-                                              self.proposals_dir, ""))
-                        if pathname not in common:
-                            common[pathname] = []
-                        common[pathname].append(proposal_file)
-                    else:
-                        log.warning("{} does not exist".format(proposal_file))
+                if os.path.isfile(proposal_file):
+                    pathname = _shift_dir(proposal_file.replace(
+                                          self.proposals_dir, ""))
+                    if pathname not in common:
+                        common[pathname] = []
+                    common[pathname].append(proposal_file)
+                else:
+                    log.warning("{} does not exist".format(proposal_file))
 
         # This should be in a conditional, but
         # getEffectiveLevel returns 1 no matter setting
@@ -268,6 +292,17 @@ def _examples(custom, yml):
         yml.write(text)
 
 
+def _digest(filename):
+    """
+    Return the md5 of a file or None if it cannot be read
+    """
+    try:
+        with open(filename, "rb") as content:
+            return hashlib.md5(content.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+
 def _merge(pathname, common):
     """
     Merge the files via stack.py
@@ -281,29 +316,6 @@ def _merge(pathname, common):
     return merged
 
 
-def _parse(line):
-    """
-    Return globbed files constrained by optional slices or regexes.
-    """
-    if " " in line:
-        parts = re.split(r'\s+', line)
-        files = sorted(glob.glob(parts[0]))
-        for optional in parts[1:]:
-            filter_type, value = optional.split('=')
-            if filter_type == "re":
-                regex = re.compile(value)
-                files = [m.group(0) for l in files for m in [regex.search(l)] if m]
-            elif filter_type == "slice":
-                # pylint: disable=eval-used
-                files = eval("files{}".format(value))
-            else:
-                log.warning("keyword {} unsupported".format(filter_type))
-
-    else:
-        files = glob.glob(line)
-    return files
-
-
 def _shift_dir(path):
     """
     Remove the leftmost directory, expects beginning /
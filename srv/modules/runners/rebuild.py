@@ -6,15 +6,26 @@ Runner to remove and deploy OSDs
 
 from __future__ import absolute_import
 from __future__ import print_function
+import json
 import logging
+import os
 import pprint
+import threading
 import time
 # pylint: disable=import-error,3rd-party-module-not-gated,redefined-builtin
 import salt.client
 import salt.runner
+from six.moves import queue
 
 log = logging.getLogger(__name__)
 
+# Seconds the master minion waits for active+clean per call
+QUIESCENT_DEADLINE = 300
+# Minimum seconds between calls
+QUIESCENT_INTERVAL = 6
+# Progress of the current rebuild, relative to the master cachedir
+STATE_FILE = "rebuild/state.json"
+
 
 def help_():
     """
@@ -27,6 +38,12 @@ def help_():
              '    Removes without emptying and deploys OSDs\n\n'
              'salt-run rebuild.nodes preserve_ids=True [TARGET...]:\n'
              '    Removes and deploys OSDs with the same IDs\n\n'
+             'salt-run rebuild.nodes parallel=N [failure_domain=rack] [TARGET...]:\n'
+             '    Empties up to N minions of different failure domains at\n'
+             '    once and deploys each while the next ones empty\n\n'
+             'salt-run rebuild.nodes restart=True [TARGET...]:\n'
+             '    Rebuilds all minions again instead of resuming an\n'
+             '    interrupted rebuild of the same minions\n\n'
              'salt-run rebuild.check [TARGET...]:\n'
              '    Checks available space\n\n'
              '\n\n'
@@ -36,6 +53,7 @@ def help_():
              '    salt-run rebuild.node data[12].ceph\n'
              '    salt-run rebuild.node I@roles:storage\n'
              '    salt-run rebuild.node data*.ceph storage*.ceph\n'
+             '    salt-run rebuild.nodes parallel=4 I@roles:storage\n'
              '\n')
     print(usage)
     return ""
@@ -53,6 +71,79 @@ def master_minion():
     return __salt_master__["master.minion"]()
 
 
+class RebuildState(object):
+    """
+    The minions a rebuild finished, kept across runs so that an interrupted
+    rebuild of the same minions resumes with the remaining ones
+    """
+
+    def __init__(self, minions, filename=None):
+        if filename is None:
+            filename = os.path.join(
+                __opts__.get('cachedir', '/var/cache/salt/master'), STATE_FILE)
+        self.filename = filename
+        self.minions = sorted(minions)
+        self.done = []
+        try:
+            with open(self.filename, 'r') as state:
+                saved = json.load(state)
+        except (IOError, OSError, ValueError):
+            saved = {}
+        if saved.get('minions') == self.minions:
+            self.done = saved.get('done', [])
+
+    def finished(self, minion):
+        """
+        Return whether a previous run rebuilt the minion
+        """
+        return minion in self.done
+
+    def finish(self, minion):
+        """
+        Record a rebuilt minion
+        """
+        self.done.append(minion)
+        directory = os.path.dirname(self.filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = "{}.{}".format(self.filename, os.getpid())
+        with open(tmp, 'w') as state:
+            json.dump({'minions': self.minions, 'done': self.done}, state)
+        os.rename(tmp, self.filename)
+
+    def clear(self):
+        """
+        Forget the progress once all minions are rebuilt or on request
+        """
+        self.done = []
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+def failure_domains(tree, domain_type):
+    """
+    Return the failure domain of every host in the osd tree.  A host without
+    an ancestor of domain_type is its own failure domain.
+    """
+    nodes = dict((node['id'], node) for node in tree['nodes'])
+    parents = {}
+    for node in tree['nodes']:
+        for child in node.get('children', []):
+            parents[child] = node['id']
+    domains = {}
+    for node in tree['nodes']:
+        if node['type'] != 'host':
+            continue
+        ancestor = parents.get(node['id'])
+        while ancestor is not None and nodes[ancestor]['type'] != domain_type:
+            ancestor = parents.get(ancestor)
+        if ancestor is None:
+            domains[node['name']] = node['name']
+        else:
+            domains[node['name']] = nodes[ancestor]['name']
+    return domains
+
+
 # pylint: disable=too-many-instance-attributes
 class Rebuild(object):
     """ Removes and deploys OSDs for a list of minions  """
@@ -66,8 +157,16 @@ class Rebuild(object):
         __master_opts__['quiet'] = True
         self.qrunner = salt.runner.RunnerClient(__master_opts__)
         self.minions = self._minions(*args)
+        self.parallel = int(kwargs.pop('parallel', 1))
+        self.failure_domain = kwargs.pop('failure_domain', 'rack')
+        self.state = RebuildState(self.minions)
+        if kwargs.pop('restart', False):
+            self.state.clear()
         self.kwargs = kwargs
         self.skipped = []
+        if self.parallel > 1 and kwargs.get('force'):
+            log.warning("Forced removals do not empty OSDs... rebuilding one minion at a time")
+            self.parallel = 1
         if 'preserve_ids' in kwargs and kwargs['preserve_ids']:
             self.operation = 'osd.replace'
         else:
@@ -129,18 +228,22 @@ class Rebuild(object):
         return True
 
     def _busy_wait(self):
-        """ Wait until OSDs are safe to stop """
-        delay = 3
+        """
+        Wait until OSDs are safe to stop.  The master minion polls the PGs
+        and returns as soon as they are active+clean or the deadline passes.
+        """
         while True:
+            start = time.time()
             quiescent = self.local.cmd(self.master_minion,
-                                       'osd.ceph_quiescent', [], tgt_type="compound")
+                                       'osd.ceph_quiescent', [],
+                                       kwarg={'deadline': QUIESCENT_DEADLINE},
+                                       tgt_type="compound")
             log.debug("quiescent: {}".format(quiescent))
             if self.master_minion in quiescent and quiescent[self.master_minion] is True:
                 break
             print("Waiting for PGs to recover...")
-            time.sleep(delay)
-            if delay < 60:
-                delay += 3
+            # Do not hammer the master minion when it answers immediately
+            time.sleep(max(0, QUIESCENT_INTERVAL - (time.time() - start)))
 
     def _disengaged(self):
         """ Return safety setting"""
@@ -170,6 +273,120 @@ class Rebuild(object):
                   "\n\nResolve any issues and run\n",
                   "salt-run rebuild.nodes {}".format(" ".join(self.skipped)))
 
+    def _domains(self):
+        """
+        Return the failure domain of each minion.  Minions missing from the
+        osd tree are their own failure domain.
+        """
+        tree = self.local.cmd(self.master_minion, 'osd.tree_from_master', [],
+                              tgt_type="compound")
+        domains = {}
+        if self.master_minion in tree and 'nodes' in tree[self.master_minion]:
+            domains = failure_domains(tree[self.master_minion], self.failure_domain)
+        else:
+            log.error("salt {} osd.tree_from_master failed".format(self.master_minion))
+        result = {}
+        for minion in self.minions:
+            result[minion] = domains.get(minion, domains.get(minion.split('.')[0], minion))
+        log.info("failure domains: {}".format(result))
+        return result
+
+    @staticmethod
+    def _start(events, stage, minion, fun, *args, **kwargs):
+        """
+        Run a runner in the background, reporting the result as an event
+        """
+        def _call():
+            """ Put the return, None on an exception """
+            try:
+                # RunnerClient is not safe to share between threads
+                ret = salt.runner.RunnerClient(__opts__).cmd(fun, *args, **kwargs)
+            # pylint: disable=broad-except
+            except Exception as error:
+                log.error("{} on {} failed: {}".format(fun, minion, error))
+                ret = None
+            events.put((stage, minion, ret))
+
+        thread = threading.Thread(target=_call)
+        thread.daemon = True
+        thread.start()
+
+    def _deployed(self, deploy_ret, minion):
+        """ Check the deployment and record a successful rebuild """
+        if deploy_ret is None:
+            self.skipped.append(minion)
+            return
+        self._check_deploy(deploy_ret, minion)
+        if minion not in self.skipped:
+            self.state.finish(minion)
+
+    def _pending(self):
+        """ Return the minions a previous run did not finish """
+        pending = []
+        for minion in self.minions:
+            if self.state.finished(minion):
+                print("Skipping minion {} rebuilt by a previous run".format(minion))
+            else:
+                pending.append(minion)
+        return pending
+
+    # pylint: disable=too-many-branches
+    def _run_parallel(self):
+        """
+        Empty up to self.parallel minions at once, each in another failure
+        domain, and deploy a minion as soon as it is empty.  The capacity
+        check covers the OSDs of all minions still emptying.  The cluster
+        must be active+clean only while nothing is in flight.
+        """
+        domains = self._domains()
+        pending = self._pending()
+        events = queue.Queue()
+        emptying = {}
+        deploying = set()
+        while pending or emptying or deploying:
+            for minion in list(pending):
+                if len(emptying) >= self.parallel:
+                    break
+                if domains[minion] in [domains[busy] for busy in emptying]:
+                    continue
+                log.info("Processing minion: {}".format(minion))
+                osds = self._osd_list(minion)
+                if not osds:
+                    pending.remove(minion)
+                    deploying.add(minion)
+                    self._start(events, 'deployed', minion, 'disks.deploy',
+                                kwarg={'target': minion})
+                    continue
+                log.info("osds for {}: {}".format(osds, minion))
+                inflight = [osd for busy in emptying.values() for osd in busy]
+                if not self.safe(list(osds) + inflight):
+                    if not emptying and not deploying:
+                        log.critical("Aborting...")
+                        return ""
+                    # Wait until the minions in flight free their space
+                    break
+                if not emptying and not deploying:
+                    self._busy_wait()
+                pending.remove(minion)
+                emptying[minion] = list(osds)
+                self._start(events, 'removed', minion, self.operation, osds,
+                            kwarg=self.kwargs)
+
+            stage, minion, ret = events.get()
+            if stage == 'removed':
+                del emptying[minion]
+                log.info("osd_ret: {}".format(ret))
+                if ret is None:
+                    self.skipped.append(minion)
+                elif not self._check_failed(ret, minion):
+                    deploying.add(minion)
+                    self._start(events, 'deployed', minion, 'disks.deploy',
+                                kwarg={'target': minion})
+            else:
+                deploying.discard(minion)
+                self._deployed(ret, minion)
+        return ""
+
     def run(self, checkonly=False):
         """
         For each minion
@@ -177,12 +394,22 @@ class Rebuild(object):
            Verify that the storage minion is safe to rebuild
            Remove the OSDs
            Deploy the minion
+
+        Minions finished by an interrupted run of the same minions are
+        skipped.  With parallel, several minions are processed at once.
         """
         if not self._disengaged() and not checkonly:
             log.error('Safety engaged...run "salt-run disengage.safety"')
             return ""
 
-        for minion in self.minions:
+        if self.parallel > 1 and not checkonly:
+            self._run_parallel()
+            if not self.skipped and len(self.state.done) == len(self.minions):
+                self.state.clear()
+            self._skipped_summary()
+            return ""
+
+        for minion in (self.minions if checkonly else self._pending()):
             log.info("Processing minion: {}".format(minion))
             osds = self._osd_list(minion)
             if osds:
@@ -200,8 +427,12 @@ class Rebuild(object):
                 if self._check_failed(osd_ret, minion):
                     continue
 
+            if checkonly:
+                continue
             deploy_ret = self.runner.cmd('disks.deploy', kwarg={'target': minion})
-            self._check_deploy(deploy_ret, minion)
+            self._deployed(deploy_ret, minion)
+        if not checkonly and not self.skipped:
+            self.state.clear()
         self._skipped_summary()
         return ""
 
@@ -19,11 +19,14 @@ import logging
 import ipaddress
 import socket
 import json
+import copy
 import os
 from os.path import dirname
 import re
 import sys
 import glob
+import threading
+import time
 from subprocess import Popen, PIPE
 from collections import OrderedDict
 from distutils.version import LooseVersion  # pylint: disable=no-name-in-module,import-error,blacklisted-module,3rd-party-module-not-gated
@@ -34,7 +37,9 @@ import salt.utils
 import salt.utils.minions
 import salt.utils.error
 from configobj import ConfigObj
+from six.moves import queue
 # pylint: disable=relative-import
+import policy
 
 
 log = logging.getLogger(__name__)
@@ -236,8 +241,7 @@ class Validate(Preparation):
         if not skip_init:
             super(Validate, self).__init__()
         self.name = name
-        self.data = self.__get_items(search_pillar, 'pillar')
-        self.grains = self.__get_items(search_grains, 'grains')
+        self.data, self.grains = self.__get_items(search_pillar, search_grains)
         self.printer = printer
         self.in_dev_env = self.__dev_env()
         self.skipped = OrderedDict()
@@ -252,15 +256,30 @@ class Validate(Preparation):
         self.package = 'ceph-common'
         self.uninstalled = []
 
-    def __get_items(self, enabled, target):
+    def __get_items(self, search_pillar, search_grains):
         """
-        Look up [pillar|grains].items
+        Look up pillar.items and grains.items, both in a single call when
+        both are needed
         """
-        if enabled:
-            items = self.local.cmd(self.search, target + '.items',
-                                   [], tgt_type="compound")
-            return items
-        return None
+        if search_pillar and search_grains:
+            results = self.local.cmd(self.search, ['pillar.items', 'grains.items'],
+                                     [[], []], tgt_type="compound")
+            data = {}
+            grains = {}
+            for minion, result in results.items():
+                if isinstance(result, dict):
+                    data[minion] = result.get('pillar.items')
+                    grains[minion] = result.get('grains.items')
+                else:
+                    data[minion] = grains[minion] = result
+            return data, grains
+        if search_pillar:
+            return self.local.cmd(self.search, 'pillar.items',
+                                  [], tgt_type="compound"), None
+        if search_grains:
+            return None, self.local.cmd(self.search, 'grains.items',
+                                        [], tgt_type="compound")
+        return None, None
 
     def __dev_env(self):
         """
@@ -373,7 +392,7 @@ class Validate(Preparation):
             found = False
             public_network = self.data[node].get("public_network", "")
             net_list = Util.parse_list_from_string(public_network)
-            addresses = self.grains[node]['ipv4']
+            addresses = list(self.grains[node]['ipv4'])
             if 'ipv6' in self.grains[node]:
                 addresses += self.grains[node]['ipv6']
             for address in addresses:
@@ -464,23 +483,13 @@ class Validate(Preparation):
         -> storage() and storage_role() should be combined
         in the future. todo!
         """
-        policy_file = '/srv/pillar/ceph/proposals/policy.cfg'
-        present = False
-        with open(policy_file, "r") as policy:
-            for line in policy:
-                # strip comments from the end of the line
-                line = re.sub(r'\s+#.*$', '', line)
-                line = line.rstrip()
-                if line.startswith('#') or not line:
-                    log.debug("Ignoring '{}'".format(line))
-                    continue
-                if line.startswith('role-storage'):
-                    present = True
-                    self.passed['storage_role'] = "valid"
-            if not present:
-                self.errors['storage_role'] = [
-                    "You have to define a role-storage in your policy.cfg"
-                ]
+        compiled = policy.compile_policy()
+        if any(entry.line.startswith('role-storage') for entry in compiled.lines):
+            self.passed['storage_role'] = "valid"
+        else:
+            self.errors['storage_role'] = [
+                "You have to define a role-storage in your policy.cfg"
+            ]
 
     def rgw(self):
         """
@@ -829,8 +838,13 @@ class Validate(Preparation):
         Check for installed Ceph packages.  The query is faster and a fresh
         install only happens once.
         """
-        search = __utils__['deepsea_minions.show']()
-        results = self._silent_search(search, 'deepsea.is_pkg_installed')
+        # Target the minions matched in advance.  Salt prints to stdout when
+        # a search matches no minions, and stdout is shared by the checks.
+        if not self.matches:
+            return
+        search = "L@{}".format(",".join(self.matches))
+        results = self.local.cmd(search, 'deepsea.is_pkg_installed', [self.package],
+                                 tgt_type="compound")
 
         for minion in results:
             if isinstance(results[minion], dict) and self.package in results[minion]:
@@ -856,7 +870,8 @@ class Validate(Preparation):
             return
 
         search = "L@{}".format(",".join(self.uninstalled))
-        results = self._silent_search(search, 'pkg.info_available')
+        results = self.local.cmd(search, 'pkg.info_available', [self.package],
+                                 tgt_type="compound")
         for minion in results:
             if isinstance(results[minion], dict) and self.package in results[minion]:
                 if 'version' in results[minion][self.package]:
@@ -873,17 +888,6 @@ class Validate(Preparation):
                 prefix = 'Ceph repository is missing from'
                 self.errors.setdefault('ceph_version', [prefix]).append(minion)
 
-    def _silent_search(self, search, func):
-        """
-        Search that matches no minions prints to stdout confusing users when
-        mixed with the normal messages.  Suppress stdout.
-        """
-        _stdout = sys.stdout
-        sys.stdout = open(os.devnull, 'w')
-        results = self.local.cmd(search, func, [self.package], tgt_type="compound")
-        sys.stdout = _stdout
-        return results
-
     def _check_version(self, minion, func, version):
         """
         Version may be an error message
@@ -918,26 +922,19 @@ class Validate(Preparation):
         Process policy file skipping comments, unmatched lines
         """
         accumulated_files = []
-        proposals_dir = "/srv/pillar/ceph/proposals"
-
-        with open(policy_file, "r") as policy:
-            for line in policy:
-                # strip comments from the end of the line
-                line = re.sub(r'\s+#.*$', '', line)
-                line = line.rstrip()
-                if line.startswith('#') or not line:
-                    log.debug("Ignoring '{}'".format(line))
+        compiled = policy.compile_policy(policy_file)
+        for entry in compiled.lines:
+            if entry.error:
+                log.error("Malformed {}: {}".format(entry.line, entry.error))
+            if not entry.files:
+                log.warning("{} matched no files".format(entry.line))
+            log.debug(entry.line)
+            log.debug(entry.files)
+            for proposal_file in entry.files:
+                if os.stat(proposal_file).st_size == 0:
+                    log.warning("Skipping empty file {}".format(proposal_file))
                     continue
-                proposal_files = self._parse(proposals_dir + "/" + line)
-                if not proposal_files:
-                    log.warning("{} matched no files".format(line))
-                log.debug(line)
-                log.debug(proposal_files)
-                for proposal_file in proposal_files:
-                    if os.stat(proposal_file).st_size == 0:
-                        log.warning("Skipping empty file {}".format(proposal_file))
-                        continue
-                    accumulated_files.append(proposal_file)
+                accumulated_files.append(proposal_file)
         return accumulated_files
 
     def _stack_files(self, stack_dir, filetype='yml'):
@@ -979,29 +976,6 @@ class Validate(Preparation):
                     self.errors.setdefault('yaml_syntax', []).append(message)
         self._set_pass_status('yaml_syntax')
 
-    def _parse(self, line):
-        """
-        Return globbed files constrained by optional slices or regexes.
-        """
-        if " " in line:
-            parts = re.split(r'\s+', line)
-            files = sorted(glob.glob(parts[0]))
-            for keyvalue in parts[1:]:
-                key, value = keyvalue.split('=')
-                if key == "re":
-                    regex = re.compile(value)
-                    files = [match.group(0) for _file in files
-                             for match in [regex.search(_file)] if match]
-                elif key == "slice":
-                    # pylint: disable=eval-used
-                    files = eval("files{}".format(value))
-                else:
-                    log.warning("keyword {} unsupported".format(key))
-
-        else:
-            files = glob.glob(line)
-        return files
-
     def deepsea_minions(self):
         """
         Verify deepsea_minions is set
@@ -1157,6 +1131,179 @@ class Validate(Preparation):
         self.printer.print_result()
 
 
+CHECK_TIMEOUT = 120
+CHECK_WORKERS = 8
+# Seconds between looking for finished and overdue checks
+CHECK_POLL = 0.05
+
+# Checks needing the results of all others; they run once those have finished
+LATE_CHECKS = ['check_ipversion']
+
+
+class _Job(object):
+    """
+    A check queued for a worker.  start is set when a worker picks it up.
+    """
+
+    def __init__(self, check, clone):
+        self.check = check
+        self.clone = clone
+        self.start = None
+        self.seconds = None
+        self.error = None
+        self.abandoned = False
+        self.done = threading.Event()
+
+
+class CheckExecutor(object):
+    """
+    Run the checks of a Validate instance concurrently.  Every check runs on
+    a copy of the instance with its own results, which are merged back in the
+    order the checks were given.  The report is the same as when running the
+    checks one after another.
+    """
+
+    def __init__(self, valid, timeout=CHECK_TIMEOUT, workers=CHECK_WORKERS):
+        self.valid = valid
+        self.timeout = float(timeout)
+        self.workers = int(workers)
+        self.timings = OrderedDict()
+        self.threads = threading.local()
+
+    def _isolated(self):
+        """
+        Return a copy sharing the pillar and grains but not the results
+        """
+        clone = copy.copy(self.valid)
+        clone.skipped = OrderedDict()
+        clone.passed = OrderedDict()
+        clone.errors = OrderedDict()
+        clone.warnings = OrderedDict()
+        clone.ipversion = set(self.valid.ipversion)
+        clone.uninstalled = []
+        return clone
+
+    def _run(self, clone, check):
+        """
+        Return the wall time of a check
+        """
+        start = time.time()
+        if hasattr(self.valid, 'local'):
+            # LocalClient is not safe to share between threads
+            if not hasattr(self.threads, 'local'):
+                self.threads.local = salt.client.LocalClient()
+            clone.local = self.threads.local
+        getattr(clone, check)()
+        return time.time() - start
+
+    def _worker(self, jobs):
+        """
+        Run queued checks until none are left.  A worker whose check was
+        abandoned stops once the check returns, since a replacement took its
+        place.
+        """
+        while True:
+            try:
+                job = jobs.get_nowait()
+            except queue.Empty:
+                return
+            job.start = time.time()
+            try:
+                job.seconds = self._run(job.clone, job.check)
+            # pylint: disable=broad-except
+            except Exception as err:
+                job.error = err
+            job.done.set()
+            if job.abandoned:
+                return
+
+    def _spawn(self, jobs):
+        """
+        Start a worker thread
+        """
+        thread = threading.Thread(target=self._worker, args=(jobs,))
+        thread.daemon = True
+        thread.start()
+
+    def _merge(self, clone):
+        """
+        Add the results of a check
+        """
+        for attr in ['skipped', 'passed', 'errors', 'warnings']:
+            results = getattr(self.valid, attr)
+            for key, value in getattr(clone, attr).items():
+                if isinstance(results.get(key), list) and isinstance(value, list):
+                    results[key].extend(value)
+                else:
+                    results[key] = value
+        self.valid.uninstalled.extend(clone.uninstalled)
+
+    def _stage(self, stage, outcome):
+        """
+        Run the checks of a stage, each limited to timeout seconds from the
+        moment a worker picks it up.  The outcome of a check is either its
+        copy or an error message.  The copy of a check that timed out is
+        dropped, so the thread still running it touches nothing shared.
+        """
+        jobs = queue.Queue()
+        timings = {}
+        pending = []
+        for check in stage:
+            job = _Job(check, self._isolated())
+            jobs.put(job)
+            pending.append(job)
+        for _ in range(min(self.workers, len(stage))):
+            self._spawn(jobs)
+        while pending:
+            for job in list(pending):
+                if job.done.is_set():
+                    pending.remove(job)
+                    if job.error is not None:
+                        timings[job.check] = time.time() - job.start
+                        outcome[job.check] = "{} failed: {}".format(job.check, job.error)
+                        continue
+                    timings[job.check] = job.seconds
+                    outcome[job.check] = job.clone
+                    # Later stages see the networks found so far
+                    self.valid.ipversion.update(job.clone.ipversion)
+                elif job.start is not None and time.time() - job.start > self.timeout:
+                    pending.remove(job)
+                    job.abandoned = True
+                    timings[job.check] = time.time() - job.start
+                    outcome[job.check] = "{} did not finish within {} seconds".format(
+                        job.check, self.timeout)
+                    # The worker is stuck, let another take the queued checks
+                    self._spawn(jobs)
+            if pending:
+                pending[0].done.wait(CHECK_POLL)
+        for check in stage:
+            self.timings[check] = timings[check]
+            log.info("VALIDATE TIMING  {:25}: {:.2f}s".format(check, timings[check]))
+
+    def run(self, checks):
+        """
+        Run the checks on at most workers threads.  Checks in LATE_CHECKS
+        start after the others have finished.
+        """
+        outcome = {}
+        for stage in [[check for check in checks if check not in LATE_CHECKS],
+                      [check for check in checks if check in LATE_CHECKS]]:
+            if stage:
+                self._stage(stage, outcome)
+        for check in checks:
+            if isinstance(outcome[check], str):
+                self.valid.errors.setdefault(check, []).append(outcome[check])
+            else:
+                self._merge(outcome[check])
+
+    def print_timings(self):
+        """
+        Print the wall time of every check, slowest first
+        """
+        for check, seconds in sorted(self.timings.items(), key=lambda item: -item[1]):
+            print("{:25}: {:.2f}s".format(check, seconds))
+
+
 class ConfigCheck(object):
     """Class to detect deprecated config values in files.
 
@@ -1312,6 +1459,11 @@ def help_():
               'salt-run validate.setup:\n\n'
               '    Verify that Stage 0/prep will succeed\n'
               '\n\n'
+              'salt-run validate.pillar cluster=ceph timings=True timeout=60:\n\n'
+              '    The checks of validate.pillar and validate.setup run\n'
+              '    concurrently.  Print the time of each check and limit\n'
+              '    each check to timeout seconds (default 120)\n'
+              '\n\n'
               'salt-run validate.prep:\n\n'
               '    Verify that Stage 1/discovery will succeed\n'
               '\n\n'
@@ -1419,26 +1571,15 @@ def pillar(cluster=None, printer=None, **kwargs):
     printer = get_printer(**kwargs)
     valid = Validate(cluster, search_pillar=True, search_grains=True,
                      printer=printer, search=search)
-    valid.dev_env()
-    valid.fsid()
-    valid.public_network()
-    valid.public_interface()
-    valid.cluster_network()
-    valid.cluster_interface()
-    valid.check_ipversion()
-    valid.monitors()
-    valid.subvolume()
-    valid.mgrs()
-    valid.storage()
-    valid.storage_role()
-    valid.rgw()
-    valid.ganesha()
-    valid.master_role()
-    valid.osd_creation()
-    valid.pool_creation()
-    valid.time_server()
-    valid.fqdn()
+    executor = CheckExecutor(valid, timeout=kwargs.get('timeout', CHECK_TIMEOUT))
+    executor.run(['dev_env', 'fsid', 'public_network', 'public_interface',
+                  'cluster_network', 'cluster_interface', 'check_ipversion', 'monitors',
+                  'subvolume', 'mgrs', 'storage', 'storage_role', 'rgw',
+                  'ganesha', 'master_role', 'osd_creation', 'pool_creation',
+                  'time_server', 'fqdn'])
     valid.report()
+    if kwargs.get('timings', False):
+        executor.print_timings()
 
     if valid.errors:
         __context__['retcode'] = 1
@@ -1507,15 +1648,13 @@ def setup(**kwargs):
         valid.report()
         return True
     valid = Validate("setup", search_pillar=True, printer=printer)
-    valid.unresolved()
-    valid.deepsea_minions()
-    valid.master_minion()
-    valid.ceph_version()
-    valid.openattic()
-    valid.salt_version()
-    valid.ceph_updates()
-    valid.salt_updates()
+    executor = CheckExecutor(valid, timeout=kwargs.get('timeout', CHECK_TIMEOUT))
+    executor.run(['unresolved', 'deepsea_minions', 'master_minion',
+                  'ceph_version', 'openattic', 'salt_version', 'ceph_updates',
+                  'salt_updates'])
     valid.report()
+    if kwargs.get('timings', False):
+        executor.print_timings()
 
     if valid.errors:
         return False
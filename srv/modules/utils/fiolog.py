@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=too-few-public-methods,modernize-parse-error
+"""
+Summarize the bandwidth, iops and latency logs fio writes per client.
+
+The logs are streamed line by line and no sample is kept, so that logs of
+several GB can be summarized in little memory.  Throughput samples are
+summed per time window.  Latency samples are counted in the bins fio uses
+for its latency histograms, per window, so latency percentiles are exact to
+the width of a bin, about 1.6%, and the bins of windows and clients merge
+by adding counts.  For every client and for all clients together, the
+summary holds percentiles of the throughput per window, percentiles of the
+latency over all samples and per window, and the periods in which a client
+stalled.
+
+Log lines are
+
+    time (msec), value, direction, block size[, offset[, priority]]
+
+and histogram log lines are
+
+    time (msec), direction, block size, bin 0, bin 1, ...
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+import array
+import logging
+import math
+import os
+import re
+# pylint: disable=relative-import
+from stats import percentile
+
+log = logging.getLogger(__name__)
+
+WINDOW_MS = 1000
+# Throughput below this fraction of the median window is a stall
+STALL_RATIO = 0.1
+
+DIRECTIONS = {0: 'read', 1: 'write', 2: 'trim'}
+THROUGHPUT = ['bw', 'iops']
+
+# <prefix>_<kind>.<job>.log[.<client>]
+_LOGNAME = re.compile(r'^.+?_(bw|iops|lat|clat|slat|clat_hist)\.(\d+)\.log(?:\.(.+))?$')
+
+# The layout of fio's latency histogram bins, see plat_idx_to_val in stat.c
+PLAT_BITS = 6
+PLAT_VAL = 1 << PLAT_BITS
+PLAT_GROUP_NR = 29
+PLAT_NR = PLAT_GROUP_NR * PLAT_VAL
+
+
+def _parse(path):
+    """
+    Yield the time, value and direction of every sample of a bandwidth,
+    iops or latency log
+    """
+    with open(path, 'rb') as log_file:
+        for line in log_file:
+            fields = line.split(b',', 3)
+            if len(fields) < 3:
+                continue
+            try:
+                yield int(fields[0]), float(fields[1]), int(fields[2])
+            except ValueError:
+                log.debug("Skipping line {!r} of {}".format(line, path))
+
+
+def bin_value(index):
+    """
+    Return the latency in nsec in the middle of a histogram bin
+    """
+    if index < (PLAT_VAL << 1):
+        return float(index)
+    error_bits = (index >> PLAT_BITS) - 1
+    base = 1 << (error_bits + PLAT_BITS)
+    return base + ((index % PLAT_VAL) + 0.5) * (1 << error_bits)
+
+
+def bin_index(value):
+    """
+    Return the histogram bin of a latency in nsec, see plat_val_to_idx in
+    stat.c
+    """
+    value = max(int(value), 0)
+    msb = value.bit_length() - 1 if value else 0
+    if msb <= PLAT_BITS:
+        return value
+    error_bits = msb - PLAT_BITS
+    base = (error_bits + 1) << PLAT_BITS
+    offset = (PLAT_VAL - 1) & (value >> error_bits)
+    return min(base + offset, PLAT_NR - 1)
+
+
+class LatencyBins(object):
+    """
+    The count of latencies per histogram bin with their exact minimum,
+    maximum and sum
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """
+        Count a latency
+        """
+        index = bin_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """
+        Add the counts of other bins
+        """
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, percent):
+        """
+        Return the nearest rank percentile, bounded by the exact minimum and
+        maximum
+        """
+        if not self.total:
+            return None
+        rank = max(int(math.ceil(percent / 100.0 * self.total)), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(max(bin_value(index), self.min), self.max)
+        return self.max
+
+    def distribution(self):
+        """
+        Return the usual percentiles
+        """
+        return {'min': self.min,
+                'p50': self.percentile(50),
+                'p99': self.percentile(99),
+                'max': self.max,
+                'mean': self.sum / self.total if self.total else None}
+
+
+def read_hist(path, window_ms=WINDOW_MS):
+    """
+    Return the summed bin counts of a histogram log per direction and
+    window
+    """
+    windows = {}
+    with open(path, 'rb') as log_file:
+        for line in log_file:
+            fields = line.split(b',')
+            if len(fields) < 4:
+                continue
+            try:
+                key = (DIRECTIONS.get(int(fields[1]), fields[1].strip()),
+                       int(fields[0]) // window_ms)
+                counts = array.array('L', (int(count) for count in fields[3:]))
+            except ValueError:
+                log.debug("Skipping line {!r} of {}".format(line, path))
+                continue
+            if key in windows:
+                total = windows[key]
+                for index, count in enumerate(counts):
+                    total[index] += count
+            else:
+                windows[key] = counts
+    return windows
+
+
+def hist_percentile(counts, percent):
+    """
+    Return the nearest rank percentile of histogram bin counts
+    """
+    total = sum(counts)
+    if not total:
+        return None
+    rank = max(int(math.ceil(percent / 100.0 * total)), 1)
+    seen = 0
+    for index, count in enumerate(counts):
+        seen += count
+        if seen >= rank:
+            return bin_value(index)
+    return bin_value(len(counts) - 1)
+
+
+def _distribution(values):
+    """
+    Return the usual percentiles of values
+    """
+    ordered = sorted(values)
+    return {'min': ordered[0] if ordered else None,
+            'p50': percentile(ordered, 50),
+            'p99': percentile(ordered, 99),
+            'max': ordered[-1] if ordered else None,
+            'mean': sum(ordered) / len(ordered) if ordered else None}
+
+
+def _stalls(series, window_ms, ratio):
+    """
+    Return the [start, end] msec of consecutive windows with throughput
+    below ratio times the median window, including windows without samples
+    """
+    if not series:
+        return []
+    first, last = min(series), max(series)
+    limit = ratio * percentile(sorted(series.values()), 50)
+    periods = []
+    for window in range(first, last + 1):
+        if series.get(window, 0) <= limit:
+            if periods and periods[-1][1] == window * window_ms:
+                periods[-1][1] = (window + 1) * window_ms
+            else:
+                periods.append([window * window_ms, (window + 1) * window_ms])
+    return periods
+
+
+class Summary(object):
+    """
+    Collect the logs of a job and summarize them
+    """
+
+    def __init__(self, window_ms=WINDOW_MS, stall_ratio=STALL_RATIO):
+        self.window_ms = window_ms
+        self.stall_ratio = stall_ratio
+        # kind -> direction -> client -> window -> throughput
+        self.throughput = {}
+        # kind -> direction -> client -> window -> LatencyBins
+        self.latency = {}
+        # direction -> client -> window -> bin counts
+        self.hist = {}
+
+    def add(self, path, kind, client):
+        """
+        Read a log of a client
+        """
+        log.debug("Reading {} log {} of {}".format(kind, path, client))
+        if kind == 'clat_hist':
+            for (direction, window), counts in read_hist(path, self.window_ms).items():
+                windows = self.hist.setdefault(direction, {}).setdefault(client, {})
+                if window in windows:
+                    for index, count in enumerate(counts):
+                        windows[window][index] += count
+                else:
+                    windows[window] = counts
+            return
+        if kind in THROUGHPUT:
+            # window -> [sum, count] per direction
+            windows = {}
+            for time_ms, value, ddir in _parse(path):
+                entry = windows.setdefault(ddir, {}).setdefault(time_ms // self.window_ms,
+                                                               [0.0, 0])
+                entry[0] += value
+                entry[1] += 1
+            for ddir, series in windows.items():
+                direction = DIRECTIONS.get(ddir, str(ddir))
+                merged = self.throughput.setdefault(kind, {}).setdefault(
+                    direction, {}).setdefault(client, {})
+                for window, (total, count) in series.items():
+                    # Several jobs of a client add up
+                    merged[window] = merged.get(window, 0) + total / count
+            return
+        for time_ms, value, ddir in _parse(path):
+            direction = DIRECTIONS.get(ddir, str(ddir))
+            windows = self.latency.setdefault(kind, {}).setdefault(
+                direction, {}).setdefault(client, {})
+            window = time_ms // self.window_ms
+            if window not in windows:
+                windows[window] = LatencyBins()
+            windows[window].add(value)
+
+    def _throughput(self, clients):
+        """
+        Summarize the throughput per window of each client and of all
+        """
+        result = {'clients': {}, 'stalls': {}}
+        total = {}
+        for client, series in sorted(clients.items()):
+            result['clients'][client] = _distribution(list(series.values()))
+            result['stalls'][client] = _stalls(series, self.window_ms, self.stall_ratio)
+            for window, value in series.items():
+                total[window] = total.get(window, 0) + value
+        result['all'] = _distribution(list(total.values()))
+        result['stalls']['all'] = _stalls(total, self.window_ms, self.stall_ratio)
+        return result
+
+    @staticmethod
+    def _latency(clients):
+        """
+        Summarize the latency of each client and of all, overall and as the
+        worst p99 of a window
+        """
+        result = {'clients': {}}
+        merged = {}
+        for client, windows in sorted(clients.items()):
+            total = LatencyBins()
+            worst = None
+            for window, bins in windows.items():
+                total.merge(bins)
+                merged.setdefault(window, LatencyBins()).merge(bins)
+                p99 = bins.percentile(99)
+                worst = p99 if worst is None else max(worst, p99)
+            result['clients'][client] = total.distribution()
+            result['clients'][client]['worst window p99'] = worst
+        total = LatencyBins()
+        for bins in merged.values():
+            total.merge(bins)
+        result['all'] = total.distribution()
+        result['all']['worst window p99'] = max(
+            [bins.percentile(99) for bins in merged.values()] or [None])
+        return result
+
+    def _histogram(self, clients):
+        """
+        Summarize the latency histograms of each client and of all
+        """
+        result = {'clients': {}}
+        merged = {}
+        for client, windows in sorted(clients.items()):
+            total = None
+            worst = None
+            for window, counts in windows.items():
+                merged.setdefault(window, []).append(counts)
+                if total is None:
+                    total = array.array('L', counts)
+                else:
+                    for index, count in enumerate(counts):
+                        total[index] += count
+                p99 = hist_percentile(counts, 99)
+                if p99 is not None:
+                    worst = p99 if worst is None else max(worst, p99)
+            result['clients'][client] = {'p50': hist_percentile(total, 50),
+                                         'p99': hist_percentile(total, 99),
+                                         'worst window p99': worst}
+        total = None
+        for counts_list in merged.values():
+            for counts in counts_list:
+                if total is None:
+                    total = array.array('L', counts)
+                else:
+                    for index, count in enumerate(counts):
+                        total[index] += count
+        result['all'] = {'p50': hist_percentile(total or [], 50),
+                         'p99': hist_percentile(total or [], 99)}
+        return result
+
+    def result(self):
+        """
+        Return the summary of all logs added
+        """
+        summary = {'window_ms': self.window_ms}
+        for kind, directions in self.throughput.items():
+            for direction, clients in directions.items():
+                summary.setdefault(kind, {})[direction] = self._throughput(clients)
+        for kind, directions in self.latency.items():
+            for direction, clients in directions.items():
+                summary.setdefault(kind, {})[direction] = self._latency(clients)
+        for direction, clients in self.hist.items():
+            summary.setdefault('clat_hist', {})[direction] = self._histogram(clients)
+        return summary
+
+
+def summarize(log_dir, window_ms=WINDOW_MS, stall_ratio=STALL_RATIO):
+    """
+    Return the summary of all fio logs in log_dir
+    """
+    summary = Summary(window_ms, stall_ratio)
+    for filename in sorted(os.listdir(log_dir)):
+        match = _LOGNAME.match(filename)
+        if match:
+            kind, _, client = match.groups()
+            summary.add(os.path.join(log_dir, filename), kind, client or 'local')
+    return summary.result()
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=too-few-public-methods,modernize-parse-error
+"""
+Compile the policy.cfg against the proposals tree.
+
+Each line of the policy.cfg is a glob relative to the proposals directory,
+optionally followed by filters:
+
+    role-mon/cluster/mon*.sls re=.*1\\.sls$
+    role-storage/cluster/*.sls slice=[2:5]
+
+The proposals tree is listed once into an in-memory index and every glob is
+matched against the index instead of the filesystem.  The compiled policy is
+kept for the life of the process and reused as long as neither the
+policy.cfg nor any directory of the proposals tree changed.
+"""
+
+from __future__ import absolute_import
+import fnmatch
+import glob
+import logging
+import os
+import re
+
+log = logging.getLogger(__name__)
+
+PROPOSALS_DIR = "/srv/pillar/ceph/proposals"
+POLICY_FILE = "{}/policy.cfg".format(PROPOSALS_DIR)
+
+_MAGIC = re.compile(r'[*?[]')
+_SLICE = re.compile(r'^\[\s*(-?\d*)\s*(?::\s*(-?\d*)\s*)?(?::\s*(-?\d*)\s*)?\]$')
+
+_indexes = {}
+_policies = {}
+
+
+def _signature(path):
+    """
+    Return what identifies a version of a file or directory, None if absent
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+
+class ProposalsIndex(object):
+    """
+    The names of all files and directories below root as a tree of dicts.
+    Files map to None.
+    """
+
+    def __init__(self, root):
+        """
+        List the tree once, remembering the version of every directory
+        """
+        self.root = root
+        self.tree = {}
+        self.dirs = {}
+        visited = set()
+        for path_dir, dirnames, filenames in os.walk(root, followlinks=True):
+            # Follow symlinks like glob, but never the same directory twice
+            real = os.path.realpath(path_dir)
+            if real in visited:
+                dirnames[:] = []
+                continue
+            visited.add(real)
+            self.dirs[path_dir] = _signature(path_dir)
+            node = self._node(os.path.relpath(path_dir, root))
+            for name in dirnames:
+                node.setdefault(name, {})
+            for name in filenames:
+                node[name] = None
+
+    def _node(self, relative):
+        """
+        Return the subtree of a relative directory
+        """
+        node = self.tree
+        if relative != os.curdir:
+            for name in relative.split(os.sep):
+                node = node.setdefault(name, {})
+        return node
+
+    def uptodate(self):
+        """
+        Adding or removing an entry changes the mtime of its directory
+        """
+        if not self.dirs:
+            return _signature(self.root) is None
+        for path_dir, signature in self.dirs.items():
+            if _signature(path_dir) != signature:
+                return False
+        return True
+
+    def glob(self, pattern):
+        """
+        Return the sorted relative paths matching a glob pattern
+        """
+        parts = [part for part in pattern.split('/') if part]
+        if not parts or os.curdir in parts or os.pardir in parts:
+            # Leaves the indexed tree, ask the filesystem
+            return sorted(os.path.relpath(path, self.root) for path in
+                          glob.glob("{}/{}".format(self.root, pattern)))
+        matches = [('', self.tree)]
+        for part in parts:
+            found = []
+            for prefix, node in matches:
+                if node is None:
+                    continue
+                if _MAGIC.search(part):
+                    names = fnmatch.filter(node, part)
+                    if not part.startswith('.'):
+                        names = [name for name in names if not name.startswith('.')]
+                elif part in node:
+                    names = [part]
+                else:
+                    names = []
+                for name in names:
+                    found.append(("{}/{}".format(prefix, name) if prefix else name,
+                                  node[name]))
+            matches = found
+        return sorted(path for path, _ in matches)
+
+
+def _slice(value):
+    """
+    Convert the [start:stop:step] notation of the slice filter
+    """
+    match = _SLICE.match(value)
+    if not match:
+        raise ValueError("invalid slice {}".format(value))
+    start, stop, step = [int(group) if group else None for group in match.groups()]
+    if ':' not in value:
+        if start is None:
+            raise ValueError("invalid slice {}".format(value))
+        return slice(start, start + 1 or None)
+    return slice(start, stop, step)
+
+
+class PolicyLine(object):
+    """
+    A line of the policy.cfg with the files it matches.  Malformed lines
+    match no files and carry an error.
+    """
+
+    def __init__(self, line, files, error=None):
+        self.line = line
+        self.files = files
+        self.error = error
+
+
+class Policy(object):
+    """
+    The policy.cfg with comments removed and every line matched against the
+    index of the proposals tree
+    """
+
+    def __init__(self, policy_file, index):
+        self.index = index
+        self.lines = []
+        with open(policy_file, "r") as policy:
+            for line in policy:
+                # strip comments from the end of the line
+                line = re.sub(r'\s+#.*$', '', line)
+                line = line.strip()
+                if line.startswith('#') or not line:
+                    log.debug("Ignoring '{}'".format(line))
+                    continue
+                try:
+                    self.lines.append(PolicyLine(line, self._match(line)))
+                except ValueError as err:
+                    self.lines.append(PolicyLine(line, [], str(err)))
+
+    def _match(self, line):
+        """
+        Return files matching the glob constrained by optional slices or
+        regexes
+        """
+        parts = line.split()
+        files = ["{}/{}".format(self.index.root, path)
+                 for path in self.index.glob(parts[0])]
+        for keyvalue in parts[1:]:
+            key, value = keyvalue.split('=')
+            if key == "re":
+                regex = re.compile(value)
+                files = [match.group(0) for _file in files
+                         for match in [regex.search(_file)] if match]
+            elif key == "slice":
+                files = files[_slice(value)]
+            else:
+                log.warning("keyword {} unsupported".format(key))
+        return files
+
+    def files(self):
+        """
+        All matched files in policy order
+        """
+        return [_file for entry in self.lines for _file in entry.files]
+
+
+def compile_policy(policy_file=POLICY_FILE, proposals_dir=PROPOSALS_DIR):
+    """
+    Return the compiled policy, reusing the previous result while the
+    policy.cfg and the proposals tree are unchanged
+    """
+    index = _indexes.get(proposals_dir)
+    if index is None or not index.uptodate():
+        index = ProposalsIndex(proposals_dir)
+        _indexes[proposals_dir] = index
+    signature = _signature(policy_file)
+    key = (policy_file, proposals_dir)
+    cached = _policies.get(key)
+    if cached and cached[0] == signature and cached[1].index is index:
+        return cached[1]
+    compiled = Policy(policy_file, index)
+    _policies[key] = (signature, compiled)
+    return compiled
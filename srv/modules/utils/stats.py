@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""
+Summary statistics shared by the runners
+"""
+
+from __future__ import absolute_import
+import math
+
+
+def percentile(ordered, percent):
+    """
+    Return the nearest rank percentile of sorted values
+    """
+    if not ordered:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(ordered)))
+    return ordered[max(rank, 1) - 1]
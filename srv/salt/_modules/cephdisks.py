@@ -2,12 +2,23 @@
 # pylint: disable=fixme,modernize-parse-error
 """
 Query ceph-volume's API for devices on the node
+
+Scanning the devices shells out to lsblk, blkid, pvs and lvs for every
+device.  The scan is done once per Salt job and kept as a snapshot which
+all functions of this module and of the dg module query.  Optionally, set
+``cephdisks_cache_ttl`` in the minion config to keep the reports on disk for
+that many seconds across jobs.  Pass refresh=True to any function to scan
+again.
 """
 
 from __future__ import absolute_import
+import copy
+import hashlib
+import json
 import logging
 import re
 import os
+import time
 from subprocess import Popen, PIPE
 from shlex import split
 
@@ -18,6 +29,10 @@ except ImportError:
 # pytest: disable=import-error
 log = logging.getLogger(__name__)
 
+# Seconds a snapshot is reused by calls that do not belong to a job
+SNAPSHOT_TTL = 60
+CACHE_FILE = 'cephdisks.json'
+
 
 # pylint: disable=import-error
 def load_ceph_volume_devices():
@@ -45,15 +60,112 @@ def load_ceph_volume_device():
         log.error("Could not import from ceph_volume.util.device.")
 
 
+class Snapshot(object):
+    """ The devices of the node as scanned by ceph-volume
+
+    Devices outside of the scan, like partitions, are looked up on first
+    use and kept as well.
+    """
+
+    def __init__(self, jid=None) -> None:
+        self.jid = jid
+        self.created: float = time.time()
+        self.devices: list = load_ceph_volume_devices().devices
+        self._device = load_ceph_volume_device()
+        self._by_path: dict = {dev.path: dev for dev in self.devices}
+        self._memo: dict = dict()
+
+    def device(self, path: str):
+        """ The ceph-volume Device of a path """
+        if path not in self._by_path:
+            self._by_path[path] = self._device(path)
+        return self._by_path[path]
+
+    def memo(self, key: str, func):
+        """ Call func once per snapshot """
+        if key not in self._memo:
+            self._memo[key] = func()
+        return self._memo[key]
+
+    def reusable(self, jid=None) -> bool:
+        """ The snapshot belongs to the job or is recent """
+        if jid is not None and self.jid is not None:
+            return jid == self.jid
+        return time.time() - self.created < SNAPSHOT_TTL
+
+
+def _snapshot(refresh=False, jid=None) -> Snapshot:
+    """ Return the snapshot of the current job, scan if there is none """
+    snapshot = __context__.get('cephdisks.snapshot')
+    if refresh or snapshot is None or not snapshot.reusable(jid):
+        log.debug("Scanning devices")
+        snapshot = Snapshot(jid)
+        __context__['cephdisks.snapshot'] = snapshot
+    return snapshot
+
+
+def _cache_filename() -> str:
+    """ The file the reports are kept in across jobs """
+    return os.path.join(__opts__.get('cachedir', ''), CACHE_FILE)
+
+
+def _cached(name: str, func, **kwargs):
+    """ Return the report of a function for its arguments
+
+    Reports are kept in memory as part of the snapshot and, if
+    cephdisks_cache_ttl is set, on disk for that many seconds.
+    """
+    refresh = kwargs.get('refresh', False)
+    jid = kwargs.get('__pub_jid')
+    args = {key: value for key, value in kwargs.items()
+            if not key.startswith('__') and key != 'refresh'}
+    key = '{}:{}'.format(
+        name,
+        hashlib.md5(json.dumps(args, sort_keys=True,
+                               default=str).encode()).hexdigest())
+    ttl = __opts__.get('cephdisks_cache_ttl', 0)
+    entries: dict = dict()
+    if ttl:
+        try:
+            with open(_cache_filename(), 'r') as cache:
+                entries = json.load(cache)
+        except (IOError, OSError, ValueError):
+            entries = dict()
+        entry = entries.get(key)
+        if not refresh and entry and entry['time'] + ttl > time.time():
+            return entry['report']
+
+    snapshot = _snapshot(refresh, jid)
+    # Callers may modify the report, keep the snapshot's copy intact
+    report = copy.deepcopy(
+        snapshot.memo(key, lambda: func(snapshot=snapshot, **args)))
+
+    if ttl:
+        entries[key] = {'time': snapshot.created, 'report': report}
+        filename = _cache_filename()
+        tmp = '{}.{}'.format(filename, os.getpid())
+        try:
+            with open(tmp, 'w') as cache:
+                json.dump(entries, cache)
+            os.rename(tmp, filename)
+        except (IOError, OSError, TypeError) as err:
+            log.warning("Cannot write {}: {}".format(filename, err))
+    return report
+
+
 class Inventory(object):
     """ Inventory wrapper class for ceph-volume's device api """
 
-    def __init__(self, **kwargs) -> None:  # noqa
+    def __init__(self, snapshot=None, **kwargs) -> None:  # noqa
         self.kwargs: dict = kwargs
-        self.devices = load_ceph_volume_devices().devices
-        self.device = load_ceph_volume_device()
-        self.root_disk = self._find_root_disk()
-        self.raid_devices = self._find_raid_devices()
+        if snapshot is None:
+            snapshot = _snapshot(
+                kwargs.get('refresh', False), kwargs.get('__pub_jid'))
+        self.devices = snapshot.devices
+        self.device = snapshot.device
+        self.root_disk = snapshot.memo('root_disk', self._find_root_disk)
+        self.raid_devices = snapshot.memo('raid_devices',
+                                          self._find_raid_devices)
 
     @property
     def exclude_unavailable(self) -> bool:
@@ -278,24 +390,44 @@ class Inventory(object):
         return devs
 
 
-def get_(disk_path):
+def get_(disk_path, refresh=False, **kwargs):
     """ Get a json report for a given device """
-    device = load_ceph_volume_device()
-    return device(disk_path).json_report()
+    return snapshot_device(disk_path, refresh=refresh, **kwargs).json_report()
 
 
-def find_by_osd_id(osd_id, **kwargs):
+def snapshot_device(disk_path, refresh=False, **kwargs):
+    """ The ceph-volume Device of a path, for use by other modules """
+    return _snapshot(refresh, kwargs.get('__pub_jid')).device(disk_path)
+
+
+def invalidate():
+    """ Drop the snapshot and the reports kept on disk """
+    __context__.pop('cephdisks.snapshot', None)
+    try:
+        os.remove(_cache_filename())
+    except OSError:
+        pass
+    return True
+
+
+def _find_by_osd_id(snapshot=None, osd_id=None, **kwargs):
     """ Find OSD by it's osd id """
     return [
-        x.json_report() for x in Inventory(**kwargs).find_by_osd_id(osd_id)
+        x.json_report()
+        for x in Inventory(snapshot, **kwargs).find_by_osd_id(osd_id)
     ]
 
 
-def attr_list(**kwargs):
+def find_by_osd_id(osd_id, **kwargs):
+    """ Find OSD by it's osd id """
+    return _cached('find_by_osd_id', _find_by_osd_id, osd_id=osd_id, **kwargs)
+
+
+def _attr_list(snapshot=None, **kwargs):
     """ List supported attributes of drives """
     report = list()
     default = "Not available"
-    for device in Inventory(**kwargs).filter_():
+    for device in Inventory(snapshot, **kwargs).filter_():
         dev = device.json_report()
         if device.path:
             model = dev.get('sys_api', {}).get('model', default)
@@ -314,18 +446,28 @@ def attr_list(**kwargs):
     return report
 
 
+def attr_list(**kwargs):
+    """ List supported attributes of drives """
+    return _cached('attr_list', _attr_list, **kwargs)
+
+
+def _reports(snapshot=None, **kwargs):
+    """ The json reports of the filtered devices """
+    return [x.json_report() for x in Inventory(snapshot, **kwargs).filter_()]
+
+
 def all_(**kwargs):
     """ List all devices regardless of used or not
     also exclude root disk by default
     """
     kwargs.update(dict(exclude_root_disk=True))
-    return [x.json_report() for x in Inventory(**kwargs).filter_()]
+    return _cached('reports', _reports, **kwargs)
 
 
 def _list(**kwargs):
     """ List only devices that are used by ceph """
     kwargs.update(dict(exclude_used_by_ceph=False))
-    return [x.json_report() for x in Inventory(**kwargs).filter_()]
+    return _cached('reports', _reports, **kwargs)
 
 
 def used(**kwargs):
@@ -340,12 +482,13 @@ def unused(**kwargs):
             exclude_used_by_ceph=True,
             exclude_unavailable=True,
             exclude_cephdisk_member=True))
-    return [x.json_report() for x in Inventory(**kwargs).filter_()]
+    return _cached('reports', _reports, **kwargs)
 
 
 def devices(**kwargs):
     """ List device paths"""
-    return [x.path for x in Inventory(**kwargs).filter_() if x.path]
+    return [x['path'] for x in _cached('reports', _reports, **kwargs)
+            if x.get('path')]
 
 
 # pylint: disable=redefined-outer-name
@@ -50,39 +50,70 @@ processes = {'mon': ['ceph-mon'],
 absent_processes = {'igw': ['lrbd']}
 
 
+def _unit_states(service_names):
+    """
+    Return the UnitFileState of systemd units, asking systemctl once for all
+    of them.  Units systemctl does not answer for are missing.
+    """
+    names = []
+    for fsn in service_names:
+        if fsn not in names:
+            names.append(fsn)
+    if not names:
+        return {}
+    proc = Popen(['systemctl', 'show', '--property=UnitFileState'] + names, stdout=PIPE)
+    stdout, stderr = proc.communicate()
+    if stderr:
+        # pylint: disable=line-too-long
+        log.error('Requesting the UnitFileState from {} has resulted in {}'.format(names, stderr))
+        return {}
+    try:
+        stdout = stdout.decode('utf-8')
+    except AttributeError:
+        log.error("Could not decode type-> {}".format(type(stdout)))
+        return {}
+    # One block per unit in the order requested
+    blocks = stdout.strip().split('\n\n')
+    if len(blocks) != len(names):
+        log.error("Expected the state of {} units but got {}".format(len(names), stdout))
+        return {}
+    states = {}
+    for fsn, block in zip(names, blocks):
+        states[fsn] = ''
+        for line in block.splitlines():
+            if line.startswith('UnitFileState='):
+                states[fsn] = line.split('=', 1)[1].strip()
+    return states
+
+
 # pylint: disable=too-few-public-methods
 class SystemdUnit(object):
     """
     Class representation of the processes' systemd state
     """
 
-    def __init__(self, proc_name=None, osd_id=None):
+    def __init__(self, proc_name=None, osd_id=None, states=None):
         self.proc_name = proc_name
         self._is_disabled = False
         self.osd_id = osd_id
         self.service_names = self._service_names()
+        # The unit states when queried together with other units
+        self.states = states
 
     @property
     def is_disabled(self):
         """
-        Reach out to systemctl and call is-enabled.
+        Reach out to systemctl unless the unit states were queried already.
         Property for this state
         """
         if not self.service_names:
             return False
 
+        states = self.states
+        if states is None:
+            states = _unit_states(self.service_names)
         for fsn in self.service_names:
-            proc = Popen(shlex.split('systemctl is-enabled {}'.format(fsn)), stdout=PIPE)
-            stdout, stderr = proc.communicate()
-            if stderr:
-                # pylint: disable=line-too-long
-                log.error('Requesting the is-enabled flag from {} has resulted in {}'.format(fsn, stderr))
-                return False
-            try:
-                status = stdout.decode('utf-8').strip()
-            except AttributeError:
-                log.error("Could not decode type-> {}".format(type(stdout)))
-                status = ''
+            status = states.get(fsn, '')
             if status == 'disabled':
                 log.info("Found {} to be disabled".format(fsn))
                 return True
@@ -156,11 +187,12 @@ class ProcInfo(object):
         Look into the commandline the process has been called
         with and extract the --id portion.
         """
-        _id = self.proc.cmdline()[self.proc.cmdline().index('--id') + 1]
-        if _id:
-            return _id
-        else:
-            raise NoOSDIDFound
+        cmdline = self.proc.cmdline()
+        if '--id' in cmdline[:-1]:
+            _id = cmdline[cmdline.index('--id') + 1]
+            if _id:
+                return _id
+        raise NoOSDIDFound
 
 
 class NoOSDIDFound(Exception):
@@ -310,19 +342,28 @@ class MetaCheck(object):
         # initialize
         for proc in self.up:
             res['up'][proc.exe] = list()
-        for proc in self.down:
+        units = [SystemdUnit(proc_name=proc) for proc in self.down]
+        osd_units = []
+        if self.insufficient_osd_count:
+            osd_units = [SystemdUnit(proc_name='ceph-osd', osd_id=missing_osd)
+                         for missing_osd in self._missing_osds]
+        # A single systemctl call answers for all units
+        states = _unit_states([fsn for unit in units + osd_units
+                               for fsn in unit.service_names])
+        for unit in units + osd_units:
+            unit.states = states
+        for proc, unit in zip(self.down, units):
             # We only consider down/enabled as abort condition
-            if not SystemdUnit(proc_name=proc).is_disabled:
+            if not unit.is_disabled:
                 res['down'][proc] = proc
 
         for proc in self.up:
             # We are checking if a systemd-unit is up,
             # but not if it is disabled. maybe we should?
             res['up'][proc.exe].append(proc.pid)
-        if self.insufficient_osd_count:
-            for missing_osd in self._missing_osds:
-                if not SystemdUnit(proc_name='ceph-osd', osd_id=missing_osd).is_disabled:
-                    res['down']['ceph-osd'] = self._missing_osds
+        for unit in osd_units:
+            if not unit.is_disabled:
+                res['down']['ceph-osd'] = self._missing_osds
         return res
 
 
@@ -335,6 +376,32 @@ def _extend_processes():
             processes[rgw_config] = ['radosgw']
 
 
+def _proc_infos():
+    """
+    Return the ProcInfo of every process, skipping processes that exit
+    while being inspected
+    """
+    procs = []
+    for running_proc in psutil.process_iter():
+        try:
+            procs.append(ProcInfo(running_proc))
+        except (psutil.NoSuchProcess, psutil.ZombieProcess, psutil.AccessDenied):
+            continue
+    return procs
+
+
+def _check_role(res, procs, role):
+    """
+    Add the processes of a role to a MetaCheck and check them
+    """
+    for proc in procs:
+        res.add(proc, role)
+    res.check_inverts(role)
+    res.check_absents(role)
+    if role == 'storage':
+        res.check_osds()
+
+
 def check(results=False, **kwargs):
 
     """
@@ -348,17 +415,33 @@ def check(results=False, **kwargs):
 
     if 'roles' not in __pillar__:
         return {'up': {}, 'down': {}} if results else True
+    # A single pass over the processes serves all roles
+    procs = _proc_infos()
     for role in kwargs.get('roles', __pillar__['roles']):
-        for running_proc in psutil.process_iter():
-            res.add(ProcInfo(running_proc), role)
-        res.check_inverts(role)
-        res.check_absents(role)
-        if role == 'storage':
-            res.check_osds()
+        _check_role(res, procs, role)
 
     return res.report() if results else res.running
 
 
+def check_roles(roles=None, **kwargs):
+    """
+    Query the status of running processes of each role separately.  Return
+    whether all processes of a role are running, by role.  Every requested
+    role is checked, the roles of the minion by default.
+    """
+    processes['igw'] = __pillar__.get('igw_service_daemons', [])
+    _extend_processes()
+    if roles is None:
+        roles = __pillar__.get('roles', [])
+    status = {}
+    procs = _proc_infos()
+    for role in roles:
+        res = MetaCheck(**kwargs)
+        _check_role(res, procs, role)
+        status[role] = res.running
+    return status
+
+
 def down():
     """
     Based on check(), return True/False if all Ceph processes that are meant
@@ -393,66 +476,135 @@ def wait(**kwargs):
     return False
 
 
+PROC = '/proc'
+# Deleted files that do not need a restart
+_IGNORED_DELETED = ('/memfd:', '/dev/shm/', '/SYSV', '/dev/zero')
+
+
+def _ceph_names():
+    """
+    Return the names of all processes of any role, as found in
+    /proc/<pid>/comm which holds at most 15 characters
+    """
+    names = set()
+    for role_names in list(processes.values()) + list(absent_processes.values()):
+        names.update(role_names)
+    names.update(__pillar__.get('igw_service_daemons', []))
+    return set(name[:15] for name in names)
+
+
+def _is_deleted(path):
+    """
+    Whether a mapped or open path is a deleted file
+    """
+    return (path.startswith('/') and path.endswith(' (deleted)') and
+            not path.startswith(_IGNORED_DELETED))
+
+
+def _holds_deleted(pid):
+    """
+    Whether a process maps a deleted library or holds a deleted file open
+    """
+    try:
+        with open('{}/{}/maps'.format(PROC, pid)) as maps:
+            for line in maps:
+                fields = line.rstrip('\n').split(None, 5)
+                if len(fields) == 6 and _is_deleted(fields[5]):
+                    return True
+        fd_dir = '{}/{}/fd'.format(PROC, pid)
+        for fd in os.listdir(fd_dir):
+            try:
+                if _is_deleted(os.readlink('{}/{}'.format(fd_dir, fd))):
+                    return True
+            except OSError:
+                continue
+    except (IOError, OSError):
+        # The process exited or is not accessible
+        pass
+    return False
+
+
 def _process_map():
     """
-    Create a map of processes that have deleted files.
+    Create a map of Ceph processes that have deleted files.  Only processes
+    with the name of a Ceph service are inspected.
     """
     procs = []
-    proc1 = Popen(shlex.split('lsof '), stdout=PIPE)
-    # pylint: disable=line-too-long
-    proc2 = Popen(shlex.split("awk 'BEGIN {IGNORECASE = 1} /deleted/ {print $1 \" \" $2 \" \" $4}'"),
-                  stdin=proc1.stdout, stdout=PIPE, stderr=PIPE)
-    proc1.stdout.close()
-    stdout, _ = proc2.communicate()
-    stdout = __salt__['helper.convert_out'](stdout)
-    for proc_l in stdout.split('\n'):
-        proc = proc_l.split(' ')
-        proc_info = {}
-        if proc[0] and proc[1] and proc[2]:
-            proc_info['name'] = proc[0]
-            proc_info['pid'] = proc[1]
-            proc_info['user'] = proc[2]
-            procs.append(proc_info)
-        else:
+    names = _ceph_names()
+    for pid in os.listdir(PROC):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('{}/{}/comm'.format(PROC, pid)) as comm:
+                name = comm.read().strip()
+            if name not in names:
+                continue
+            user = pwd.getpwuid(os.stat('{}/{}'.format(PROC, pid)).st_uid).pw_name
+        except (IOError, OSError, KeyError):
             continue
+        if _holds_deleted(pid):
+            procs.append({'name': name, 'pid': pid, 'user': user})
     return procs
 
 
-def zypper_ps(role, lsof_map):
+def _zypper_services():
     """
-    Gets services that need a restart from zypper
+    Return the services that zypper reports as using deleted files
     """
-    assert role
     proc1 = Popen(shlex.split('zypper ps -sss'), stdout=PIPE)
     stdout, _ = proc1.communicate()
     stdout = __salt__['helper.convert_out'](stdout)
-    processes_ = processes
-    # adding instead of overwriting, eh?
+    return [proc_l.split('@')[0] for proc_l in stdout.split('\n') if proc_l]
+
+
+def _restart_names(role):
+    """
+    Return the process and service names of a role
+    """
+    names = list(processes.get(role, []))
     # radosgw is ceph-radosgw in zypper ps.
-    processes_['rgw'] = ['ceph-radosgw', 'radosgw', 'rgw']
+    if role == 'rgw':
+        names = ['ceph-radosgw', 'radosgw', 'rgw']
     # ganesha is called nfs-ganesha
-    processes_['ganesha'] = ['ganesha.nfsd', 'rpcbind', 'rpc.statd', 'nfs-ganesha']
+    if role == 'ganesha':
+        names = ['ganesha.nfsd', 'rpcbind', 'rpc.statd', 'nfs-ganesha']
     # igw we need to get the current iSCSI daemon deployed
-    processes_['igw'] = __pillar__.get('igw_service_daemons', ['lrbd'])
-    for proc_l in stdout.split('\n'):
-        if '@' in proc_l:
-            proc_l = proc_l.split('@')[0]
-        if proc_l in processes_[role]:
-            lsof_map.append({'name': proc_l})
+    if role == 'igw':
+        names = __pillar__.get('igw_service_daemons', ['lrbd'])
+    return names
+
+
+def zypper_ps(role, lsof_map):
+    """
+    Gets services that need a restart from zypper
+    """
+    assert role
+    for name in _zypper_services():
+        if name in _restart_names(role):
+            lsof_map.append({'name': name})
     return lsof_map
 
 
+def _restart_candidates():
+    """
+    Return the names of Ceph processes holding deleted files and of services
+    zypper wants restarted
+    """
+    names = set(proc['name'] for proc in _process_map())
+    names.update(_zypper_services())
+    return names
+
+
 def need_restart_lsof(role=None):
     """
     Use the process map to determine if a service restart is required.
     """
     assert role
-    lsof_proc_map = _process_map()
-    proc_map = zypper_ps(role, lsof_proc_map)
-    for proc in proc_map:
-        if proc['name'] in processes[role]:
-            log.info("Found deleted file for ceph service: {} -> Queuing a restart".format(role))
-            return True
+    candidates = _restart_candidates()
+    if any(name in candidates or name[:15] in candidates
+           for name in _restart_names(role)):
+        log.info("Found deleted file for ceph service: {} -> Queuing a restart".format(role))
+        return True
     return False
 
 
@@ -11,7 +11,7 @@ import json
 import re
 import logging
 import os
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from typing import Tuple
 log = logging.getLogger(__name__)
 try:
@@ -215,6 +215,14 @@ class Matcher(object):
         """
         pass
 
+    def compare_value(self, disk_value) -> bool:
+        """ Compare a value already extracted from a disk
+        This will get overwritten by the individual classes
+
+        :param disk_value: The value of 'key' (or 'fallback_key') of a disk
+        """
+        pass
+
 
 # pylint: disable=too-few-public-methods
 class SubstringMatcher(Matcher):
@@ -235,7 +243,11 @@ class SubstringMatcher(Matcher):
         """
         if not disk:
             return False
-        disk_value: str = self._get_disk_key(disk)
+        return self.compare_value(self._get_disk_key(disk))
+
+    def compare_value(self, disk_value) -> bool:
+        """ Substring match of an extracted value
+        """
         if str(self.value) in str(disk_value):
             return True
         return False
@@ -285,7 +297,11 @@ class EqualityMatcher(Matcher):
         """
         if not disk:
             return False
-        disk_value: str = self._get_disk_key(disk)
+        return self.compare_value(self._get_disk_key(disk))
+
+    def compare_value(self, disk_value) -> bool:
+        """ Value comparison of an extracted value
+        """
         if int(disk_value) == int(self.value):
             return True
         return False
@@ -476,7 +492,12 @@ class SizeMatcher(Matcher, UnitHelper):
         """
         if not disk:
             return False
-        disk_value = self._get_disk_key(disk)
+        return self.compare_value(self._get_disk_key(disk))
+
+    # pylint: disable=inconsistent-return-statements, too-many-return-statements
+    def compare_value(self, disk_value) -> bool:
+        """ Size comparison of an extracted value
+        """
         # This doesn't neccessarily have to be a float.
         # The current output from ceph-volume gives a float..
         # This may change in the future..
@@ -522,13 +543,104 @@ class Inventory(object):
     Inventory class that calls out to cephdisks
     """
 
-    def __init__(self, cephdisks_mode='unused'):
+    def __init__(self, cephdisks_mode='unused', refresh=False):
         self.cephdisks_mode = cephdisks_mode
+        self.refresh = refresh
 
     @property
     def disks(self) -> list:
         """ Returns a list of disks (json_report)"""
-        return __salt__[f'cephdisks.{self.cephdisks_mode}']()
+        return __salt__[f'cephdisks.{self.cephdisks_mode}'](
+            refresh=self.refresh)
+
+
+class DiskTable(object):
+    """ The inventory indexed by disk attributes
+
+    Rows are positions in the inventory.  Equal disks share the id of the
+    first of them.  The value of an attribute, like path, rotational,
+    vendor, model or size, is extracted from every disk once, and disks
+    are grouped by value.  A filter is compared once per distinct value
+    and selects the union of the matching groups.
+    """
+
+    def __init__(self, disks: list) -> None:
+        self.disks: list = list(disks)
+        self.ids: list = list()
+        by_path: dict = dict()
+        for row, disk in enumerate(self.disks):
+            rows = by_path.setdefault(str(disk.get('path')) if disk else '', [])
+            self.ids.append(
+                next((other for other in rows if self.disks[other] == disk),
+                     row))
+            rows.append(row)
+        self.taken: set = set()
+        self._indexes: dict = dict()
+
+    @property
+    def remaining(self) -> list:
+        """ Disks that are not taken, in inventory order
+        """
+        return [
+            disk for row, disk in enumerate(self.disks)
+            if row not in self.taken
+        ]
+
+    def _index(self, matcher) -> OrderedDict:
+        """ Group the rows by the value of the matcher's key
+
+        Groups are ordered by their first row.  A disk whose value cannot
+        be extracted forms a group of its own carrying the exception.
+        """
+        column = (matcher.key, matcher.fallback_key, matcher.virtual)
+        if column not in self._indexes:
+            index = OrderedDict()
+            for row, disk in enumerate(self.disks):
+                if not disk:
+                    continue
+                try:
+                    # pylint: disable=protected-access
+                    value = matcher._get_disk_key(disk)
+                # pylint: disable=broad-except
+                except Exception as err:
+                    index[('error', row)] = (err, [row])
+                    continue
+                try:
+                    key = ('value', value)
+                    hash(key)
+                except TypeError:
+                    key = ('row', row)
+                index.setdefault(key, (value, []))[1].append(row)
+            self._indexes[column] = index
+        return self._indexes[column]
+
+    def select(self, matcher) -> list:
+        """ Rows not taken yet that match, in inventory order
+
+        Each row comes with the exception its comparison raised, if any,
+        so the caller can raise it where iterating the disks would have.
+        :param Matcher matcher: The matcher of a filter
+        :return: A list of (row, exception) tuples
+        :rtype: list
+        """
+        if isinstance(matcher, AllMatcher):
+            return [(row, None) for row, disk in enumerate(self.disks)
+                    if disk and row not in self.taken]
+        selected = list()
+        for key, (value, rows) in self._index(matcher).items():
+            error = None
+            if key[0] == 'error':
+                error = value
+            else:
+                try:
+                    if not matcher.compare_value(value):
+                        continue
+                # pylint: disable=broad-except
+                except Exception as err:
+                    error = err
+            selected.extend(
+                (row, error) for row in rows if row not in self.taken)
+        return sorted(selected, key=lambda item: item[0])
 
 
 # pylint: disable=too-many-public-methods
@@ -544,12 +656,15 @@ class DriveGroup(object):
     """
 
     # pylint: disable=too-many-instance-attributes
-    def __init__(self, filter_args: dict, cephdisks_mode='unused') -> None:
+    def __init__(self, filter_args: dict, cephdisks_mode='unused',
+                 refresh=False) -> None:
         self.filter_args: dict = filter_args
         log.debug("Initializing DriveGroups with {}".format(self.filter_args))
         self._check_filter_support()
         self._data_devices = None
-        self._disks = Inventory(cephdisks_mode=cephdisks_mode).disks
+        self._disks = Inventory(
+            cephdisks_mode=cephdisks_mode, refresh=refresh).disks
+        self._disk_table = None
         self._wal_devices = None
         self._db_devices = None
         self.prop = namedtuple("Property", 'ident can_have_osds devices')
@@ -718,6 +833,16 @@ class DriveGroup(object):
         """
         return self._disks
 
+    @property
+    def disk_table(self) -> DiskTable:
+        """
+        The disks found in the inventory indexed by attributes
+        """
+        if (self._disk_table is None
+                or len(self._disk_table.remaining) != len(self.disks)):
+            self._disk_table = DiskTable(self.disks)
+        return self._disk_table
+
     @staticmethod
     def _limit_reached(device_filter, len_devices: int,
                        disk_path: str) -> bool:
@@ -762,21 +887,19 @@ class DriveGroup(object):
         :rtype set:
         """
         devices: list = list()
+        chosen: dict = dict()
+        table = self.disk_table
         for name, val in device_filter.items():
             _filter = Filter(name=name, value=val)
-            for disk in self.disks:
+            if not _filter.is_matchable:
+                log.debug("Ignoring filter {}. Filter is not matchable".format(
+                    name))
+                continue
+            for row, error in table.select(_filter.matcher):
+                disk = table.disks[row]
                 log.debug("Processing disk {}".format(disk.get('path')))
-                # continue criterias
-                if not _filter.is_matchable:
-                    log.debug(
-                        "Ignoring disk {}. Filter is not matchable".format(
-                            disk.get('path')))
-                    continue
-
-                if not _filter.matcher.compare(disk):
-                    log.debug("Ignoring disk {}. Filter did not match".format(
-                        disk.get('path')))
-                    continue
+                if error is not None:
+                    raise error
 
                 if not self._has_mandatory_idents(disk):
                     log.debug(
@@ -790,14 +913,15 @@ class DriveGroup(object):
                         disk.get('path')))
                     continue
 
-                if disk not in devices:
+                if table.ids[row] not in chosen:
                     log.debug('Adding disk {}'.format(disk.get("path")))
+                    chosen[table.ids[row]] = row
                     devices.append(disk)
 
         # This disk is already taken and must not be re-assigned.
-        for taken_device in devices:
-            if taken_device in self.disks:
-                self.disks.remove(taken_device)
+        if chosen:
+            table.taken.update(chosen.values())
+            self.disks[:] = table.remaining
         # return sorted([x.get('path') for x in devices])
         return sorted([x for x in devices],
                       key=lambda dev: dev.get('path', ''))
@@ -850,7 +974,7 @@ class Disk(object):
 
     def __init__(self, path):
         self.path = path
-        self.device = Device(self.path)
+        self.device = __salt__['cephdisks.snapshot_device'](self.path)
         self.error = ''
 
     @property
@@ -937,7 +1061,7 @@ class CephDiskOSD(object):
         """ Find data partition in all partitions """
         partitions = self.device.sys_api.get('partitions', dict())
         for partition in list(partitions.keys()):
-            part = Device(f"/dev/{partition}")
+            part = __salt__['cephdisks.snapshot_device'](f"/dev/{partition}")
             if part.ceph_disk.type == 'data':
                 return part.abspath
         return ''
@@ -1135,7 +1259,8 @@ class Output(object):
         self.bypass_pillar = kwargs.get('bypass_pillar', False)
         self.destroyed_osds_map = kwargs.get('destroyed_osds', {})
         self.dry_run = kwargs.get('dry_run', False)
-        self.dgo = DriveGroup(self.filter_args, cephdisks_mode)
+        self.dgo = DriveGroup(self.filter_args, cephdisks_mode,
+                              kwargs.get('refresh', False))
         self.ret: dict = dict(
             data_devices={},
             wal_devices={},
@@ -1416,6 +1541,9 @@ Please make sure to have more/equal wal_devices than db_devices"""
                 continue
             log.debug("Running command: {}".format(cmd))
             rets.append(__salt__['helper.run'](cmd))
+        if rets:
+            # The devices changed, do not serve the reports kept on disk
+            __salt__['cephdisks.invalidate']()
         log.debug("Returns for dg.deploy: {}".format(rets))
         return rets
 
@@ -30,6 +30,9 @@ IPERF_PATH = which('iperf3')
 
 LOCALHOST_NAME = socket.gethostname()
 
+# Average rtt above this multiple of the median is slow
+SLOW_FACTOR = 3
+
 '''
 multi is the module to call subprocess in minion host
 
@@ -88,25 +91,41 @@ def _summarize_iperf(result):
     return msg
 
 
+def _parse_ping(out):
+    '''
+    Return the rtt statistics and packet loss of the ping output
+    '''
+    stats = {}
+    rtt = re.search(r'rtt min/avg/max/mdev = ([\d.]+)/([\d.]+)/([\d.]+)/([\d.]+)', out)
+    if rtt:
+        for key, value in zip(['min', 'avg', 'max', 'mdev'], rtt.groups()):
+            stats[key] = float(value)
+    loss = re.search(r'([\d.]+)% packet loss', out)
+    if loss:
+        stats['loss'] = float(loss.group(1))
+    return stats
+
+
 def _summarize_ping(results):
     '''
-    Scan the results and summarize
+    Scan the results and summarize.  A host is slow when its average rtt
+    is more than SLOW_FACTOR times the median of all hosts.
     '''
     success = []
     failed = []
     errored = []
     slow = []
     avg = []
+    hosts = {}
     for result in results:
         # pylint: disable=invalid-name,unused-variable
         host, rc, out, err = result
+        if rc in [0, 1]:
+            hosts[host] = _parse_ping(out)
         if rc == 0:
             success.append(host)
-            rtt = re.match(
-                r'.*rtt min/avg/max/mdev = \d+\.?\d+/(\d+\.?\d+)/',
-                out, re.DOTALL)
-            if rtt:
-                avg.append({'avg': float(rtt.group(1)), 'host': host})
+            if 'avg' in hosts[host]:
+                avg.append({'avg': hosts[host]['avg'], 'host': host})
         if rc == 1:
             failed.append(host)
         if rc == 2:
@@ -116,11 +135,13 @@ def _summarize_ping(results):
 
     if avg:
         avg_sum = sum(i.get('avg') for i in avg) / len(avg)
+        # lower median, as the nearest rank p50 of net.latency
+        median = sorted(i.get('avg') for i in avg)[(len(avg) - 1) // 2]
         if len(avg) > 2:
             for i in avg:
-                if (avg_sum * len(avg) / 2) < i.get('avg'):
-                    log.debug('_summarize_ping: slow host = {} avg = {}, s'.
-                              format(i.get('avg'), avg_sum))
+                if SLOW_FACTOR * median < i.get('avg'):
+                    log.debug('_summarize_ping: slow host = {} avg = {}, median = {}'.
+                              format(i.get('host'), i.get('avg'), median))
                     slow.append(i.get('host'))
     else:
         avg_sum = 0
@@ -134,6 +155,7 @@ def _summarize_ping(results):
     if slow:
         msg['slow'] = " ".join(slow)
     msg['avg'] = avg_sum
+    msg['hosts'] = hosts
     return msg
 
 
@@ -200,36 +222,40 @@ def kill_iperf_cmd():
     return True
 
 
-def ping(*hosts):
+def ping(*hosts, **kwargs):
     '''
-    Ping a list of hosts and summarize the results
+    Ping a list of hosts and summarize the results.  Optionally, set the
+    number of packets with count.
 
     CLI Example:
     .. code-block:: bash
         sudo salt 'node' multi.ping <hostname>|<ip> <hostname>|<ip>....
+        sudo salt 'node' multi.ping <hostname>|<ip> <hostname>|<ip>.... count=5
     '''
     # I should be filter all the localhost here?
     log.debug('ping hostlist={}'.format(list(hosts)))
-    results = _all(ping_cmd, list(hosts))
+    count = int(kwargs.get('count', 1))
+    results = _all(lambda host: ping_cmd(host, count), list(hosts))
     return _summarize_ping(results)
 
 
-def ping_cmd(host):
+def ping_cmd(host, count=1):
     '''
-    Ping a host with 1 packet and return the result
+    Ping a host with count packets and return the result
 
     CLI Example:
     .. code-block:: bash
         sudo salt 'node' multi.ping_cmd <hostname>|<ip>
     '''
-    cmd = ["/usr/bin/ping", "-c1", "-q", "-W1", host]
+    cmd = ["/usr/bin/ping", "-c{}".format(count), "-i0.2", "-q", "-W1", host]
     retcode, stdout, stderr = __salt__['helper.run'](cmd)
     return host, retcode, stdout, stderr
 
 
-def jumbo_ping(*hosts):
+def jumbo_ping(*hosts, **kwargs):
     '''
-    Ping a list of hosts and summarize the results
+    Ping a list of hosts and summarize the results.  Optionally, set the
+    number of packets with count.
 
     CLI Example:
     .. code-block:: bash
@@ -237,19 +263,21 @@ def jumbo_ping(*hosts):
     '''
     # I should be filter all the localhost here?
     log.debug('jumbo_ping hostlist={}'.format(list(hosts)))
-    results = _all(jumbo_ping_cmd, list(hosts))
+    count = int(kwargs.get('count', 1))
+    results = _all(lambda host: jumbo_ping_cmd(host, count), list(hosts))
     return _summarize_ping(results)
 
 
-def jumbo_ping_cmd(host):
+def jumbo_ping_cmd(host, count=1):
     '''
-    Ping a host with 1 packet and return the result
+    Ping a host with count packets and return the result
 
     CLI Example:
     .. code-block:: bash
         sudo salt 'node' multi.ping_cmd <hostname>|<ip>
     '''
-    cmd = ["/usr/bin/ping", "-Mdo", "-s8972", "-c1", "-q", "-W1", host]
+    cmd = ["/usr/bin/ping", "-Mdo", "-s8972", "-c{}".format(count), "-i0.2",
+           "-q", "-W1", host]
     log.debug('ping_cmd hostname={}'.format(host))
     retcode, stdout, stderr = __salt__['helper.run'](cmd)
     return host, retcode, stdout, stderr
@@ -8,10 +8,12 @@ All OSD related functions
 
 from __future__ import absolute_import
 from __future__ import print_function
+import collections
 import glob
 import os
 import json
 import logging
+import math
 import time
 import re
 import pprint
@@ -257,6 +259,105 @@ def tree_from_any():
     return _tree(**kwargs)
 
 
+# Samples kept to estimate the rate of progress
+RATE_SAMPLES = 10
+
+_clusters = {}
+
+
+def _connect(settings):
+    """
+    Return a connection to the Ceph cluster, shared by every query of this
+    process with the same conf, keyring and client
+    """
+    key = (settings['conf'], settings['keyring'], settings['client'])
+    if key not in _clusters:
+        cluster = rados.Rados(conffile=settings['conf'],
+                              conf=dict(keyring=settings['keyring']),
+                              name=settings['client'])
+        try:
+            cluster.connect()
+        except Exception as error:
+            raise RuntimeError("connection error: {}".format(error))
+        _clusters[key] = cluster
+    return _clusters[key]
+
+
+class PGWatcher(object):
+    """
+    Poll until a condition holds.  Polls every min_delay seconds while the
+    watched counts change and doubles the delay up to max_delay while they
+    are stable.  Gives up after timeout seconds without a change or once
+    the deadline in seconds has passed.
+    """
+
+    def __init__(self, timeout, min_delay=1, max_delay=12, deadline=None):
+        if max_delay <= 0:
+            raise ValueError("The delay cannot be 0")
+        self.timeout = timeout
+        self.min_delay = min(min_delay, max_delay)
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.samples = collections.deque(maxlen=RATE_SAMPLES)
+
+    def eta(self):
+        """
+        Return the seconds until nothing remains at the rate of the last
+        samples, None without progress
+        """
+        if not self.samples:
+            return None
+        last_time, last = self.samples[-1]
+        if last == 0:
+            return 0
+        first_time, first = self.samples[0]
+        if first <= last or last_time <= first_time:
+            return None
+        return int(math.ceil(last * (last_time - first_time) / float(first - last)))
+
+    def remaining(self):
+        """
+        Return the estimate for messages
+        """
+        eta = self.eta()
+        if eta is None:
+            return ""
+        return ", about {} seconds remaining".format(eta)
+
+    def watch(self, check):
+        """
+        Call check until it returns a result.  Otherwise, check returns None,
+        the counts to watch for changes and the number of items remaining.
+        """
+        end = None
+        if self.deadline is not None:
+            end = time.time() + self.deadline
+        idle = 0
+        delay = self.min_delay
+        last = None
+        while idle < self.timeout:
+            result, counts, remaining = check()
+            if result is not None:
+                return result
+            self.samples.append((time.time(), remaining))
+            if counts != last:
+                # Making progress - poll quickly and reset the timeout
+                last = counts
+                idle = 0
+                delay = self.min_delay
+            else:
+                delay = min(delay * 2, self.max_delay)
+            if end is not None:
+                left = end - time.time()
+                if left <= 0:
+                    raise RuntimeError("Deadline reached")
+                delay = min(delay, left)
+            log.debug("idle: {} delay: {} counts: {}".format(idle, delay, counts))
+            time.sleep(delay)
+            idle += delay
+        raise RuntimeError("Timeout expired")
+
+
 class OSDWeight(object):
     """
     Manage the setting and restoring of OSD crush weights
@@ -278,13 +379,7 @@ class OSDWeight(object):
         }
         self.settings.update(kwargs)
         log.debug("settings for OSDWeight: {}".format(pprint.pformat(self.settings)))
-        self.cluster = rados.Rados(conffile=self.settings['conf'],
-                                   conf=dict(keyring=self.settings['keyring']),
-                                   name=self.settings['client'])
-        try:
-            self.cluster.connect()
-        except Exception as error:
-            raise RuntimeError("connection error: {}".format(error))
+        self.cluster = _connect(self.settings)
 
     def save(self):
         """
@@ -372,19 +467,22 @@ class OSDWeight(object):
 
     def wait(self):
         """
-        Wait until PGs reach 0 or timeout expires
+        Wait until PGs reach 0 or timeout expires.  Polls quickly while PGs
+        move off the OSD and backs off to the delay while none do.
         """
-        i = 0
-        last_pgs = 0
-        msg = "unexpected error"
-        fmt_msg = "osd.{} has {} PGs remaining"
-
-        while i < self.settings['timeout']/self.settings['delay']:
+        watcher = PGWatcher(self.settings['timeout'], max_delay=self.settings['delay'],
+                            deadline=self.settings.get('deadline'))
+        status = {'msg': "unexpected error"}
+
+        def _check():
+            """
+            Return the message once safe, otherwise the remaining PGs
+            """
             rc, out = self.osd_safe_to_destroy()
             if rc == 0:
                 msg = "osd.{} is safe to destroy".format(self.osd_id)
                 log.info(msg)
-                return msg
+                return msg, None, 0
 
             entry = self.osd_df()
             pgs = entry.get('pgs')
@@ -392,21 +490,19 @@ class OSDWeight(object):
             if pgs is None:
                 msg = "osd.{} does not exist. {}".format(self.osd_id, out)
             else:
-                msg = fmt_msg.format(self.osd_id, pgs)
+                msg = "osd.{} has {} PGs remaining".format(self.osd_id, pgs)
                 if pgs == 0:
                     msg = "{}, but {}".format(msg, out)
-                elif last_pgs != pgs:
-                    # Making progress, reset countdown
-                    i = 0
-                    last_pgs = pgs
-
-            log.warning(msg)
-            i += 1
-            time.sleep(self.settings['delay'])
+            status['msg'] = msg
+            log.warning(msg + watcher.remaining())
+            return None, pgs, pgs or 0
 
-        msg = "Timeout expired - " + msg
-        log.error(msg)
-        return msg
+        try:
+            return watcher.watch(_check)
+        except RuntimeError as error:
+            msg = "{} - {}".format(error, status['msg'])
+            log.error(msg)
+            return msg
 
 
 class CephPGs(object):
@@ -427,55 +523,47 @@ class CephPGs(object):
         }
         self.settings.update(kwargs)
         log.debug("settings: {}".format(pprint.pformat(self.settings)))
-        self.cluster = rados.Rados(conffile=self.settings['conf'],
-                                   conf=dict(keyring=self.settings['keyring']),
-                                   name=self.settings['client'])
-        try:
-            self.cluster.connect()
-        except Exception as error:
-            raise RuntimeError("connection error: {}".format(error))
+        self.cluster = _connect(self.settings)
 
     def quiescent(self):
         """
         Wait until PGs are active+clean or timeout is reached.  Default is a
-        2 minute sliding window.  Return if no PGs are present.
+        2 minute sliding window.  Return if no PGs are present.  Polls
+        quickly while PG states change and backs off to the delay while
+        they are stable.
         """
-        i = 0
-        last = []
-        if self.settings['delay'] == 0:
-            raise ValueError("The delay cannot be 0")
-        while i < self.settings['timeout']/self.settings['delay']:
+        watcher = PGWatcher(self.settings['timeout'], max_delay=self.settings['delay'],
+                            deadline=self.settings.get('deadline'))
+
+        def _check():
+            """
+            Return whether PGs are active+clean, otherwise the PG states
+            """
             current = self.pg_states()
             if not current:
                 log.warning("PGs are not present")
-                return False
+                return False, None, 0
             if len(current) == 1 and current[0]['name'] == 'active+clean':
                 log.warning("PGs are active+clean")
-                return True
-            log.warning("Waiting on active+clean {}".format(pprint.pformat(current)))
-            if self._pg_value(last) != self._pg_value(current):
-                # Making progress - reset counter
-                log.debug("Resetting active+clean counter")
-                i = 0
-                last = current
-
-            i += 1
-            log.debug("iteration: {} last: {} current: {}".
-                      format(i, self._pg_value(last), self._pg_value(current)))
-            time.sleep(self.settings['delay'])
-
-        log.error("Timeout expired waiting on active+clean")
-        raise RuntimeError("Timeout expired waiting on active+clean")
+                return True, None, 0
+            log.warning("Waiting on active+clean{} {}".format(watcher.remaining(),
+                                                              pprint.pformat(current)))
+            counts = sorted((entry['name'], entry['num']) for entry in current)
+            return None, counts, self._pending(current)
+
+        try:
+            return watcher.watch(_check)
+        except RuntimeError as error:
+            msg = "{} waiting on active+clean{}".format(error, watcher.remaining())
+            log.error(msg)
+            raise RuntimeError(msg)
 
     # pylint: disable=no-self-use
-    def _pg_value(self, entries):
+    def _pending(self, entries):
         """
-        Return the value for the active+clean entry
+        Return the number of PGs that are not active+clean
         """
-        for entry in entries:
-            if 'name' in entry and entry['name'] == 'active+clean':
-                return entry['num']
-        return 0
+        return sum(entry['num'] for entry in entries if entry['name'] != 'active+clean')
 
     def pg_states(self):
         """
@@ -487,6 +575,67 @@ class CephPGs(object):
         return json.loads(output)['pg_summary']['num_pg_by_state']
 
 
+class OSDDrain(object):
+    """
+    Query the progress of several emptying OSDs at once
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Initialize settings, connect to Ceph cluster
+        """
+        self.settings = {
+            'conf': "/etc/ceph/ceph.conf",
+            'keyring': '/etc/ceph/ceph.client.admin.keyring',
+            'client': 'client.admin',
+        }
+        self.settings.update(kwargs)
+        log.debug("settings for OSDDrain: {}".format(pprint.pformat(self.settings)))
+        self.cluster = _connect(self.settings)
+
+    def pgs(self):
+        """
+        Return the PGs of every OSD from a single osd df
+        """
+        cmd = json.dumps({"prefix": "osd df", "format": "json"})
+        _, output, _ = self.cluster.mon_command(cmd, b'', timeout=6)
+        return dict((entry['id'], entry['pgs']) for entry in json.loads(output)['nodes'])
+
+    def safe_to_destroy(self, osd_ids):
+        """
+        Return the OSDs that are safe to destroy.  A single query answers
+        for all OSDs unless Ceph does not list them, then each is asked.
+        """
+        cmd = json.dumps({"prefix": "osd safe-to-destroy",
+                          "ids": ["{}".format(osd_id) for osd_id in osd_ids],
+                          "format": "json"})
+        rc, output, _ = self.cluster.mon_command(cmd, b'', timeout=6)
+        try:
+            return set(int(osd_id) for osd_id in json.loads(output)['safe_to_destroy'])
+        except (ValueError, KeyError, TypeError):
+            if rc == 0:
+                return set(int(osd_id) for osd_id in osd_ids)
+        safe = set()
+        for osd_id in osd_ids:
+            cmd = json.dumps({"prefix": "osd safe-to-destroy",
+                              "ids": ["{}".format(osd_id)]})
+            rc, _, _ = self.cluster.mon_command(cmd, b'', timeout=6)
+            if rc == 0:
+                safe.add(int(osd_id))
+        return safe
+
+    def status(self, osd_ids):
+        """
+        Return the remaining PGs of each OSD, None for missing OSDs, and
+        whether it is safe to destroy
+        """
+        pgs = self.pgs()
+        safe = self.safe_to_destroy(osd_ids)
+        return dict(("{}".format(osd_id),
+                     {'pgs': pgs.get(int(osd_id)), 'safe': int(osd_id) in safe})
+                    for osd_id in osd_ids)
+
+
 def _settings(**kwargs):
     """
     Initialize settings to use the client.storage name and keyring
@@ -502,13 +651,14 @@ def _settings(**kwargs):
             'keyring': storage_keyring,
             'client': 'client.storage'
         }
-        settings.update(kwargs)
+    settings.update(kwargs)
     return settings
 
 
 def ceph_quiescent(**kwargs):
     """
-    Check that PGs are active+clean
+    Wait until PGs are active+clean.  A deadline in seconds limits the
+    wait even while PGs are making progress.
     """
     settings = _settings(**kwargs)
 
@@ -660,7 +810,8 @@ def is_empty(osd_id, **kwargs):
 
 def wait_until_empty(osd_id, **kwargs):
     """
-    Check whether an OSD has an PGs
+    Wait until an OSD has no PGs.  A deadline in seconds limits the wait
+    even while PGs are moving.
     """
     settings = _settings(**kwargs)
     OSDDevices()
@@ -668,6 +819,15 @@ def wait_until_empty(osd_id, **kwargs):
     return osdw.wait()
 
 
+def drain_status(*args, **kwargs):
+    """
+    Return the remaining PGs of a list of OSDs and whether each is safe to
+    destroy, without waiting
+    """
+    settings = _settings(**kwargs)
+    return OSDDrain(**settings).status(args)
+
+
 class OSDDevices(object):
     """
     Gather the partitions for an OSD
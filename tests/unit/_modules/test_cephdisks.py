@@ -223,3 +223,73 @@ class TestInventory(object):
     @pytest.mark.skip(reason="Offloaded to ceph-volume")
     def test_find_by_osd_id(self):
         pass
+
+
+class ReportDevice(SimpleDevice):
+    is_ceph_disk_member = False
+
+    def json_report(self):
+        return {'path': self.path, 'sys_api': {'size': self.size}}
+
+
+@pytest.fixture
+def scan(tmpdir):
+    cephdisks.__context__ = {}
+    cephdisks.__opts__ = {'cachedir': str(tmpdir)}
+    with patch.object(cephdisks, 'load_ceph_volume_devices') as devices, \
+            patch.object(cephdisks, 'load_ceph_volume_device') as device, \
+            patch.object(cephdisks.Inventory, '_find_root_disk',
+                         return_value='/dev/sda'), \
+            patch.object(cephdisks.Inventory, '_find_raid_devices',
+                         return_value=set()):
+        devices.return_value.devices = [
+            ReportDevice({'path': '/dev/sdb'}), ReportDevice({'path': '/dev/sdc'})]
+        device.return_value = lambda path: ReportDevice({'path': path})
+        yield devices
+
+
+class TestSnapshot(object):
+    def test_reused_within_job(self, scan):
+        first = cephdisks.unused(__pub_jid='1')
+        assert cephdisks.all_(__pub_jid='1') == first
+        assert cephdisks.devices(__pub_jid='1') == ['/dev/sdb', '/dev/sdc']
+        assert scan.call_count == 1
+
+    def test_new_job_scans(self, scan):
+        cephdisks.unused(__pub_jid='1')
+        cephdisks.unused(__pub_jid='2')
+        assert scan.call_count == 2
+
+    def test_refresh(self, scan):
+        cephdisks.unused()
+        cephdisks.unused(refresh=True)
+        assert scan.call_count == 2
+
+    def test_report_is_a_copy(self, scan):
+        cephdisks.unused().pop()
+        assert len(cephdisks.unused()) == 2
+
+    def test_snapshot_device(self, scan):
+        assert cephdisks.snapshot_device('/dev/sdb').path == '/dev/sdb'
+        partition = cephdisks.snapshot_device('/dev/sdb1')
+        assert cephdisks.snapshot_device('/dev/sdb1') is partition
+
+    def test_persisted(self, scan):
+        cephdisks.__opts__['cephdisks_cache_ttl'] = 30
+        first = cephdisks.unused(__pub_jid='1')
+        cephdisks.__context__ = {}
+        assert cephdisks.unused(__pub_jid='2') == first
+        assert scan.call_count == 1
+
+    def test_persisted_refresh(self, scan):
+        cephdisks.__opts__['cephdisks_cache_ttl'] = 30
+        cephdisks.unused()
+        cephdisks.unused(refresh=True)
+        assert scan.call_count == 2
+
+    def test_invalidate(self, scan):
+        cephdisks.__opts__['cephdisks_cache_ttl'] = 30
+        cephdisks.unused()
+        cephdisks.invalidate()
+        cephdisks.unused()
+        assert scan.call_count == 2
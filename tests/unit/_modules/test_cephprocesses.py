@@ -1,3 +1,4 @@
+import os
 import pytest
 import sys
 sys.path.insert(0, 'srv/salt/_modules')
@@ -402,6 +403,27 @@ class TestMetaCheck():
             mc.down = [proc_name_down]
             assert mc.report() == {'up': {'ceph-osd': [0]}, 'down': {'ceph-mds': 'ceph-mds', 'ceph-osd': ['1', '3']}}
 
+    @patch('srv.salt._modules.cephprocesses.Popen')
+    def test_report_single_systemctl_call(self, po, mc):
+        """
+        down processes and missing OSDs share one systemctl call
+        """
+        cephprocesses.__salt__ = {'mds.get_name': lambda host: host}
+        po.return_value.communicate.return_value = (
+            b"UnitFileState=enabled\n\nUnitFileState=disabled\n\nUnitFileState=enabled\n", "")
+        with mock.patch('srv.salt._modules.cephprocesses.MetaCheck._missing_osds',
+                        new_callable=mock.PropertyMock) as missing_mock:
+            missing_mock.return_value = ['1', '3']
+            mc.insufficient_osd_count = True
+            mc.up = []
+            mc.down = ['ceph-mds']
+            assert mc.report() == {'up': {}, 'down': {'ceph-mds': 'ceph-mds',
+                                                      'ceph-osd': ['1', '3']}}
+        mc.insufficient_osd_count = False
+        assert po.call_count == 1
+        assert po.call_args[0][0] == ['systemctl', 'show', '--property=UnitFileState',
+                                      'ceph-mds@a_hostname', 'ceph-osd@1', 'ceph-osd@3']
+
 
 class TestInstanceMethods():
 
@@ -454,6 +476,80 @@ class TestInstanceMethods():
         mock_check_osds.assert_called_once is False
         mock_report.assert_called
 
+class TestProcInfos():
+
+    @mock.patch('srv.salt._modules.cephprocesses.psutil.process_iter')
+    def test_one_pass_for_all_roles(self, process_iter):
+        cephprocesses.__pillar__ = {'roles': ['mon', 'storage']}
+        cephprocesses.__salt__ = {'osd.list': lambda: ['1'], 'pillar.get': lambda key: {}}
+        mon = MockedPsUtil('ceph-mon', 10, 0, '/usr/bin/ceph-mon')
+        osd = MockedPsUtil('ceph-osd', 11, 0, '/usr/bin/ceph-osd', osd_id=1)
+        process_iter.return_value = [mon, osd]
+        assert cephprocesses.check(results=True) == {
+            'up': {'ceph-mon': [10], 'ceph-osd': [11]}, 'down': {}}
+        assert process_iter.call_count == 1
+
+    @mock.patch('srv.salt._modules.cephprocesses.psutil.process_iter')
+    def test_check_roles(self, process_iter):
+        cephprocesses.__pillar__ = {'roles': ['mon', 'mgr', 'storage']}
+        cephprocesses.__salt__ = {'osd.list': lambda: ['1'], 'pillar.get': lambda key: {}}
+        process_iter.return_value = [MockedPsUtil('ceph-mon', 10, 0, '/usr/bin/ceph-mon'),
+                                     MockedPsUtil('ceph-osd', 11, 0, '/usr/bin/ceph-osd', osd_id=1)]
+        assert cephprocesses.check_roles(quiet=True) == {'mon': True, 'mgr': False,
+                                                         'storage': True}
+        assert cephprocesses.check_roles(roles=['storage', 'rgw']) == {'storage': True,
+                                                                       'rgw': False}
+        assert process_iter.call_count == 2
+
+    @mock.patch('srv.salt._modules.cephprocesses.psutil.process_iter')
+    def test_skips_vanished(self, process_iter):
+        gone = MockedPsUtil('ceph-mon', 10, 0, '/usr/bin/ceph-mon')
+        gone.exe = MagicMock(side_effect=cephprocesses.psutil.NoSuchProcess(10))
+        osd = MockedPsUtil('ceph-osd', 11, 0, '/usr/bin/ceph-osd', osd_id=1)
+        process_iter.return_value = [gone, osd]
+        procs = cephprocesses._proc_infos()
+        assert [proc.pid for proc in procs] == [11]
+
+    def test_osd_id_single_cmdline_read(self):
+        proc = MockedPsUtil('ceph-osd', 0, 0, '/usr/bin/ceph-osd', osd_id=7)
+        proc.cmdline = MagicMock(return_value=['/usr/bin/ceph-osd', '--id', '7'])
+        assert cephprocesses.ProcInfo(proc).osd_id == '7'
+        assert proc.cmdline.call_count == 1
+
+    def test_osd_id_missing(self):
+        proc = MockedPsUtil('ceph-osd', 0, 0, '/usr/bin/ceph-osd')
+        proc.cmdline = MagicMock(return_value=['/usr/bin/ceph-osd', '--id'])
+        with pytest.raises(cephprocesses.NoOSDIDFound):
+            cephprocesses.ProcInfo(proc)
+
+
+class TestUnitStates():
+
+    @patch('srv.salt._modules.cephprocesses.Popen')
+    def test_no_units(self, po):
+        assert cephprocesses._unit_states([]) == {}
+        assert po.called is False
+
+    @patch('srv.salt._modules.cephprocesses.Popen')
+    def test_states(self, po):
+        po.return_value.communicate.return_value = (
+            b"UnitFileState=enabled\n\nUnitFileState=\n", "")
+        states = cephprocesses._unit_states(['ceph-osd@1', 'ceph-osd@2', 'ceph-osd@1'])
+        assert states == {'ceph-osd@1': 'enabled', 'ceph-osd@2': ''}
+        assert po.call_count == 1
+
+    @patch('srv.salt._modules.cephprocesses.Popen')
+    def test_mismatch(self, po):
+        po.return_value.communicate.return_value = (b"UnitFileState=enabled\n", "")
+        assert cephprocesses._unit_states(['ceph-osd@1', 'ceph-osd@2']) == {}
+
+    @patch('srv.salt._modules.cephprocesses.Popen')
+    def test_queried_states(self, po):
+        unit = cephprocesses.SystemdUnit('ceph-osd', 1, states={'ceph-osd@1': 'disabled'})
+        assert unit.is_disabled is True
+        assert po.called is False
+
+
 class TestSystemdUnit():
 
 
@@ -503,7 +599,7 @@ class TestSystemdUnit():
 
         """
         cephprocesses.__grains__ = {'host': 'a_host'}
-        po.return_value.communicate.return_value = (b"enabled\n ", "")
+        po.return_value.communicate.return_value = (b"UnitFileState=enabled\n", "")
         ret = cephprocesses.SystemdUnit('ceph-mon').is_disabled
         assert ret is False
         log.info.assert_called_once_with('Found ceph-mon@a_host to be enabled')
@@ -516,7 +612,7 @@ class TestSystemdUnit():
         log should be called. (once)
         """
         cephprocesses.__grains__ = {'host': 'a_host'}
-        po.return_value.communicate.return_value = (b"disabled\n ", "")
+        po.return_value.communicate.return_value = (b"UnitFileState=disabled\n", "")
         ret = cephprocesses.SystemdUnit('ceph-mon').is_disabled
         assert ret is True
         log.info.assert_called_once_with('Found ceph-mon@a_host to be disabled')
@@ -529,7 +625,7 @@ class TestSystemdUnit():
         log should be called. (once)
         """
         cephprocesses.__grains__ = {'host': 'a_host'}
-        po.return_value.communicate.return_value = (b"undefined\n ", "")
+        po.return_value.communicate.return_value = (b"UnitFileState=undefined\n", "")
         ret = cephprocesses.SystemdUnit('ceph-mon').is_disabled
         assert ret is False
         log.info.assert_called_once_with('Expected to get disabled/enabled but got undefined instead')
@@ -544,7 +640,8 @@ class TestSystemdUnit():
         log should be called. (twice)
         """
         cephprocesses.__grains__ = {'host': 'a_host'}
-        po.return_value.communicate.side_effect = [(b"enabled\n ", ""), (b"disabled\n ", "")]
+        po.return_value.communicate.return_value = (
+            b"UnitFileState=enabled\n\nUnitFileState=disabled\n", "")
         ret = cephprocesses.SystemdUnit('ganesha.nfsd').is_disabled
         assert ret is True
         log.info.assert_called_with('Found rpcbind to be disabled')
@@ -573,4 +670,63 @@ class TestSystemdUnit():
         po.return_value.communicate.return_value = ("", "stderr")
         ret = cephprocesses.SystemdUnit('ceph-mon').is_disabled
         assert ret is False
-        log.error.assert_called_once_with('Requesting the is-enabled flag from ceph-mon@a_host has resulted in stderr')
+        log.error.assert_called_once_with("Requesting the UnitFileState from ['ceph-mon@a_host'] has resulted in stderr")
+
+
+class TestNeedRestart():
+
+    @pytest.fixture
+    def proc(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(cephprocesses, 'PROC', str(tmpdir))
+        cephprocesses.__pillar__ = {}
+        cephprocesses.__salt__ = {'helper.convert_out': lambda out: out.decode('utf-8')}
+        return tmpdir
+
+    def _process(self, proc, pid, name, maps=(), fds=()):
+        pid_dir = proc.mkdir(str(pid))
+        pid_dir.join('comm').write(name + '\n')
+        pid_dir.join('maps').write(''.join(
+            '7f0000000000-7f0000001000 r-xp 00000000 08:01 1234    {}\n'.format(path)
+            for path in maps))
+        fd_dir = pid_dir.mkdir('fd')
+        for number, target in enumerate(fds):
+            os.symlink(target, str(fd_dir.join(str(number))))
+        return pid_dir
+
+    def test_deleted_library(self, proc):
+        self._process(proc, 10, 'ceph-osd', maps=['/usr/lib64/libceph-common.so.0 (deleted)'])
+        self._process(proc, 11, 'ceph-mon', maps=['/usr/lib64/libc.so.6'])
+        assert [entry['name'] for entry in cephprocesses._process_map()] == ['ceph-osd']
+
+    def test_deleted_fd(self, proc):
+        self._process(proc, 10, 'ceph-mgr', fds=['/var/lib/ceph/tmp/x (deleted)'])
+        assert [entry['pid'] for entry in cephprocesses._process_map()] == ['10']
+
+    def test_ignored(self, proc):
+        self._process(proc, 10, 'ceph-osd', maps=['/memfd:jit (deleted)', '[heap]'],
+                      fds=['socket:[1234]', '/dev/shm/x (deleted)'])
+        assert cephprocesses._process_map() == []
+
+    def test_other_processes_not_inspected(self, proc):
+        self._process(proc, 10, 'bash', maps=['/usr/lib64/libc.so.6 (deleted)'])
+        proc.mkdir('self')
+        assert cephprocesses._process_map() == []
+
+    @patch('srv.salt._modules.cephprocesses.Popen')
+    def test_need_restart_lsof(self, po, proc):
+        po.return_value.communicate.return_value = (b"ceph-radosgw@rgw1\n", "")
+        self._process(proc, 10, 'ceph-osd', maps=['/usr/lib64/librados.so.2 (deleted)'])
+        assert cephprocesses.need_restart_lsof(role='storage') is True
+        assert cephprocesses.need_restart_lsof(role='rgw') is True
+        assert cephprocesses.need_restart_lsof(role='mon') is False
+
+    @patch('srv.salt._modules.cephprocesses.Popen')
+    def test_rescan(self, po, proc, monkeypatch):
+        po.return_value.communicate.return_value = (b"", "")
+        self._process(proc, 10, 'ceph-osd', maps=['/usr/lib64/librados.so.2 (deleted)'])
+        monkeypatch.setattr(cephprocesses, '__grains__', {}, raising=False)
+        assert cephprocesses.need_restart(role='storage') is True
+        proc.remove()
+        proc.mkdir()
+        assert cephprocesses.need_restart(role='storage') is False
+        assert po.call_count == 2
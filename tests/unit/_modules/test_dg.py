@@ -1,3 +1,4 @@
+import random
 import pytest
 from mock import patch, call, Mock, PropertyMock
 from srv.salt._modules import dg
@@ -407,9 +408,9 @@ class TestDriveGroup(object):
             self.check_filter_support.start()
 
             dg.__salt__ = dict()
-            dg.__salt__['cephdisks.all'] = lambda : []
-            dg.__salt__['cephdisks.unused'] = lambda : []
-            dg.__salt__['cephdisks.used'] = lambda : []
+            dg.__salt__['cephdisks.all'] = lambda **kwargs: []
+            dg.__salt__['cephdisks.unused'] = lambda **kwargs: []
+            dg.__salt__['cephdisks.used'] = lambda **kwargs: []
 
             dgo = dg.DriveGroup(raw_sample)
             return dgo
@@ -1029,9 +1030,11 @@ class TestDriveGroup(object):
         inventory()
         dg.__salt__ = dict()
         dg.__salt__['helper.run'] = Mock()
+        dg.__salt__['cephdisks.invalidate'] = Mock()
         ret = dg.Output(filter_args=test_fix.filter_args).deploy()
         log.error.assert_called_with(c_v_command.return_value[0])
         dg.__salt__['helper.run'].assert_called_with('ceph-volume lvm foo')
+        dg.__salt__['cephdisks.invalidate'].assert_called_once_with()
 
     def test_check_for_old_profiles(self, test_fix, inventory):
         """ No pillar no bypass"""
@@ -1118,3 +1121,100 @@ class TestPublicMethods(object):
     def test_list(self, report_mock):
         dg.list_()
         report_mock.assert_called_once()
+
+
+# The per disk loop of _filter_devices before the disk table, kept as
+# reference
+def _ref_filter_devices(disks, device_filter):
+    devices = list()
+    for name, val in device_filter.items():
+        _filter = dg.Filter(name=name, value=val)
+        for disk in disks:
+            if not _filter.is_matchable:
+                continue
+            if not _filter.matcher.compare(disk):
+                continue
+            if not dg.DriveGroup._has_mandatory_idents(disk):
+                continue
+            if dg.DriveGroup._limit_reached(device_filter, len(devices),
+                                            disk.get('path')):
+                continue
+            if disk not in devices:
+                devices.append(disk)
+    for taken_device in devices:
+        if taken_device in disks:
+            disks.remove(taken_device)
+    return sorted(devices, key=lambda dev: dev.get('path', ''))
+
+
+def _random_disks(rnd, count):
+    disks = []
+    for number in range(count):
+        if rnd.random() < 0.05:
+            disks.append({})
+            continue
+        path = '/dev/sd{}'.format(number)
+        size = rnd.choice(['20.00 GB', '50.00 GB', '1.82 TB', '3.64 TB'])
+        disks.append({
+            'available': True,
+            'path': path,
+            'sys_api': {
+                'human_readable_size': size,
+                'model': rnd.choice(['42-RGB', 'fast-ssd', 'ST4000']),
+                'path': path,
+                'rotational': rnd.choice(['0', '1']),
+                'vendor': rnd.choice(['samsung', 'seagate', 'intel']),
+            }
+        })
+        if rnd.random() < 0.05:
+            # A duplicate entry
+            disks.append(dict(disks[-1]))
+    return disks
+
+
+class TestDiskTable(object):
+
+    def setup_method(self):
+        dg.__grains__ = {'virtual': 'physical'}
+
+    @pytest.fixture
+    def drive_group(self):
+        def make(disks):
+            with patch('srv.salt._modules.dg.Inventory.disks',
+                       new_callable=PropertyMock, return_value=disks):
+                return dg.DriveGroup({})
+        return make
+
+    @pytest.mark.parametrize("seed", range(50))
+    def test_filter_devices_equivalence(self, drive_group, seed):
+        rnd = random.Random(seed)
+        disks = _random_disks(rnd, rnd.randint(0, 100))
+        expected_disks = [dict(disk) for disk in disks]
+        dgo = drive_group(disks)
+        filters = [
+            {'rotational': '1', 'size': '1T:', 'limit': rnd.randint(0, 40)},
+            {'model': 'fast', 'vendor': 'intel'},
+            {'size': ':60G', 'limit': rnd.randint(0, 3)},
+            {'all': True, 'limit': rnd.randint(0, 5)},
+        ]
+        for device_filter in filters:
+            assert (dgo._filter_devices(device_filter) ==
+                    _ref_filter_devices(expected_disks, device_filter))
+            assert dgo.disks == expected_disks
+
+    def test_compares_each_value_once(self, drive_group):
+        dgo = drive_group(_random_disks(random.Random(1), 90))
+        with patch.object(dg.SubstringMatcher, 'compare_value',
+                          autospec=True, return_value=True) as compare:
+            dgo._filter_devices({'model': 'fast'})
+        assert compare.call_count == 3
+
+    def test_missing_key_raises(self, drive_group):
+        dgo = drive_group([{'path': '/dev/sda', 'sys_api': {}}])
+        with pytest.raises(Exception):
+            dgo._filter_devices({'model': 'fast'})
+
+    def test_missing_path_raises(self, drive_group):
+        dgo = drive_group([{'sys_api': {'model': 'fast'}}])
+        with pytest.raises(Exception):
+            dgo._filter_devices({'model': 'fast'})
@@ -0,0 +1,55 @@
+from mock import MagicMock
+from srv.salt._modules import multi
+
+PING_OUT = """PING 10.0.0.2 (10.0.0.2) 56(84) bytes of data.
+
+--- 10.0.0.2 ping statistics ---
+5 packets transmitted, 5 received, 0% packet loss, time 804ms
+rtt min/avg/max/mdev = 0.051/0.073/0.101/0.019 ms
+"""
+
+LOST_OUT = """PING 10.0.0.9 (10.0.0.9) 56(84) bytes of data.
+
+--- 10.0.0.9 ping statistics ---
+5 packets transmitted, 0 received, 100% packet loss, time 819ms
+"""
+
+
+class TestMulti():
+
+    def test_parse_ping(self):
+        stats = multi._parse_ping(PING_OUT)
+        assert stats == {'min': 0.051, 'avg': 0.073, 'max': 0.101,
+                         'mdev': 0.019, 'loss': 0.0}
+
+    def test_parse_ping_lost(self):
+        assert multi._parse_ping(LOST_OUT) == {'loss': 100.0}
+
+    def test_summarize_ping(self):
+        results = [('10.0.0.2', 0, PING_OUT, ''),
+                   ('10.0.0.3', 0, PING_OUT, ''),
+                   ('10.0.0.4', 0, PING_OUT.replace('0.051/0.073', '0.051/0.950'), ''),
+                   ('10.0.0.9', 1, LOST_OUT, ''),
+                   ('10.0.0.10', 2, '', 'ping not found')]
+        msg = multi._summarize_ping(results)
+        assert msg['succeeded'] == 3
+        assert msg['failed'] == '10.0.0.9'
+        assert msg['errored'] == '10.0.0.10'
+        assert msg['slow'] == '10.0.0.4'
+        assert msg['hosts']['10.0.0.9'] == {'loss': 100.0}
+        assert msg['hosts']['10.0.0.2']['mdev'] == 0.019
+
+    def test_ping_count(self):
+        run = MagicMock(return_value=(0, PING_OUT, ''))
+        multi.__salt__ = {'helper.run': run}
+        multi.ping('10.0.0.2', count=5)
+        cmd = run.call_args[0][0]
+        assert '-c5' in cmd
+
+    def test_summarize_ping_lower_median(self):
+        results = [('10.0.0.{}'.format(num), 0,
+                    PING_OUT.replace('0.051/0.073', '0.051/{}'.format(avg)), '')
+                   for num, avg in enumerate(['0.100', '0.200', '0.500', '0.700'])]
+        # median 0.2, so only hosts above 0.6 are slow
+        assert multi._summarize_ping(results)['slow'] == '10.0.0.3'
+
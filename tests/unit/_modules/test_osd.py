@@ -286,7 +286,7 @@ class TestOSDWeight():
         """
         Check that wait can timeout
         """
-        od = {}
+        od.return_value = {}
         ostd.return_value = (-16, "Ceph is busy")
         with patch.object(osd.OSDWeight, "__init__", lambda self, _id: None):
             osdw = osd.OSDWeight(0)
@@ -302,7 +302,7 @@ class TestOSDWeight():
         """
         Check that wait does loop
         """
-        od = {}
+        od.return_value = {}
         ostd.return_value = (-16, "Ceph is busy")
         with patch.object(osd.OSDWeight, "__init__", lambda self, _id: None):
             osdw = osd.OSDWeight(0)
@@ -310,3 +310,168 @@ class TestOSDWeight():
             osdw.settings = {'timeout': 2, 'delay': 1, 'osd_id': 0}
             ret = osdw.wait()
             assert ostd.call_count == 2
+
+
+class TestPGWatcher():
+
+    @patch('time.sleep')
+    def test_backs_off_while_stable(self, sleep):
+        watcher = osd.PGWatcher(60, min_delay=1, max_delay=12)
+        answers = iter([5, 4, 4, 4, 4, 4])
+
+        def check():
+            pgs = next(answers, 0)
+            return ('done' if pgs == 0 else None), pgs, pgs
+
+        assert watcher.watch(check) == 'done'
+        assert [args[0] for args, _ in sleep.call_args_list] == [1, 1, 2, 4, 8, 12]
+
+    @patch('time.sleep')
+    def test_timeout_without_change(self, sleep):
+        watcher = osd.PGWatcher(20, min_delay=1, max_delay=12)
+        with pytest.raises(RuntimeError) as excinfo:
+            watcher.watch(lambda: (None, 3, 3))
+        assert 'Timeout expired' in str(excinfo.value)
+        assert sum(args[0] for args, _ in sleep.call_args_list) >= 20
+
+    @patch('time.sleep')
+    @patch('time.time')
+    def test_deadline(self, now, sleep):
+        clock = iter(range(0, 1000, 10))
+        now.side_effect = lambda: next(clock)
+        watcher = osd.PGWatcher(600, min_delay=1, max_delay=12, deadline=25)
+        counts = iter(range(100, 0, -1))
+        with pytest.raises(RuntimeError) as excinfo:
+            watcher.watch(lambda: (None, next(counts), 1))
+        assert 'Deadline reached' in str(excinfo.value)
+
+    def test_zero_delay(self):
+        with pytest.raises(ValueError):
+            osd.PGWatcher(120, max_delay=0)
+
+    def test_eta(self):
+        watcher = osd.PGWatcher(120)
+        assert watcher.eta() is None
+        watcher.samples.extend([(100, 50), (110, 40), (120, 30)])
+        assert watcher.eta() == 30
+        assert 'about 30 seconds' in watcher.remaining()
+
+    def test_eta_no_progress(self):
+        watcher = osd.PGWatcher(120)
+        watcher.samples.extend([(100, 30), (110, 40)])
+        assert watcher.eta() is None
+        assert watcher.remaining() == ""
+
+
+class TestCephPGs():
+    """
+    Override the __init__ function to avoid the rados logic
+    """
+
+    @pytest.fixture
+    def pgs(self):
+        with patch.object(osd.CephPGs, "__init__", lambda self: None):
+            ceph_pgs = osd.CephPGs()
+            ceph_pgs.settings = {'timeout': 120, 'delay': 12}
+            yield ceph_pgs
+
+    @patch('time.sleep')
+    def test_quiescent(self, sleep, pgs):
+        pgs.pg_states = MagicMock(side_effect=[
+            [{'name': 'active+clean', 'num': 10}, {'name': 'active+recovering', 'num': 2}],
+            [{'name': 'active+clean', 'num': 11}, {'name': 'active+recovering', 'num': 1}],
+            [{'name': 'active+clean', 'num': 12}]])
+        assert pgs.quiescent() is True
+        assert [args[0] for args, _ in sleep.call_args_list] == [1, 1]
+
+    def test_quiescent_no_pgs(self, pgs):
+        pgs.pg_states = MagicMock(return_value=[])
+        assert pgs.quiescent() is False
+
+    @patch('time.sleep')
+    def test_quiescent_timeout(self, sleep, pgs):
+        pgs.settings = {'timeout': 10, 'delay': 4}
+        pgs.pg_states = MagicMock(return_value=[
+            {'name': 'active+clean', 'num': 10}, {'name': 'peering', 'num': 2}])
+        with pytest.raises(RuntimeError) as excinfo:
+            pgs.quiescent()
+        assert 'waiting on active+clean' in str(excinfo.value)
+
+    @patch('time.sleep')
+    @patch('srv.salt._modules.osd.OSDWeight.osd_df')
+    @patch('srv.salt._modules.osd.OSDWeight.osd_safe_to_destroy')
+    def test_wait_polls_quickly_while_moving(self, ostd, od, sleep):
+        ostd.side_effect = [(-16, "busy"), (-16, "busy"), (0, "safe")]
+        od.side_effect = [{'pgs': 20}, {'pgs': 10}]
+        with patch.object(osd.OSDWeight, "__init__", lambda self, _id: None):
+            osdw = osd.OSDWeight(0)
+            osdw.osd_id = 0
+            osdw.settings = {'timeout': 60, 'delay': 6}
+            assert osdw.wait() == 'osd.0 is safe to destroy'
+        assert [args[0] for args, _ in sleep.call_args_list] == [1, 1]
+
+
+class TestSettings():
+
+    @patch('os.path.exists', return_value=False)
+    def test_no_storage_keyring(self, exists):
+        assert osd._settings(deadline=300) == {'deadline': 300}
+
+    @patch('os.path.exists', return_value=True)
+    def test_storage_keyring(self, exists):
+        assert osd._settings(deadline=300) == {
+            'keyring': '/etc/ceph/ceph.client.storage.keyring',
+            'client': 'client.storage',
+            'deadline': 300}
+
+    @patch('srv.salt._modules.osd.CephPGs')
+    @patch('os.path.exists', return_value=False)
+    def test_ceph_quiescent_deadline(self, exists, ceph_pgs):
+        osd.ceph_quiescent(deadline=300)
+        ceph_pgs.assert_called_once_with(deadline=300)
+
+
+class TestConnect():
+
+    def test_shared(self):
+        osd._clusters.clear()
+        settings = {'conf': 'ceph.conf', 'keyring': 'admin.keyring', 'client': 'client.admin'}
+        with patch.object(osd, 'rados', create=True) as rados:
+            first = osd._connect(settings)
+            second = osd._connect(dict(settings))
+            assert first is second
+            assert rados.Rados.return_value.connect.call_count == 1
+            osd._connect(dict(settings, client='client.storage'))
+            assert rados.Rados.call_count == 2
+        osd._clusters.clear()
+
+
+class TestOSDDrain():
+    """
+    Override the __init__ function to avoid the rados logic
+    """
+
+    @pytest.fixture
+    def drain(self):
+        with patch.object(osd.OSDDrain, "__init__", lambda self: None):
+            osdd = osd.OSDDrain()
+            osdd.cluster = MagicMock()
+            yield osdd
+
+    def test_status(self, drain):
+        df = '{"nodes": [{"id": 1, "pgs": 0}, {"id": 2, "pgs": 12}]}'
+        safe = '{"safe_to_destroy": [1], "active": [2]}'
+        drain.cluster.mon_command.side_effect = [(0, df, ''), (-16, safe, '')]
+        assert drain.status([1, 2, 3]) == {
+            '1': {'pgs': 0, 'safe': True},
+            '2': {'pgs': 12, 'safe': False},
+            '3': {'pgs': None, 'safe': False}}
+        assert drain.cluster.mon_command.call_count == 2
+
+    def test_safe_to_destroy_all(self, drain):
+        drain.cluster.mon_command.return_value = (0, '', 'OSD(s) 1,2 are safe')
+        assert drain.safe_to_destroy([1, 2]) == set([1, 2])
+
+    def test_safe_to_destroy_each(self, drain):
+        drain.cluster.mon_command.side_effect = [(-16, '', ''), (0, '', ''), (-16, '', '')]
+        assert drain.safe_to_destroy([1, 2]) == set([1])
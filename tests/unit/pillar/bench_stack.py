@@ -0,0 +1,61 @@
+"""
+Microbenchmark of the PillarStack merge against the recursive reference
+implementation kept in test_stack.py.
+
+    PYTHONPATH=. python tests/unit/pillar/bench_stack.py [entries]
+"""
+from __future__ import print_function
+import copy
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# pylint: disable=wrong-import-position
+from srv.modules.pillar import stack
+import test_stack
+
+
+def layers(entries):
+    """
+    Simulate merging many files adding to, and removing from, large lists
+    such as the gateway and client lists of rgw or iscsi pillars
+    """
+    result = [{'config': {'clients': ['client{}'.format(i) for i in range(entries)],
+                          'settings': {str(i): i for i in range(entries)}}}]
+    for layer in range(20):
+        result.append({'config': {'clients': ['extra{}.{}'.format(layer, i)
+                                              for i in range(entries // 20)]}})
+    result.append({'config': {'clients': [{'__': 'remove'}] +
+                                         ['client{}'.format(i)
+                                          for i in range(0, entries, 2)]}})
+    return result
+
+
+def merge_all(merge_dict, data, owned=False):
+    """
+    Merge copies of all layers in order
+    """
+    args = ({},) if owned else ()
+    result = {}
+    for layer in copy.deepcopy(data):
+        result = merge_dict(result, layer, *args)
+    return result
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    data = layers(entries)
+    assert merge_all(stack._merge_dict, data, True) == \
+        merge_all(test_stack._ref_merge_dict, data)
+    copying = min(timeit.repeat(lambda: copy.deepcopy(data), number=1, repeat=3))
+    for name, func, owned in (('recursive', test_stack._ref_merge_dict, False),
+                              ('iterative', stack._merge_dict, True)):
+        elapsed = min(timeit.repeat(lambda: merge_all(func, data, owned),
+                                    number=1, repeat=3))
+        print("{:>10}: {:8.3f} ms".format(name, (elapsed - copying) * 1000))
+
+
+if __name__ == '__main__':
+    main()
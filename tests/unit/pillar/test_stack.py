@@ -0,0 +1,301 @@
+import copy
+import random
+import pytest
+from srv.modules.pillar import stack
+
+
+# The recursive merge of PillarStack as shipped by Salt, kept as reference
+# for the iterative implementation
+def _ref_cleanup(obj):
+    if obj:
+        if isinstance(obj, dict):
+            obj.pop('__', None)
+            for k, v in obj.items():
+                obj[k] = _ref_cleanup(v)
+        elif isinstance(obj, list) and isinstance(obj[0], dict) \
+                and '__' in obj[0]:
+            del obj[0]
+    return obj
+
+
+def _ref_merge_dict(stack, obj):
+    strategy = obj.pop('__', 'merge-last')
+    if strategy not in STRATEGIES:
+        raise Exception('Unknown strategy')
+    if strategy == 'overwrite':
+        return _ref_cleanup(obj)
+    else:
+        for k, v in obj.items():
+            if strategy == 'remove':
+                stack.pop(k, None)
+                continue
+            if k in stack:
+                if strategy == 'merge-first':
+                    stack_k = stack[k]
+                    stack[k] = _ref_cleanup(v)
+                    v = stack_k
+                if type(stack[k]) != type(v):
+                    stack[k] = _ref_cleanup(v)
+                elif isinstance(v, dict):
+                    stack[k] = _ref_merge_dict(stack[k], v)
+                elif isinstance(v, list):
+                    stack[k] = _ref_merge_list(stack[k], v)
+                else:
+                    stack[k] = v
+            else:
+                stack[k] = _ref_cleanup(v)
+        return stack
+
+
+def _ref_merge_list(stack, obj):
+    strategy = 'merge-last'
+    if obj and isinstance(obj[0], dict) and '__' in obj[0]:
+        strategy = obj[0]['__']
+        del obj[0]
+    if strategy not in STRATEGIES:
+        raise Exception('Unknown strategy')
+    if strategy == 'overwrite':
+        return obj
+    elif strategy == 'remove':
+        return [item for item in stack if item not in obj]
+    elif strategy == 'merge-first':
+        return obj + stack
+    else:
+        return stack + obj
+
+
+STRATEGIES = stack.strategies
+KEYS = ['a', 'b', 'c', 'd', 1]
+
+
+class Generator(object):
+    """
+    Random pillar data with strategy markers, drawn from a small set of keys
+    and values so that merges collide often
+    """
+
+    def __init__(self, seed):
+        self.rnd = random.Random(seed)
+
+    def scalar(self):
+        return self.rnd.choice([0, 1, 2, 1.0, True, None, 'x', 'y', ''])
+
+    def marker(self):
+        return self.rnd.choice(STRATEGIES)
+
+    def list_(self, depth):
+        items = [self.value(depth + 1, containers=self.rnd.random() < 0.2)
+                 for _ in range(self.rnd.randint(0, 5))]
+        if self.rnd.random() < 0.4:
+            items.insert(0, {'__': self.marker()})
+        return items
+
+    def dict_(self, depth):
+        obj = {}
+        if self.rnd.random() < 0.3:
+            obj['__'] = self.marker()
+        for _ in range(self.rnd.randint(0, 4)):
+            obj[self.rnd.choice(KEYS)] = self.value(depth + 1)
+        return obj
+
+    def value(self, depth, containers=True):
+        if not containers or depth > 3:
+            return self.scalar()
+        choice = self.rnd.random()
+        if choice < 0.4:
+            return self.dict_(depth)
+        if choice < 0.7:
+            return self.list_(depth)
+        return self.scalar()
+
+
+def _outcome(func, stack_data, obj):
+    try:
+        return ('ok', func(copy.deepcopy(stack_data), copy.deepcopy(obj)))
+    except Exception:
+        return ('error', None)
+
+
+class TestMergeEquivalence():
+
+    @pytest.mark.parametrize("seed", range(300))
+    def test_merge_dict(self, seed):
+        gen = Generator(seed)
+        layers = [gen.dict_(0) for _ in range(4)]
+        expected = {}
+        result = {}
+        for layer in layers:
+            outcome = _outcome(_ref_merge_dict, expected, layer)
+            assert _outcome(stack._merge_dict, result, layer) == outcome
+            if outcome[0] == 'error':
+                break
+            expected = outcome[1]
+            result = expected
+
+    def test_merge_dict_sequence_owned(self):
+        """
+        Lists extended in place across several merges
+        """
+        for seed in range(100):
+            gen = Generator(seed)
+            layers = [gen.dict_(0) for _ in range(6)]
+            expected = {}
+            result = {}
+            owned = {}
+            try:
+                for layer in layers:
+                    expected = _ref_merge_dict(expected, copy.deepcopy(layer))
+            except Exception:
+                continue
+            for layer in layers:
+                result = stack._merge_dict(result, copy.deepcopy(layer), owned)
+            assert result == expected
+
+    @pytest.mark.parametrize("seed", range(300))
+    def test_merge_list(self, seed):
+        gen = Generator(seed)
+        current = gen.list_(0)
+        obj = gen.list_(0)
+        if current and isinstance(current[0], dict) and '__' in current[0]:
+            del current[0]
+        assert (_outcome(stack._merge_list, current, obj) ==
+                _outcome(_ref_merge_list, current, obj))
+
+    def test_merge_list_unknown_strategy(self):
+        with pytest.raises(Exception):
+            stack._merge_list([1], [{'__': 'bogus'}, 2])
+
+    def test_merge_dict_unknown_strategy(self):
+        with pytest.raises(Exception):
+            stack._merge_dict({'a': {}}, {'a': {'__': 'bogus'}})
+
+
+class TestMerge():
+
+    def test_remove_unhashable(self):
+        result = stack._merge_list([{'a': 1}, 'b', [1], 'c'],
+                                   [{'__': 'remove'}, {'a': 1}, [1], 'c'])
+        assert result == ['b']
+
+    def test_merge_last_owned_extends_in_place(self):
+        owned = {}
+        first = stack._merge_list([1], [2], owned)
+        second = stack._merge_list(first, [3], owned)
+        assert second is first
+        assert second == [1, 2, 3]
+
+    def test_merge_last_copies_yaml_lists(self):
+        shared = [1]
+        data = {'a': shared, 'b': shared}
+        result = stack._merge_dict(data, {'a': [2]})
+        assert result == {'a': [1, 2], 'b': [1]}
+
+    def test_cleanup_nested(self):
+        obj = {'__': 'overwrite', 'a': {'__': 'remove', 'b': [{'__': 'remove'}, 1]}}
+        assert stack._cleanup(obj) == {'a': {'b': [1]}}
+
+    def test_cleanup_aliased(self):
+        shared = {'__': 'remove', 'x': 1}
+        assert stack._cleanup({'a': shared, 'b': shared}) == {'a': {'x': 1}, 'b': {'x': 1}}
+
+    def test_cleanup_aliased_list(self):
+        # The marker of a list referenced twice is stripped once, the dict
+        # following it is data
+        shared = [{'__': 'overwrite'}, {'__': 'data'}, 1]
+        assert stack._cleanup({'a': shared, 'b': shared}) == {'a': [{'__': 'data'}, 1],
+                                                               'b': [{'__': 'data'}, 1]}
+
+    def test_deep_nesting(self):
+        depth = 5000
+        current = {}
+        obj = {}
+        cursor_s, cursor_o = current, obj
+        for _ in range(depth):
+            cursor_s['k'] = {}
+            cursor_o['k'] = {}
+            cursor_s, cursor_o = cursor_s['k'], cursor_o['k']
+        cursor_o['leaf'] = 1
+        result = stack._merge_dict(current, obj)
+        for _ in range(depth):
+            result = result['k']
+        assert result == {'leaf': 1}
+
+
+class TestStage():
+
+    @pytest.fixture(autouse=True)
+    def dunders(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(stack, '__grains__', {'id': 'mon1'}, raising=False)
+        monkeypatch.setattr(stack, '__salt__', {}, raising=False)
+        monkeypatch.setattr(stack, '__opts__', {'cachedir': str(tmpdir)}, raising=False)
+
+    def test_staged(self, tmpdir):
+        stack_file = tmpdir.join('global.yml')
+        stack_file.write('a: 1\n')
+        deps = {'files': [str(stack_file)], 'missing': [str(tmpdir.join('absent.yml'))]}
+        inputs = stack._inputs(['stack.cfg'], {'cluster': 'ceph'})
+        stack._stage('mon1', inputs, deps, {'a': 1})
+        assert stack._staged('mon1', inputs) == {'a': 1}
+
+    def test_staged_changed_inputs(self):
+        inputs = stack._inputs(['stack.cfg'], {'cluster': 'ceph'})
+        stack._stage('mon1', inputs, {'files': [], 'missing': []}, {'a': 1})
+        stack.__grains__['os'] = 'SUSE'
+        assert stack._staged('mon1', stack._inputs(['stack.cfg'], {'cluster': 'ceph'})) is None
+
+    def test_staged_changed_file(self, tmpdir):
+        stack_file = tmpdir.join('global.yml')
+        stack_file.write('a: 1\n')
+        inputs = stack._inputs([], {})
+        stack._stage('mon1', inputs, {'files': [str(stack_file)], 'missing': []}, {'a': 1})
+        stack_file.write('a: 22\n')
+        assert stack._staged('mon1', inputs) is None
+
+    def test_staged_created_file(self, tmpdir):
+        missing = tmpdir.join('mon1.yml')
+        inputs = stack._inputs([], {})
+        stack._stage('mon1', inputs, {'files': [], 'missing': [str(missing)]}, {'a': 1})
+        missing.write('b: 1\n')
+        assert stack._staged('mon1', inputs) is None
+
+    def test_staged_expired(self):
+        stack.__opts__['pillarstack_stage_ttl'] = -1
+        inputs = stack._inputs([], {})
+        stack._stage('mon1', inputs, {'files': [], 'missing': []}, {'a': 1})
+        assert stack._staged('mon1', inputs) is None
+
+    def test_staged_absent(self):
+        assert stack._staged('mon1', 'digest') is None
+
+
+class TestRender():
+
+    @pytest.fixture(autouse=True)
+    def dunders(self, monkeypatch):
+        monkeypatch.setattr(stack, '__grains__', {}, raising=False)
+        monkeypatch.setattr(stack, '__salt__', {}, raising=False)
+        monkeypatch.setattr(stack, '__opts__', {}, raising=False)
+
+    def test_import_with_context(self, tmpdir):
+        tmpdir.join('stack.cfg').write('global.yml\n')
+        tmpdir.join('macros.jinja').write('{% macro name() %}{{ minion_id }}{% endmacro %}')
+        tmpdir.join('global.yml').write("{% from 'macros.jinja' import name with context %}\n"
+                                        "id: {{ name() }}\n")
+        cfg = str(tmpdir.join('stack.cfg'))
+        assert stack._process_stack_cfg(cfg, {}, 'mon1', {}) == {'id': 'mon1'}
+        assert stack._process_stack_cfg(cfg, {}, 'mon2', {}) == {'id': 'mon2'}
+
+    def test_import_without_context(self, tmpdir):
+        tmpdir.join('stack.cfg').write('global.yml\n')
+        tmpdir.join('macros.jinja').write(
+            "{% macro name() %}{{ minion_id }}-{{ __grains__['os'] }}{% endmacro %}")
+        tmpdir.join('global.yml').write("{% import 'macros.jinja' as macros %}\n"
+                                        "{% from 'macros.jinja' import name %}\n"
+                                        "id: {{ macros.name() }}\n"
+                                        "name: {{ name() }}\n")
+        cfg = str(tmpdir.join('stack.cfg'))
+        for minion, os_name in [('mon1', 'SUSE'), ('mon2', 'Ubuntu')]:
+            stack.__grains__['os'] = os_name
+            expected = '{}-{}'.format(minion, os_name)
+            assert stack._process_stack_cfg(cfg, {}, minion, {}) == {'id': expected,
+                                                                      'name': expected}
@@ -0,0 +1,150 @@
+import json
+import threading
+import time
+import pytest
+from mock import patch, MagicMock
+from srv.modules.runners import benchmark
+
+OSD_TREE = {'nodes': [{'id': -1, 'name': 'default', 'type': 'root', 'children': [-2, -3]},
+                      {'id': -2, 'name': 'data1', 'type': 'host', 'children': [0, 1, 2]},
+                      {'id': -3, 'name': 'data2', 'type': 'host', 'children': [3, 4]},
+                      {'id': 0, 'name': 'osd.0', 'type': 'osd', 'device_class': 'hdd'},
+                      {'id': 1, 'name': 'osd.1', 'type': 'osd', 'device_class': 'hdd'},
+                      {'id': 2, 'name': 'osd.2', 'type': 'osd', 'device_class': 'ssd'},
+                      {'id': 3, 'name': 'osd.3', 'type': 'osd', 'device_class': 'hdd'},
+                      {'id': 4, 'name': 'osd.4', 'type': 'osd', 'device_class': 'ssd'}],
+            'stray': [{'id': 5, 'name': 'osd.5', 'type': 'osd'}]}
+
+
+class TestBaseline():
+    '''
+    This class tests the parallel OSD bench
+    '''
+
+    def test_osds(self):
+        with patch.object(benchmark, 'local_client') as client:
+            client.cmd.return_value = {'master': json.dumps(OSD_TREE)}
+            osds = getattr(benchmark, '__osds')('master')
+        assert list(osds) == ['0', '1', '2', '3', '4', '5']
+        assert osds['2'] == {'host': 'data1', 'device_class': 'ssd'}
+        assert osds['5'] == {'host': 'unknown', 'device_class': 'unknown'}
+
+    def test_bench_all_limits(self):
+        osds = dict((str(id), {'host': 'data{}'.format(id % 3)}) for id in range(12))
+        lock = threading.Lock()
+        running = {}
+        peak = {'host': 0, 'cluster': 0}
+
+        def bench(master_minion, id):
+            host = osds[id]['host']
+            with lock:
+                running[host] = running.get(host, 0) + 1
+                peak['host'] = max(peak['host'], running[host])
+                peak['cluster'] = max(peak['cluster'], sum(running.values()))
+            time.sleep(0.02)
+            with lock:
+                running[host] -= 1
+            return {'bytes_per_sec': int(id)}
+
+        with patch.object(benchmark, '__bench', bench, create=True):
+            results = list(getattr(benchmark, '__bench_all')('master', osds, 1, 2))
+        assert sorted(id for id, _ in results) == sorted(osds)
+        assert peak['host'] == 1
+        assert peak['cluster'] == 2
+
+    @pytest.mark.parametrize('limits', [{'per_host': 0}, {'cluster_max': 0},
+                                        {'per_host': -1, 'cluster_max': 2}])
+    def test_baseline_rejects_limits(self, limits):
+        with patch.object(benchmark, 'local_client') as client:
+            with pytest.raises(Exception) as excinfo:
+                benchmark.baseline(**limits)
+            assert 'at least 1' in str(excinfo.value)
+            assert client.cmd.called is False
+
+    def test_bench_failure(self):
+        client = MagicMock()
+        client.cmd.return_value = {'master': 'Error EINVAL'}
+        with patch('salt.client.LocalClient', return_value=client):
+            assert getattr(benchmark, '__bench')('master', '3') is None
+
+    def test_groups(self):
+        osds = {'0': {'host': 'data1'}, '1': {'host': 'data1'},
+                '2': {'host': 'data1'}, '10': {'host': 'data1'},
+                '3': {'host': 'data2'}}
+        perf = {'0': 100.0, '1': 100.0, '2': 60.0, '10': 100.0, '3': 50.0}
+        groups = getattr(benchmark, '__groups')(perf, osds, 'host', 20)
+        assert groups['data1']['average'] == 90.0
+        assert list(groups['data1']['deviation']) == ['0', '1', '2', '10']
+        assert groups['data1']['outliers'] == ['2']
+        assert groups['data2']['outliers'] == []
+
+
+FIO_OUTPUT = {'client_stats': [
+    {'jobname': 'seq', 'hostname': 'c1',
+     'read': {'io_bytes': 1, 'bw': 100, 'iops': 25, 'clat_ns': {'mean': 4000}}},
+    {'jobname': 'All clients',
+     'read': {'io_bytes': 2, 'bw': 200, 'iops': 50,
+              'clat_ns': {'mean': 5000, 'percentile': {'99.000000': 9000}}},
+     'write': {'io_bytes': 0, 'bw': 0, 'iops': 0}}]}
+
+
+class TestResultStore():
+    '''
+    This class tests the benchmark result store
+    '''
+
+    def test_fio_metrics(self, tmpdir):
+        output = tmpdir.join('output.json')
+        output.write(json.dumps(FIO_OUTPUT))
+        metrics = benchmark._fio_metrics(str(output))
+        assert metrics == {'read_bw': 200, 'read_iops': 50,
+                           'read_lat_mean': 5000, 'read_lat_p99': 9000}
+
+    def test_fio_metrics_missing(self, tmpdir):
+        assert benchmark._fio_metrics(str(tmpdir.join('absent.json'))) == {}
+
+    def test_compare(self, tmpdir):
+        store = benchmark.ResultStore(str(tmpdir.join('results.db')))
+        first = store.add('fio', 'rbd', 'seq.yml', ['c2', 'c1'], '14.2.1', None,
+                          {'read_bw': 200, 'read_lat_mean': 5000})
+        other = store.add('fio', 'rbd', 'rand.yml', ['c1', 'c2'], '14.2.1', None,
+                          {'read_bw': 10})
+        second = store.add('fio', 'rbd', 'seq.yml', ['c1', 'c2'], '14.2.2', None,
+                           {'read_bw': 150, 'read_lat_mean': 4000})
+        assert store.previous(second, 5) == [first]
+        assert store.latest() == [other, second]
+        result = store.compare(second, [first], 10)
+        assert result['regressions'] == {'read_bw': {'value': 150, 'baseline': 200,
+                                                     'change': -25.0}}
+        assert result['improvements']['read_lat_mean']['change'] == 20.0
+        assert result['run']['version'] == '14.2.2'
+
+    def test_compare_runner(self, tmpdir):
+        store = benchmark.ResultStore(str(tmpdir.mkdir('benchmark').join('results.db')))
+        for value in [100, 110, 90, 50]:
+            store.add('baseline', 'osd', 'bench', ['0', '1'], '14.2.2', None,
+                      {'bytes_per_sec': value})
+        with patch('salt.config.client_config', return_value={'cachedir': str(tmpdir)}):
+            results = benchmark.compare(rolling=3)
+        assert len(results) == 1
+        assert results[0]['baseline'] == [3, 2, 1]
+        assert results[0]['regressions']['bytes_per_sec']['change'] == -50.0
+
+    def test_baseline_series(self, tmpdir):
+        bench = {'0': 100, '1': 100, '2': 100}
+        with patch.object(benchmark, 'local_client') as client, \
+                patch('salt.config.client_config', return_value={'cachedir': str(tmpdir)}), \
+                patch.object(benchmark, '_cluster_version', return_value='14.2.2'):
+            client.cmd.return_value = {'master': 'master'}
+            for ids in [['0', '1'], ['0', '1', '2']]:
+                osds = dict((id, {'host': 'data1'}) for id in ids)
+                with patch.object(benchmark, '__osds', return_value=osds, create=True), \
+                        patch.object(benchmark, '__bench_all', create=True,
+                                     return_value=[(id, {'bytes_per_sec': bench[id]})
+                                                   for id in ids]):
+                    run = benchmark.baseline()['run']
+        store = benchmark.ResultStore(str(tmpdir.join('benchmark', 'results.db')))
+        # An added OSD continues the series
+        assert store.previous(run, 5) == [run - 1]
+        assert store.run(run)['clients'] == 'cluster_max=16,per_host=1'
+        assert store.run(run)['info'] == {'osds': '0,1,2'}
@@ -7,20 +7,70 @@ from srv.modules.runners import cephprocesses
 
 class TestCephProcesses():
 
+    @patch('srv.modules.runners.cephprocesses._minion_roles', autospec=True)
     @patch('salt.client.LocalClient', autospec=True)
-    def test_status(self, localclient):
+    def test_status(self, localclient, minion_roles):
         result = {'mon1.ceph': True,
                   'mon3.ceph': True,
                   'mon2.ceph': True}
+        minion_roles.return_value = dict((minion, ['mon']) for minion in result)
 
         search = "I@cluster:ceph"
         roles = ['mon']
 
         local = localclient.return_value
-        local.cmd.return_value = result
+        local.cmd.return_value = dict((minion, {'mon': running})
+                                      for minion, running in result.items())
 
         status = cephprocesses._status(search, roles, False)
         assert status['mon'] == result
+        assert local.cmd.call_args[0][0] == "I@cluster:ceph and L@mon1.ceph,mon2.ceph,mon3.ceph"
+
+    @patch('srv.modules.runners.cephprocesses._minion_roles', autospec=True)
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_status_grouped(self, localclient, minion_roles):
+        minion_roles.return_value = {'node1.ceph': ['mon', 'mgr', 'storage'],
+                                     'node2.ceph': ['storage', 'admin'],
+                                     'node3.ceph': ['storage'],
+                                     'node4.ceph': ['admin']}
+        answers = {'node1.ceph': {'mon': True, 'mgr': True, 'storage': False},
+                   'node2.ceph': {'storage': True},
+                   'node3.ceph': "Exception occurred"}
+        local = localclient.return_value
+        local.cmd.side_effect = lambda target, *args, **kwargs: dict(
+            (minion, answers[minion]) for minion in target.split('L@')[1].split(','))
+
+        status = cephprocesses._status("I@cluster:ceph", ['mon', 'mgr', 'storage', 'rgw'], False)
+        assert status == {'mon': {'node1.ceph': True},
+                          'mgr': {'node1.ceph': True},
+                          'storage': {'node1.ceph': False, 'node2.ceph': True},
+                          'rgw': {}}
+        calls = sorted((call[0][0], call[1]['kwarg']['roles'])
+                       for call in local.cmd.call_args_list)
+        assert calls == [("I@cluster:ceph and L@node1.ceph", ['mon', 'mgr', 'storage']),
+                         ("I@cluster:ceph and L@node2.ceph,node3.ceph", ['storage'])]
+
+    @patch('srv.modules.runners.cephprocesses._minion_roles', autospec=True)
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_status_stream(self, localclient, minion_roles, capsys):
+        minion_roles.return_value = {'node1.ceph': ['mon', 'storage'],
+                                     'node2.ceph': ['mon', 'storage']}
+        local = localclient.return_value
+        local.cmd_iter.return_value = iter([
+            {'node2.ceph': {'ret': {'storage': False}, 'retcode': 0}},
+            {'node1.ceph': {'ret': {'mon': True}, 'retcode': 0}}])
+
+        status = cephprocesses._status("I@cluster:ceph", ['mon', 'storage'], False, stream=True)
+        assert status == {'mon': {'node1.ceph': True}, 'storage': {'node2.ceph': False}}
+        assert local.cmd.called is False
+        assert capsys.readouterr().out == "node2.ceph: storage down\nnode1.ceph: mon up\n"
+
+    @patch('srv.modules.runners.cephprocesses._minion_roles', autospec=True)
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_status_no_roles(self, localclient, minion_roles):
+        assert cephprocesses._status("I@cluster:ceph", [], False) == {}
+        assert localclient.return_value.cmd.called is False
+        assert minion_roles.called is False
 
     @patch('srv.modules.runners.cephprocesses._status', autospec=True)
     @patch('srv.modules.runners.cephprocesses._cached_roles', autospec=True)
@@ -1,3 +1,5 @@
+import hashlib
+import os
 from mock import patch, MagicMock, mock_open
 import pytest
 from pyfakefs import fake_filesystem as fake_fs
@@ -171,3 +173,65 @@ class TestChanged():
     def test_igw(self, rcc_mock, salt_mock):
         changed.igw()
         rcc_mock.assert_called
+
+
+class TestManifest():
+    """
+    Testing the digest manifest
+    """
+
+    def _old(self, path, mtime=1):
+        os.utime(str(path), (mtime, mtime))
+
+    def test_digest(self, tmpdir):
+        conf = tmpdir.join('global.conf')
+        conf.write('foo=bar')
+        self._old(conf)
+        manifest = changed.Manifest(str(tmpdir.join('.manifest')))
+        assert manifest.digest(str(conf)) == hashlib.md5(b'foo=bar').hexdigest()
+        manifest.save()
+        assert tmpdir.join('.manifest').check()
+
+    def test_unchanged_not_read(self, tmpdir):
+        conf = tmpdir.join('global.conf')
+        conf.write('foo=bar')
+        self._old(conf)
+        first = changed.Manifest(str(tmpdir.join('.manifest')))
+        first.digest(str(conf))
+        first.save()
+        manifest = changed.Manifest(str(tmpdir.join('.manifest')))
+        # Only the manifest itself is opened
+        with patch('builtins.open', side_effect=[open(str(tmpdir.join('.manifest')))]) as open_mock:
+            assert manifest.digest(str(conf)) == hashlib.md5(b'foo=bar').hexdigest()
+            assert open_mock.call_count == 1
+
+    def test_changed_file(self, tmpdir):
+        conf = tmpdir.join('global.conf')
+        conf.write('foo=bar')
+        self._old(conf)
+        manifest = changed.Manifest(str(tmpdir.join('.manifest')))
+        manifest.digest(str(conf))
+        conf.write('foo=baz')
+        self._old(conf, 2)
+        assert manifest.digest(str(conf)) == hashlib.md5(b'foo=baz').hexdigest()
+
+    def test_recent_file_not_recorded(self, tmpdir):
+        conf = tmpdir.join('global.conf')
+        conf.write('foo=bar')
+        manifest = changed.Manifest(str(tmpdir.join('.manifest')))
+        manifest.digest(str(conf))
+        assert not manifest.dirty
+
+    @patch('srv.modules.runners.changed.salt.client', new_callable=MagicMock)
+    @patch('srv.modules.runners.changed.requires_conf_change')
+    @patch('srv.modules.runners.changed._rgw_configurations')
+    def test_all(self, rgw_mock, rcc_mock, salt_mock):
+        rgw_mock.return_value = ['rgw', 'rgw-ssl']
+        rcc_mock.side_effect = lambda **kwargs: kwargs['role'].name == 'mgr'
+        ret = changed.all_()
+        assert list(ret) == ['mon', 'storage', 'mgr', 'rgw', 'rgw-ssl',
+                             'client', 'global', 'mds']
+        assert ret['mgr'] is True and ret['mon'] is False
+        manifests = set(id(call[1]['manifest']) for call in rcc_mock.call_args_list)
+        assert len(manifests) == 1
+        assert rgw_mock.call_count == 1
@@ -164,3 +164,184 @@ class TestFileQueue():
 
 
 
+    @patch('srv.modules.runners.filequeue.FileQueue._fire_event', autospec=True)
+    def test_items_same_mtime(self, fire_event, dirpath):
+        '''
+        Verify that items with the same mtime are all listed
+        '''
+        fq = filequeue.FileQueue(root_dir=dirpath)
+        fq.touch_many(["red", "blue"])
+        os.utime("{}/default/red".format(dirpath), (1, 1))
+        os.utime("{}/default/blue".format(dirpath), (1, 1))
+        files = fq.items()
+        shutil.rmtree(dirpath)
+        assert files == ['blue', 'red']
+
+
+@patch('srv.modules.runners.filequeue.FileQueue._fire_event', autospec=True)
+class TestJournalQueue():
+    '''
+    This class tests the journal backend
+    '''
+
+    def setup_method(self):
+        filequeue.JournalQueue._replayed.clear()
+
+    def test_items_in_order(self, fire_event, tmpdir):
+        fq = filequeue.JournalQueue(root_dir=str(tmpdir))
+        fq.touch_many(["red", "blue", "green"])
+        fq.touch("red")
+        assert fq.items() == ['blue', 'green', 'red']
+        assert fq.ls() == ['blue', 'green', 'red']
+
+    def test_oldest_newest(self, fire_event, tmpdir):
+        fq = filequeue.JournalQueue(root_dir=str(tmpdir))
+        with pytest.raises(IndexError):
+            fq.newest()
+        assert fq.oldest(2) == []
+        fq.touch_many(["red", "blue", "green"])
+        fq.touch("red")
+        assert fq.oldest(2) == ['blue', 'green']
+        assert fq.oldest(5) == ['blue', 'green', 'red']
+        assert fq.newest() == 'red'
+
+    def test_runner_pop(self, fire_event, tmpdir):
+        kwargs = {'root_dir': str(tmpdir), 'backend': 'journal', 'queue': 'prep'}
+        filequeue.enqueue(items="a,b,c", **kwargs)
+        assert filequeue.pop(**kwargs) == 'c'
+        assert filequeue.items(**kwargs) == "a\nb"
+
+    def test_duplicate_fail(self, fire_event, tmpdir):
+        fq = filequeue.JournalQueue(root_dir=str(tmpdir), duplicate_fail=True)
+        assert fq.touch("lock")
+        assert not fq.touch("lock")
+        assert fq.touch_many(["a", "a"]) == {'a': False}
+
+    def test_remove_check_empty(self, fire_event, tmpdir):
+        fq = filequeue.JournalQueue(root_dir=str(tmpdir))
+        fq.touch("red")
+        assert fq.check("red")
+        assert fq.remove("red")
+        assert not fq.remove("red")
+        assert not fq.check("red")
+        assert fq.empty()
+
+    def test_vacate(self, fire_event, tmpdir):
+        fq = filequeue.JournalQueue(root_dir=str(tmpdir))
+        fq.touch_many(["red", "blue"])
+        assert fq.vacate("red") is None
+        assert fq.vacate("blue") is True
+
+    def test_shared_between_processes(self, fire_event, tmpdir):
+        '''
+        Another process appending to the journal is seen
+        '''
+        fq = filequeue.JournalQueue(root_dir=str(tmpdir))
+        fq.touch("red")
+        filequeue.JournalQueue._replayed.clear()
+        other = filequeue.JournalQueue(root_dir=str(tmpdir))
+        other.touch("blue")
+        filequeue.JournalQueue._replayed.clear()
+        assert fq.items() == ['red', 'blue']
+
+    def test_compact(self, fire_event, tmpdir):
+        fq = filequeue.JournalQueue(root_dir=str(tmpdir))
+        items = ["minion{}".format(i) for i in range(filequeue.COMPACT_LINES)]
+        fq.touch_many(items)
+        fq.remove_many(items[:-1])
+        with open(fq.journal) as journal:
+            assert len(journal.readlines()) == 1
+        filequeue.JournalQueue._replayed.clear()
+        assert fq.items() == [items[-1]]
+
+    def test_runner_batches(self, fire_event, tmpdir):
+        kwargs = {'root_dir': str(tmpdir), 'backend': 'journal', 'queue': 'prep'}
+        ret = filequeue.enqueue(items="a,b,c", **kwargs)
+        assert ret == {'a': True, 'b': True, 'c': True}
+        assert filequeue.dequeue(count=2, **kwargs) == ['a', 'b']
+        assert filequeue.dequeue(**kwargs) == 'c'
+        assert filequeue.empty(**kwargs)
+
+
+@patch('srv.modules.runners.filequeue.FileQueue._fire_event', autospec=True)
+class TestWait():
+    '''
+    This class tests blocking on a queue
+    '''
+
+    def _later(self, func, *args):
+        import threading
+        timer = threading.Timer(0.2, func, args)
+        timer.start()
+        return timer
+
+    def test_wait_empty(self, fire_event, tmpdir):
+        fq = filequeue.FileQueue(root_dir=str(tmpdir), queue='prep')
+        fq.touch("minion1")
+        self._later(fq.remove, "minion1")
+        start = time.time()
+        assert fq.wait('empty', timeout=5)
+        assert time.time() - start < 2
+
+    def test_wait_item_journal(self, fire_event, tmpdir):
+        fq = filequeue.JournalQueue(root_dir=str(tmpdir), queue='master')
+        other = filequeue.JournalQueue(root_dir=str(tmpdir), queue='master')
+        self._later(other.touch_many, ["lock", "complete"])
+        assert fq.wait('item', 'complete', timeout=5)
+
+    def test_wait_timeout(self, fire_event, tmpdir):
+        fq = filequeue.FileQueue(root_dir=str(tmpdir))
+        fq.touch("minion1")
+        assert not fq.wait('empty', timeout=0.1)
+
+    def test_wait_polling(self, fire_event, tmpdir):
+        fq = filequeue.FileQueue(root_dir=str(tmpdir))
+        self._later(fq.touch, "minion1")
+        with patch.object(filequeue, '_watch', return_value=None):
+            with patch.object(filequeue, 'POLL_INTERVAL', 0.05):
+                assert fq.wait('item', timeout=5)
+
+    def test_wait_invalid(self, fire_event, tmpdir):
+        fq = filequeue.FileQueue(root_dir=str(tmpdir))
+        with pytest.raises(ValueError):
+            fq.wait('full')
+
+
+class TestCoalesce():
+    '''
+    This class tests batching of events
+    '''
+
+    @patch('salt.utils.event.SaltEvent', autospec=True)
+    def test_batch_event(self, saltevent, tmpdir):
+        filequeue.__opts__ = {'sock_dir': str(tmpdir)}
+        fq = filequeue.FileQueue(root_dir=str(tmpdir), queue='prep', coalesce=60)
+        fq.touch_many(["minion{}".format(i) for i in range(500)])
+        fq.remove("minion0")
+        assert not saltevent.called
+        filequeue._events.flush('salt/filequeue/prep')
+        fire_event = saltevent.return_value.fire_event
+        assert fire_event.call_count == 1
+        data, tag = fire_event.call_args[0]
+        assert tag == 'salt/filequeue/prep/batch'
+        assert len(data['events']) == 501
+        assert data['events'][0] == {'tag': 'salt/filequeue/prep/minion0/added',
+                                     'result': True}
+
+    @patch('salt.utils.event.SaltEvent', autospec=True)
+    def test_window(self, saltevent, tmpdir):
+        filequeue.__opts__ = {'sock_dir': str(tmpdir)}
+        fq = filequeue.FileQueue(root_dir=str(tmpdir), queue='window', coalesce=0.05)
+        fq.touch("minion1")
+        time.sleep(0.3)
+        assert saltevent.return_value.fire_event.call_count == 1
+
+    @patch('salt.utils.event.SaltEvent', autospec=True)
+    def test_flush_all(self, saltevent, tmpdir):
+        filequeue.__opts__ = {'sock_dir': str(tmpdir)}
+        for queue in ['one', 'two']:
+            fq = filequeue.FileQueue(root_dir=str(tmpdir), queue=queue, coalesce=60)
+            fq.touch("minion1")
+        filequeue._events.flush_all()
+        assert saltevent.return_value.fire_event.call_count == 2
+        assert not filequeue._events.pending
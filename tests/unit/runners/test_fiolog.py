@@ -0,0 +1,144 @@
+from srv.modules.utils import fiolog
+
+
+def _write(tmpdir, name, lines):
+    log_file = tmpdir.join(name)
+    log_file.write(''.join("{}\n".format(', '.join(str(field) for field in line))
+                           for line in lines))
+    return str(log_file)
+
+
+class TestParse():
+
+    def test_parse_skips_garbage(self, tmpdir):
+        tmpdir.join('output_bw.1.log').write('500, 100, 0, 4096\n'
+                                             '600, x, 0, 4096\n'
+                                             'broken\n'
+                                             '700, 300, 1, 4096, 8192\n')
+        samples = list(fiolog._parse(str(tmpdir.join('output_bw.1.log'))))
+        assert samples == [(500, 100.0, 0), (700, 300.0, 1)]
+
+
+class TestHistogram():
+
+    def test_bin_value_linear(self):
+        assert fiolog.bin_value(0) == 0
+        assert fiolog.bin_value(127) == 127
+
+    def test_bin_value_grouped(self):
+        # Bins 128 to 191 are 2 nsec wide starting at 128
+        assert fiolog.bin_value(128) == 129
+        assert fiolog.bin_value(191) == 255
+
+    def test_bin_index(self):
+        assert fiolog.bin_index(0) == 0
+        assert fiolog.bin_index(127) == 127
+        assert fiolog.bin_index(128) == 128
+        assert fiolog.bin_index(1000) == 317
+        assert fiolog.bin_index(1 << 62) == fiolog.PLAT_NR - 1
+
+    def test_bin_index_roundtrip(self):
+        for value in [130, 999, 12345, 987654, 9876543210]:
+            assert abs(fiolog.bin_value(fiolog.bin_index(value)) - value) <= value / 64.0
+
+    def test_latency_bins_merge(self):
+        first = fiolog.LatencyBins()
+        second = fiolog.LatencyBins()
+        for value in range(1, 51):
+            first.add(value)
+        for value in range(51, 101):
+            second.add(value)
+        first.merge(second)
+        assert first.distribution() == {'min': 1, 'p50': 50, 'p99': 99,
+                                        'max': 100, 'mean': 50.5}
+
+    def test_latency_bins_bounded(self):
+        bins = fiolog.LatencyBins()
+        bins.add(1000)
+        assert bins.percentile(99) == 1000
+        assert fiolog.LatencyBins().percentile(50) is None
+
+    def test_hist_percentile(self):
+        counts = [0] * 10
+        counts[3] = 90
+        counts[7] = 10
+        assert fiolog.hist_percentile(counts, 50) == 3
+        assert fiolog.hist_percentile(counts, 99) == 7
+
+    def test_hist_percentile_empty(self):
+        assert fiolog.hist_percentile([0, 0], 50) is None
+
+    def test_read_hist(self, tmpdir):
+        path = _write(tmpdir, 'output_clat_hist.1.log',
+                      [(100, 0, 4096, 1, 2, 0), (600, 0, 4096, 0, 1, 1),
+                       (1100, 1, 4096, 5, 0, 0)])
+        windows = fiolog.read_hist(path)
+        assert list(windows[('read', 0)]) == [1, 3, 1]
+        assert list(windows[('write', 1)]) == [5, 0, 0]
+
+
+class TestSummarize():
+
+    def test_throughput_aggregate(self, tmpdir):
+        _write(tmpdir, 'output_bw.1.log.host1',
+               [(t * 1000, 100, 0, 4096) for t in range(5)])
+        _write(tmpdir, 'output_bw.1.log.host2',
+               [(t * 1000, 50, 0, 4096) for t in range(5)])
+        summary = fiolog.summarize(str(tmpdir))
+        read = summary['bw']['read']
+        assert read['clients']['host1']['p50'] == 100
+        assert read['clients']['host2']['p50'] == 50
+        assert read['all']['p50'] == 150
+        assert read['stalls']['all'] == []
+
+    def test_jobs_of_a_client_add_up(self, tmpdir):
+        _write(tmpdir, 'output_iops.1.log', [(0, 10, 1, 4096), (500, 30, 1, 4096)])
+        _write(tmpdir, 'output_iops.2.log', [(0, 5, 1, 4096)])
+        summary = fiolog.summarize(str(tmpdir))
+        assert summary['iops']['write']['clients']['local']['p50'] == 25
+
+    def test_stalls(self, tmpdir):
+        lines = [(t * 1000, 100, 0, 4096) for t in range(10)
+                 if t not in (3, 4, 7)]
+        lines.append((7000, 5, 0, 4096))
+        _write(tmpdir, 'output_bw.1.log.host1', lines)
+        summary = fiolog.summarize(str(tmpdir))
+        assert summary['bw']['read']['stalls']['host1'] == [[3000, 5000], [7000, 8000]]
+
+    def test_latency(self, tmpdir):
+        _write(tmpdir, 'output_clat.1.log.host1',
+               [(100, value, 0, 4096) for value in range(1, 101)] +
+               [(1100, 1000, 0, 4096)])
+        _write(tmpdir, 'output_clat.1.log.host2', [(100, 5, 0, 4096)])
+        summary = fiolog.summarize(str(tmpdir))
+        clat = summary['clat']['read']
+        assert clat['clients']['host1']['p50'] == 51
+        assert clat['clients']['host1']['worst window p99'] == 1000
+        assert clat['clients']['host2']['max'] == 5
+        assert clat['all']['max'] == 1000
+        assert clat['all']['worst window p99'] == 1000
+
+    def test_latency_keeps_no_samples(self, tmpdir):
+        path = _write(tmpdir, 'output_clat.1.log.host1',
+                      [(t, 5000 + t % 7, 0, 4096) for t in range(10000)])
+        summary = fiolog.Summary()
+        summary.add(path, 'clat', 'host1')
+        windows = summary.latency['clat']['read']['host1']
+        assert len(windows) == 10
+        assert all(len(bins.counts) <= 7 for bins in windows.values())
+        clat = summary.result()['clat']['read']['clients']['host1']
+        assert clat['min'] == 5000
+        assert clat['max'] == 5006
+
+    def test_histogram(self, tmpdir):
+        _write(tmpdir, 'output_clat_hist.1.log.host1', [(100, 0, 4096, 0, 99, 1)])
+        _write(tmpdir, 'output_clat_hist.1.log.host2', [(100, 0, 4096, 0, 0, 100)])
+        summary = fiolog.summarize(str(tmpdir))
+        hist = summary['clat_hist']['read']
+        assert hist['clients']['host1']['p50'] == 1
+        assert hist['clients']['host2']['p50'] == 2
+        assert hist['all']['p50'] == 2
+
+    def test_ignores_other_files(self, tmpdir):
+        tmpdir.join('output.json').write('{}')
+        assert fiolog.summarize(str(tmpdir)) == {'window_ms': 1000}
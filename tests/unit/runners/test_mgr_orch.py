@@ -12,6 +12,12 @@ class TestMgrOrch():
     def output_helper(self):
         yield OutputHelper()
 
+    @pytest.fixture(autouse=True)
+    def store(self, tmpdir):
+        mgr_orch.__opts__ = {'cachedir': str(tmpdir)}
+        with patch('srv.modules.runners.mgr_orch._minions', return_value=[]):
+            yield
+
     @patch('salt.client.LocalClient', autospec=True)
     def test_get_inventory(self, localclient, output_helper):
         result = {
@@ -271,3 +277,93 @@ class TestMgrOrch():
                 }
             }
         }
+
+
+class TestInventoryStore():
+
+    @pytest.fixture(autouse=True)
+    def opts(self, tmpdir):
+        mgr_orch.__opts__ = {'cachedir': str(tmpdir)}
+
+    @pytest.fixture
+    def minions(self):
+        with patch('srv.modules.runners.mgr_orch._minions',
+                   return_value=['data1.ceph', 'data2.ceph']) as minions:
+            yield minions
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_first_query_asks_all(self, localclient, minions):
+        local = localclient.return_value
+        local.cmd.return_value = {'data1.ceph': [{'path': '/dev/sdb'}],
+                                  'data2.ceph': []}
+        result = mgr_orch.get_inventory()
+        assert result == local.cmd.return_value
+        local.cmd.assert_called_once_with(
+            "I@cluster:ceph", 'cephdisks.all', [], tgt_type="compound")
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_served_from_store(self, localclient, minions):
+        local = localclient.return_value
+        local.cmd.return_value = {'data1.ceph': [{'path': '/dev/sdb'}],
+                                  'data2.ceph': []}
+        mgr_orch.get_inventory()
+        local.cmd.reset_mock()
+        result = mgr_orch.get_inventory()
+        assert result == {'data1.ceph': [{'path': '/dev/sdb'}], 'data2.ceph': []}
+        local.cmd.assert_not_called()
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_filtered_from_store(self, localclient, minions):
+        local = localclient.return_value
+        local.cmd.return_value = {'data1.ceph': [{'path': '/dev/sdb'}],
+                                  'data2.ceph': []}
+        mgr_orch.get_inventory()
+        local.cmd.reset_mock()
+        minions.return_value = ['data2.ceph']
+        assert mgr_orch.get_inventory(roles='mds') == {'data2.ceph': []}
+        minions.assert_called_with("I@cluster:ceph and ( I@roles:mds )")
+        local.cmd.assert_not_called()
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_stale_minions_asked(self, localclient, minions):
+        store = mgr_orch.InventoryStore()
+        store.update({'data1.ceph': [{'path': '/dev/sdb'}]})
+        local = localclient.return_value
+        local.cmd.return_value = {'data2.ceph': [{'path': '/dev/sdc'}]}
+        result = mgr_orch.get_inventory()
+        local.cmd.assert_called_once_with(
+            ['data2.ceph'], 'cephdisks.all', [], tgt_type="list")
+        assert result == {'data1.ceph': [{'path': '/dev/sdb'}],
+                          'data2.ceph': [{'path': '/dev/sdc'}]}
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_max_age(self, localclient, minions):
+        store = mgr_orch.InventoryStore()
+        store.update({'data1.ceph': [], 'data2.ceph': []})
+        local = localclient.return_value
+        local.cmd.return_value = {'data1.ceph': [], 'data2.ceph': []}
+        with patch('time.time', return_value=store.entries['data1.ceph']['time'] + 60):
+            mgr_orch.get_inventory(max_age=30)
+        local.cmd.assert_called_once_with(
+            "I@cluster:ceph", 'cephdisks.all', [], tgt_type="compound")
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_refresh(self, localclient, minions):
+        mgr_orch.InventoryStore().update({'data1.ceph': [], 'data2.ceph': []})
+        local = localclient.return_value
+        local.cmd.return_value = {'data1.ceph': [{'path': '/dev/sdb'}],
+                                  'data2.ceph': []}
+        assert mgr_orch.get_inventory(refresh=True) == local.cmd.return_value
+        assert mgr_orch.InventoryStore().devices('data1.ceph') == [{'path': '/dev/sdb'}]
+
+    def test_failed_minion_not_stored(self):
+        store = mgr_orch.InventoryStore()
+        store.update({'data1.ceph': 'cephdisks.all is not available'})
+        assert 'data1.ceph' not in mgr_orch.InventoryStore().entries
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_refresh_inventory(self, localclient):
+        local = localclient.return_value
+        local.cmd.return_value = {'data1.ceph': [], 'data2.ceph': False}
+        assert mgr_orch.refresh_inventory() == 1
+        assert list(mgr_orch.InventoryStore().entries) == ['data1.ceph']
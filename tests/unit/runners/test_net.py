@@ -0,0 +1,212 @@
+import pytest
+from mock import patch, MagicMock
+from srv.modules.runners import net
+
+
+class TestIperf():
+    '''
+    This class tests the iperf scheduling of the net runner
+    '''
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_hosts(self, localclient):
+        local = localclient.return_value
+        local.cmd.return_value = {'a.ceph': {'num_cpus': 2, 'ipv4': ['10.0.0.1', '10.1.0.1']},
+                                  'b.ceph': {'num_cpus': 4, 'ipv4': ['10.0.0.2']}}
+        hosts = net._hosts(['10.0.0.1', '10.0.0.2', '10.1.0.1'])
+        assert local.cmd.call_count == 1
+        assert hosts['10.1.0.1'] == ('a.ceph', 2)
+        assert hosts['10.0.0.2'] == ('b.ceph', 4)
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_create_server_once_per_host(self, localclient):
+        local = localclient.return_value
+        hosts = {'10.0.0.1': ('a.ceph', 2), '10.1.0.1': ('a.ceph', 2),
+                 '10.0.0.2': ('b.ceph', 4)}
+        net._create_server(list(hosts), hosts)
+        local.cmd.assert_called_once_with(['a.ceph', 'b.ceph'],
+                                          'multi.prepare_iperf_server', [],
+                                          tgt_type="list")
+
+    def test_client_jobs(self):
+        hosts = {'10.0.0.1': ('a.ceph', 1), '10.0.0.2': ('b.ceph', 2),
+                 '10.0.0.3': ('c.ceph', 1)}
+        jobs = net._client_jobs(['10.0.0.1', '10.0.0.2', '10.0.0.3'], hosts)
+        assert jobs == [('10.0.0.2', '10.0.0.1', 0, 5200),
+                        ('10.0.0.1', '10.0.0.2', 0, 5200),
+                        ('10.0.0.3', '10.0.0.2', 0, 5201),
+                        ('10.0.0.1', '10.0.0.3', 0, 5200)]
+
+    def test_client_jobs_other_hosts(self):
+        hosts = {'10.0.0.1': ('a.ceph', 1), '10.1.0.1': ('a.ceph', 1),
+                 '10.0.0.2': ('b.ceph', 1)}
+        jobs = net._client_jobs(['10.0.0.1', '10.1.0.1', '10.0.0.2'], hosts,
+                                ['10.0.0.1', '10.1.0.1'])
+        assert jobs == [('10.0.0.2', '10.0.0.1', 0, 5200),
+                        ('10.0.0.2', '10.1.0.1', 0, 5200)]
+
+    def test_waves(self):
+        hosts = {'10.0.0.1': ('a.ceph', 1), '10.1.0.1': ('a.ceph', 1),
+                 '10.0.0.2': ('b.ceph', 1), '10.1.0.2': ('b.ceph', 1),
+                 '10.0.0.3': (None, 1)}
+        waves = net._waves(['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.1.0.1', '10.1.0.2'],
+                           hosts)
+        assert waves == [['10.0.0.1', '10.0.0.2', '10.0.0.3'], ['10.1.0.1', '10.1.0.2']]
+
+    @patch('salt.utils.event.get_event')
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_create_client_waves(self, localclient, get_event):
+        net.__opts__ = {'sock_dir': '/tmp', 'transport': 'zeromq'}
+        hosts = {'10.0.0.1': ('a.ceph', 1), '10.1.0.1': ('a.ceph', 1),
+                 '10.0.0.2': ('b.ceph', 1)}
+        local = localclient.return_value
+        local.cmd_async.side_effect = lambda tgt, fun, arg, tgt_type: arg[0]
+        waves = []
+
+        def collect(event, jids, timeout):
+            waves.append(sorted(jids))
+            return {}
+        with patch.object(net, '_collect', side_effect=collect):
+            net._create_client(['10.0.0.1', '10.0.0.2', '10.1.0.1'], hosts)
+        # The servers of a.ceph are never busy with two addresses at once
+        assert waves == [['10.0.0.1', '10.0.0.2'], ['10.1.0.1']]
+
+    def test_collect(self):
+        event = MagicMock()
+        event.get_event.side_effect = [
+            {'tag': 'salt/job/2/new', 'data': {}},
+            None,
+            {'tag': 'salt/job/2/ret/b.ceph', 'data': {'id': 'b.ceph', 'return': 'two'}},
+            {'tag': 'salt/job/9/ret/c.ceph', 'data': {'id': 'c.ceph', 'return': 'other'}},
+            {'tag': 'salt/job/1/ret/a.ceph', 'data': {'id': 'a.ceph', 'return': 'one'}}]
+        results = net._collect(event, ['1', '2'], 10)
+        assert list(results.items()) == [('2', {'b.ceph': 'two'}), ('1', {'a.ceph': 'one'})]
+
+    def test_collect_timeout(self):
+        event = MagicMock()
+        event.get_event.return_value = None
+        net.__salt__ = {'jobs.lookup_jid': MagicMock(return_value={'a.ceph': 'late'})}
+        results = net._collect(event, ['1'], 0.1)
+        assert results == {'1': {'a.ceph': 'late'}}
+
+
+class TestIperfMatrix():
+    '''
+    This class tests the contention free iperf plan
+    '''
+
+    @pytest.mark.parametrize("count", [2, 3, 4, 7, 10])
+    def test_rounds(self, count):
+        addresses = ["10.0.0.{}".format(i) for i in range(count)]
+        rounds = net._rounds(addresses)
+        pairs = [pair for pairs in rounds for pair in pairs]
+        assert len(pairs) == count * (count - 1)
+        assert set(pairs) == set((a, b) for a in addresses for b in addresses if a != b)
+        for pairs in rounds:
+            busy = [address for pair in pairs for address in pair]
+            assert len(busy) == len(set(busy))
+
+    def test_rounds_single(self):
+        assert net._rounds(['10.0.0.1']) == []
+
+    def test_speed(self):
+        assert net._speed({'a': {'succeeded': True, 'filter': '941 Mbits/sec'}}) == 941.0
+        assert net._speed({'a': {'succeeded': False, 'failed': True}}) is None
+        assert net._speed({}) is None
+
+    def test_analyze(self):
+        addresses = ['a', 'b', 'c', 'd']
+        matrix = dict((src, dict((dst, 1000.0) for dst in addresses if dst != src))
+                      for src in addresses)
+        for src in addresses:
+            if src != 'c':
+                matrix[src]['c'] = 100.0
+        matrix['a']['b'] = None
+        result = net._analyze(matrix, {'c': ('c.ceph', 4)})
+        assert result['hosts']['c']['receive'] == 100.0
+        assert result['hosts']['c']['minion'] == 'c.ceph'
+        assert 'c' in result['outliers']
+        assert 'd' not in result['outliers']
+        assert 'a -> b: failed' in result['slow links']
+        assert 'd -> c: 100.0 Mbits/sec' in result['slow links']
+
+    @patch('salt.utils.event.get_event')
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_bandwidth(self, localclient, get_event):
+        net.__opts__ = {'sock_dir': '/tmp', 'transport': 'zeromq'}
+        local = localclient.return_value
+        jobs = []
+
+        def cmd_async(tgt, fun, arg, tgt_type):
+            jobs.append((tgt[2:], arg[0]))
+            return str(len(jobs))
+        local.cmd_async.side_effect = cmd_async
+
+        def collect(event, jids, timeout):
+            return dict((jid, {jobs[int(jid) - 1][0]: {'succeeded': True,
+                                                       'filter': '{} Mbits/sec'.format(jid)}})
+                        for jid in jids)
+        with patch.object(net, '_collect', side_effect=collect):
+            matrix = net._bandwidth(['a', 'b', 'c'], 10)
+        assert len(jobs) == 6
+        for number, (src, dst) in enumerate(jobs):
+            assert matrix[src][dst] == float(number + 1)
+
+    @patch('srv.modules.runners.net._create_server')
+    @patch('srv.modules.runners.net._hosts', return_value={})
+    @patch('srv.modules.runners.net._bandwidth')
+    @patch('srv.modules.runners.net._iperf_addresses')
+    def test_iperf_matrix_saved(self, addresses, bandwidth, hosts, server, tmpdir):
+        import json
+        from collections import OrderedDict
+        addresses.return_value = OrderedDict([('Public Network', ['a', 'b']),
+                                              ('Cluster Network', [])])
+        bandwidth.side_effect = [{'a': {'b': 900.0}, 'b': {'a': 950.0}}, {}]
+        filename = str(tmpdir.join('iperf.json'))
+        result = net.iperf_matrix(cluster='ceph', filename=filename)
+        assert result['file'] == filename
+        saved = json.load(open(filename))
+        assert saved['Public Network']['matrix']['a']['b'] == 900.0
+        assert saved['Cluster Network']['outliers'] == []
+
+
+class TestLatency():
+    '''
+    This class tests the latency matrix
+    '''
+
+    RESULTS = {'a.ceph': {'hosts': {'10.0.0.1': {'avg': 0.01, 'loss': 0.0},
+                                    '10.0.0.2': {'avg': 0.2, 'loss': 0.0},
+                                    '10.0.0.3': {'loss': 100.0}}},
+               'b.ceph': 'Minion did not return'}
+    OWNED = {'a.ceph': ['10.0.0.1'], 'b.ceph': ['10.0.0.2']}
+
+    def test_latency_matrix(self):
+        result = net._latency_matrix(self.RESULTS, self.OWNED)
+        assert list(result['latency']['a.ceph']) == ['10.0.0.2', '10.0.0.3']
+        assert result['hosts']['a.ceph']['p50'] == 0.2
+        assert result['hosts']['a.ceph']['max loss'] == 100.0
+        assert result['hosts']['a.ceph']['unreachable'] == ['10.0.0.3']
+        assert 'b.ceph' not in result['hosts']
+
+    def test_mtu_matrix(self):
+        result = net._mtu_matrix(self.RESULTS, self.OWNED)
+        assert result == {'a.ceph': {'10.0.0.2': True, '10.0.0.3': False}}
+
+    @patch('salt.client.LocalClient', autospec=True)
+    @patch('srv.modules.runners.net._ping_addresses')
+    def test_latency_cached(self, addresses, localclient, tmpdir):
+        net.__opts__ = {'cachedir': str(tmpdir)}
+        addresses.return_value = ('I@cluster:ceph', ['10.0.0.1', '10.0.0.2'], self.OWNED)
+        local = localclient.return_value
+        local.cmd.return_value = dict(self.RESULTS)
+        first = net.latency(cluster='ceph', jumbo=False)
+        assert first['cached'] is False
+        assert local.cmd.call_count == 1
+        second = net.latency(cluster='ceph', jumbo=False, max_age=600)
+        assert second['cached'] is True
+        assert local.cmd.call_count == 1
+        assert second['hosts']['a.ceph']['p50'] == 0.2
+        third = net.latency(cluster='ceph', count=10, jumbo=False, max_age=600)
+        assert third['cached'] is False
+        assert local.cmd.call_count == 2
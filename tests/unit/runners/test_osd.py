@@ -1,3 +1,4 @@
+import itertools
 import pytest
 from mock import patch, Mock
 from srv.modules.runners import osd as osd_module
@@ -140,19 +141,23 @@ class TestOSDUtil():
         }
         test_fix._lvm_zap()
 
-        test_fix.local.cmd.assert_called_once_with(
+        test_fix.local.cmd.assert_any_call(
             "dummy_host",
             'cmd.run', [
                 'ceph-volume lvm zap --osd-id {} --destroy'.format(
                     test_fix.osd_id)
             ],
             tgt_type='glob')
+        test_fix.local.cmd.assert_called_with(
+            "dummy_host", 'cephdisks.invalidate', tgt_type='glob')
 
     def test_lvm_zap_fail(self, test_fix):
         test_fix = test_fix()
         test_fix.local.cmd.return_value = {'node': 'Nope, some error'}
         with pytest.raises(RuntimeError):
             test_fix._lvm_zap()
+        test_fix.local.cmd.assert_called_with(
+            "dummy_host", 'cephdisks.invalidate', tgt_type='glob')
 
     @patch(
         'srv.modules.runners.osd.Util.master_minion',
@@ -364,3 +369,74 @@ class TestOSDUtil():
     def test__target_lookup_list(self):
         ret = osd_module._target_lookup(tuple([1, 2, 3]))
         assert ret == [1, 2, 3]
+
+
+class TestDrain():
+    """
+    Test the batch drain of runners/osd.py
+    """
+
+    @pytest.fixture
+    def drain(self):
+        with patch('srv.modules.runners.osd.Util.master_minion',
+                   return_value="master_minion"), \
+                patch('srv.modules.runners.osd.osd_dump',
+                      return_value=[{'osd': 1}, {'osd': 2}]) as dump, \
+                patch('srv.modules.runners.osd.time.sleep') as sleep:
+            drain = osd_module.Drain([1, 2, 3], retries=1)
+            drain.local = Mock()
+            drain.dump = dump
+            drain.sleep = sleep
+            yield drain
+
+    def test_safe_in_order_of_drain(self, drain):
+        drain.local.cmd.side_effect = [
+            {'master_minion': {'1': {'pgs': 0, 'safe': True},
+                               '2': {'pgs': 10, 'safe': False},
+                               '3': {'pgs': None, 'safe': False}}},
+            {'master_minion': {'2': {'pgs': 0, 'safe': True}}},
+        ]
+        assert [osd_id for osd_id, _ in drain.safe()] == [1, 2]
+        assert drain.remaining == []
+        drain.local.cmd.assert_called_with(
+            'master_minion', 'osd.drain_status', [2], tgt_type='glob')
+        assert drain.dump.call_count == 2
+        assert drain.sleep.call_count == 1
+
+    def test_timeout_without_progress(self, drain):
+        drain.local.cmd.return_value = {
+            'master_minion': {'1': {'pgs': 5, 'safe': False},
+                              '2': {'pgs': 5, 'safe': False},
+                              '3': {'pgs': 5, 'safe': False}}}
+        clock = itertools.chain([0, 0, 30], itertools.repeat(90))
+        with patch('srv.modules.runners.osd.time.time',
+                   side_effect=lambda: next(clock)):
+            assert list(drain.safe()) == []
+        assert drain.remaining == [1, 2, 3]
+
+    def test_progress_resets_timeout(self, drain):
+        drain.local.cmd.side_effect = [
+            {'master_minion': {'1': {'pgs': 9, 'safe': False}}},
+            {'master_minion': {'1': {'pgs': 5, 'safe': False}}},
+            {'master_minion': {'1': {'pgs': 0, 'safe': True}}},
+        ]
+        drain.remaining = [1]
+        clock = itertools.chain([0, 0], itertools.repeat(100))
+        with patch('srv.modules.runners.osd.time.time',
+                   side_effect=lambda: next(clock)):
+            assert [osd_id for osd_id, _ in drain.safe()] == [1]
+
+    @patch('srv.modules.runners.osd.OSDUtil', autospec=True)
+    @patch('srv.modules.runners.osd.Drain', autospec=True)
+    def test_batch(self, drain, osdutil):
+        drain.return_value.safe.return_value = iter([(2, [])])
+        osdutil._host_osds.return_value = {'host': ['1', '2']}
+        osdutil.return_value.remove.return_value = True
+        osdutil.return_value.path_for_osd = '/dev/sdb'
+        osdutil.return_value.model_for_osd = 'model'
+        ret = osd_module._batch([1, 2], operation='remove')
+        osdutil.assert_called_once_with(
+            2, host_osds={'host': ['1', '2']}, osd_dump=[], drained=True,
+            operation='remove')
+        assert ret == {'1': {'returncode': False, 'path': 'n/a', 'model': 'n/a'},
+                       '2': {'returncode': True, 'path': '/dev/sdb', 'model': 'model'}}
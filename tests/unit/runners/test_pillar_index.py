@@ -0,0 +1,56 @@
+import json
+from mock import patch
+from srv.modules.runners import pillar_index
+
+
+def _write(index_dir, minion, files, missing=None):
+    with open(str(index_dir.join("{}.json".format(minion))), 'w') as index:
+        json.dump({'files': files, 'missing': missing or []}, index)
+
+
+class TestPillarIndex():
+
+    def test_minions(self, tmpdir):
+        _write(tmpdir, 'b.ceph', [])
+        _write(tmpdir, 'a.ceph', [])
+        index = pillar_index.PillarIndex(str(tmpdir))
+        assert index.minions() == ['a.ceph', 'b.ceph']
+
+    def test_minions_no_index(self, tmpdir):
+        index = pillar_index.PillarIndex(str(tmpdir.join('absent')))
+        assert index.minions() == []
+
+    def test_affected(self, tmpdir):
+        _write(tmpdir, 'mon1', ['/srv/pillar/ceph/stack/stack.cfg',
+                                '/srv/pillar/ceph/stack/default/ceph/roles/mon.yml'])
+        _write(tmpdir, 'osd1', ['/srv/pillar/ceph/stack/stack.cfg',
+                                '/srv/pillar/ceph/stack/default/ceph/roles/storage.yml'])
+        index = pillar_index.PillarIndex(str(tmpdir))
+        assert index.affected('default/ceph/roles/mon.yml') == ['mon1']
+        assert index.affected('/srv/pillar/ceph/stack/stack.cfg') == ['mon1', 'osd1']
+
+    def test_affected_missing(self, tmpdir):
+        _write(tmpdir, 'mon1', [], ['/srv/pillar/ceph/stack/ceph/minions/mon1.yml'])
+        index = pillar_index.PillarIndex(str(tmpdir))
+        assert index.affected('ceph/minions/mon1.yml') == ['mon1']
+
+    def test_entry_unreadable(self, tmpdir):
+        tmpdir.join('broken.json').write('{')
+        index = pillar_index.PillarIndex(str(tmpdir))
+        assert index.entry('broken') == {'files': [], 'missing': []}
+
+    @patch('salt.client.LocalClient', autospec=True)
+    @patch('srv.modules.runners.pillar_index.affected')
+    def test_refresh(self, affected, localclient):
+        affected.return_value = ['mon1']
+        pillar_index.refresh(file='global.yml')
+        local = localclient.return_value
+        local.cmd.assert_called_with(['mon1'], 'saltutil.refresh_pillar', [],
+                                     tgt_type="list")
+
+    @patch('salt.client.LocalClient', autospec=True)
+    @patch('srv.modules.runners.pillar_index.affected')
+    def test_refresh_nothing(self, affected, localclient):
+        affected.return_value = []
+        assert pillar_index.refresh(file='global.yml') == []
+        assert not localclient.called
@@ -0,0 +1,51 @@
+from mock import patch
+from srv.modules.runners import pillarstack
+
+
+class TestPrerender():
+
+    def setup_method(self):
+        pillarstack.__opts__ = {'cachedir': '/var/cache/salt/master'}
+
+    @patch('salt.pillar.Pillar', autospec=True)
+    @patch('salt.utils.minions.get_minion_data')
+    def test_prerender(self, get_minion_data, pillar):
+        get_minion_data.return_value = ('mon1', {'id': 'mon1'}, {})
+        result = pillarstack.prerender(minions=['mon1'])
+        opts = pillar.call_args[0][0]
+        assert opts['pillarstack_stage']
+        assert pillar.call_args[0][1:] == ({'id': 'mon1'}, 'mon1', 'base')
+        assert pillar.return_value.compile_pillar.called
+        assert result['staged'] == 1
+        assert result['failed'] == {}
+
+    @patch('salt.pillar.Pillar', autospec=True)
+    @patch('salt.utils.minions.get_minion_data')
+    def test_prerender_no_grains(self, get_minion_data, pillar):
+        get_minion_data.return_value = (None, None, None)
+        pillarstack.prerender(minions='mon1')
+        assert pillar.call_args[0][1] == {'fqdn': 'mon1'}
+
+    @patch('salt.pillar.Pillar', autospec=True)
+    @patch('salt.utils.minions.get_minion_data')
+    def test_prerender_failed(self, get_minion_data, pillar):
+        get_minion_data.return_value = ('mon1', {}, {})
+        pillar.return_value.compile_pillar.side_effect = RuntimeError('broken')
+        result = pillarstack.prerender(minions=['mon1'])
+        assert result['staged'] == 0
+        assert result['failed'] == {'mon1': 'broken'}
+
+    @patch('salt.utils.minions.CkMinions', autospec=True)
+    def test_prerender_nothing(self, ckminions):
+        ckminions.return_value.check_minions.return_value = {'minions': []}
+        assert pillarstack.prerender()['staged'] == 0
+
+    @patch('salt.utils.minions.CkMinions', autospec=True)
+    def test_minions(self, ckminions):
+        ckminions.return_value.check_minions.return_value = {'minions': ['b', 'a']}
+        assert pillarstack._minions('*') == ['a', 'b']
+
+    @patch('salt.utils.minions.CkMinions', autospec=True)
+    def test_minions_list(self, ckminions):
+        ckminions.return_value.check_minions.return_value = ['b', 'a']
+        assert pillarstack._minions('*') == ['a', 'b']
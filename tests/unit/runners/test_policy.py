@@ -0,0 +1,125 @@
+import pytest
+from srv.modules.utils import policy
+
+nodes = [
+    'master',
+    'mon1',
+    'mon2',
+    'mon3',
+    'mds1',
+    'mds2',
+    'osd1',
+    'osd2',
+    'osd3',
+    'osd4',
+    'osd5',
+    'rgw1',
+]
+
+
+@pytest.fixture
+def proposals(tmpdir):
+    root = tmpdir.join('proposals')
+    for node in nodes:
+        root.join('cluster-ceph/cluster/{}.sls'.format(node)).write('cluster: ceph\n', ensure=True)
+    root.join('role-mon/cluster/.hidden.sls').write('roles: []\n', ensure=True)
+    return root
+
+
+def _compile(tmpdir, proposals, contents):
+    policy_file = tmpdir.join('policy.cfg')
+    policy_file.write(contents)
+    return policy.Policy(str(policy_file), policy.ProposalsIndex(str(proposals)))
+
+
+class TestPolicy():
+
+    def test_match(self, tmpdir, proposals):
+        compiled = _compile(tmpdir, proposals, 'cluster-ceph/cluster/*.sls')
+        assert len(compiled.files()) == len(nodes)
+
+        compiled = _compile(tmpdir, proposals, 'cluster-ceph/cluster/mon*.sls')
+        assert len(compiled.files()) == len([n for n in nodes if n.startswith('mon')])
+
+        compiled = _compile(tmpdir, proposals, 'cluster-ceph/cluster/mon[1,2].sls')
+        assert len(compiled.files()) == 2
+
+        compiled = _compile(tmpdir, proposals, 'cluster-ceph/cluster/*.sls slice=[2:5]')
+        assert len(compiled.files()) == 3
+
+        compiled = _compile(tmpdir, proposals, r'cluster-ceph/cluster/*.sls re=.*1\.sls$')
+        assert len(compiled.files()) == len([n for n in nodes if '1' in n])
+
+        compiled = _compile(tmpdir, proposals, r'cluster-ceph/cluster/*.sls FOO=.*1\.sls$')
+        assert len(compiled.files()) == len(nodes)
+
+    def test_match_sorted_absolute(self, tmpdir, proposals):
+        compiled = _compile(tmpdir, proposals, 'cluster-ceph/cluster/mon*.sls')
+        assert compiled.files() == ['{}/cluster-ceph/cluster/mon{}.sls'.format(proposals, i)
+                                    for i in range(1, 4)]
+
+    def test_match_directories(self, tmpdir, proposals):
+        compiled = _compile(tmpdir, proposals, '*/cluster/master.sls')
+        assert compiled.files() == ['{}/cluster-ceph/cluster/master.sls'.format(proposals)]
+
+    def test_match_hidden(self, tmpdir, proposals):
+        compiled = _compile(tmpdir, proposals, 'role-mon/cluster/*.sls')
+        assert compiled.files() == []
+        compiled = _compile(tmpdir, proposals, 'role-mon/cluster/.*.sls')
+        assert len(compiled.files()) == 1
+
+    def test_slice_negative(self, tmpdir, proposals):
+        compiled = _compile(tmpdir, proposals, 'cluster-ceph/cluster/*.sls slice=[-2:]')
+        assert compiled.files() == ['{}/cluster-ceph/cluster/{}.sls'.format(proposals, n)
+                                    for n in ['osd5', 'rgw1']]
+
+    def test_slice_index(self, tmpdir, proposals):
+        compiled = _compile(tmpdir, proposals, 'cluster-ceph/cluster/*.sls slice=[0]')
+        assert compiled.files() == ['{}/cluster-ceph/cluster/master.sls'.format(proposals)]
+
+    def test_malformed(self, tmpdir, proposals):
+        compiled = _compile(tmpdir, proposals, ('cluster-ceph/cluster/*.sls slice=[os.system()]\n'
+                                                'cluster-ceph/cluster/*.sls re\n'
+                                                'cluster-ceph/cluster/mon1.sls'))
+        assert compiled.lines[0].error
+        assert compiled.lines[1].error
+        assert compiled.lines[2].error is None
+        assert len(compiled.files()) == 1
+
+    def test_comments(self, tmpdir, proposals):
+        compiled = _compile(tmpdir, proposals, ('# comment\n\n'
+                                                ' cluster-ceph/cluster/mon1.sls \t# comment\n'))
+        assert [entry.line for entry in compiled.lines] == ['cluster-ceph/cluster/mon1.sls']
+
+
+class TestCompilePolicy():
+
+    def test_cached(self, tmpdir, proposals):
+        policy_file = tmpdir.join('policy.cfg')
+        policy_file.write('cluster-ceph/cluster/*.sls')
+        first = policy.compile_policy(str(policy_file), str(proposals))
+        assert policy.compile_policy(str(policy_file), str(proposals)) is first
+
+    def test_tree_changed(self, tmpdir, proposals):
+        policy_file = tmpdir.join('policy.cfg')
+        policy_file.write('cluster-ceph/cluster/*.sls')
+        first = policy.compile_policy(str(policy_file), str(proposals))
+        proposals.join('cluster-ceph/cluster/osd6.sls').write('cluster: ceph\n')
+        proposals.join('cluster-ceph/cluster').setmtime(1)
+        second = policy.compile_policy(str(policy_file), str(proposals))
+        assert second is not first
+        assert len(second.files()) == len(nodes) + 1
+
+    def test_policy_changed(self, tmpdir, proposals):
+        policy_file = tmpdir.join('policy.cfg')
+        policy_file.write('cluster-ceph/cluster/*.sls')
+        first = policy.compile_policy(str(policy_file), str(proposals))
+        policy_file.write('cluster-ceph/cluster/mon1.sls')
+        second = policy.compile_policy(str(policy_file), str(proposals))
+        assert len(second.files()) == 1
+
+    def test_missing_tree(self, tmpdir):
+        policy_file = tmpdir.join('policy.cfg')
+        policy_file.write('cluster-ceph/cluster/*.sls')
+        compiled = policy.compile_policy(str(policy_file), str(tmpdir.join('absent')))
+        assert compiled.files() == []
@@ -1,6 +1,5 @@
 from pyfakefs import fake_filesystem as fake_fs
-from pyfakefs import fake_filesystem_glob as fake_glob
-from mock import patch, mock_open, MagicMock
+from mock import patch, mock_open
 import sys
 sys.path.insert(0, 'srv/modules/pillar')
 from srv.modules.runners import push
@@ -44,69 +43,53 @@ fs.CreateFile('policy.cfg_trailing_and_leading_whitespace_and_leading_comment',
 fs.CreateFile('policy.cfg_trailing_and_leading_whitespace_and_trailing_comment',
               contents=(' cluster-ceph/cluster/*.sls #'))
 
-f_glob = fake_glob.FakeGlobModule(fs)
 f_os = fake_fs.FakeOsModule(fs)
 f_open = fake_fs.FakeFileOpen(fs)
 
 
 class TestPush():
 
-    @patch('glob.glob', new=f_glob.glob)
-    def test_parse(self):
-
-        parsed = push._parse('{}/*.sls'.format(proposal_dir))
-        assert len(parsed) == len(nodes)
-
-        parsed = push._parse('{}/mon*.sls'.format(proposal_dir))
-        assert len(parsed) == len([n for n in nodes if n.startswith('mon')])
-
-        parsed = push._parse('{}/mon[1,2].sls'.format(proposal_dir))
-        assert len(parsed) == 2
-
-        parsed = push._parse('{}/*.sls slice=[2:5]'.format(proposal_dir))
-        assert len(parsed) == 3
-
-        parsed = push._parse(r'{}/*.sls re=.*1\.sls$'.format(proposal_dir))
-        assert len(parsed) == len([n for n in nodes if '1' in n])
-
-        parsed = push._parse(r'{}/*.sls FOO=.*1\.sls$'.format(proposal_dir))
-        assert len(parsed) == len(nodes)
-
-    @patch('glob.glob', new=f_glob.glob)
-    @patch('os.path.isfile', new=f_os.path.isfile)
-    @patch('builtins.open', new=f_open)
-    @patch('os.stat')
-    def test_organize(self, mock_stat):
-        # make sure all out faked files have content
-        mock_stat.return_value = MagicMock(st_size=1)
+    def test_organize(self, tmpdir):
+        proposals = tmpdir.join('proposals')
+        for node in nodes:
+            proposals.join('cluster-ceph/cluster/{}.sls'.format(node)).write(
+                'cluster: ceph\n', ensure=True)
         p_d = push.PillarData(False)
-
-        organized = p_d.organize('policy.cfg')
-        assert len(organized.keys()) == len(nodes)
-
-        organized = p_d.organize('policy.cfg_commented1')
-        assert len(organized.keys()) == len(nodes)
-
-        organized = p_d.organize('policy.cfg_commented2')
-        assert len(organized.keys()) == len(nodes)
-
-        organized = p_d.organize('policy.cfg_ml_commented')
-        assert len(organized.keys()) == len(nodes)
-
-        organized = p_d.organize('policy.cfg_leading_whitespace')
-        assert len(organized.keys()) == len(nodes)
-
-        organized = p_d.organize('policy.cfg_trailing_whitespace')
-        assert len(organized.keys()) == len(nodes)
-
-        organized = p_d.organize('policy.cfg_trailing_and_leading_whitespace')
-        assert len(organized.keys()) == len(nodes)
-
-        organized = p_d.organize('policy.cfg_trailing_and_leading_whitespace_and_leading_comment')
+        p_d.proposals_dir = str(proposals)
+
+        policies = {
+            'policy.cfg': 'cluster-ceph/cluster/*.sls',
+            'policy.cfg_commented1': 'cluster-ceph/cluster/*.sls # with a comment',
+            'policy.cfg_commented2': 'cluster-ceph/cluster/*.sls \t# with a comment',
+            'policy.cfg_ml_commented': ('# a line comment\n'
+                                        'cluster-ceph/cluster/*.sls \t# with a comment'),
+            'policy.cfg_leading_whitespace': ' cluster-ceph/cluster/*.sls',
+            'policy.cfg_trailing_whitespace': 'cluster-ceph/cluster/*.sls ',
+            'policy.cfg_trailing_and_leading_whitespace': ' cluster-ceph/cluster/*.sls ',
+            'policy.cfg_trailing_and_leading_whitespace_and_trailing_comment':
+                ' cluster-ceph/cluster/*.sls #',
+        }
+        for name, contents in policies.items():
+            policy_file = tmpdir.join(name)
+            policy_file.write(contents)
+            organized = p_d.organize(str(policy_file))
+            assert len(organized.keys()) == len(nodes)
+
+        policy_file = tmpdir.join('policy.cfg_trailing_and_leading_whitespace_and_leading_comment')
+        policy_file.write(' #cluster-ceph/cluster/*.sls ')
+        organized = p_d.organize(str(policy_file))
         assert len(organized.keys()) == 0
 
-        organized = p_d.organize('policy.cfg_trailing_and_leading_whitespace_and_trailing_comment')
-        assert len(organized.keys()) == len(nodes)
+    def test_organize_skips_empty(self, tmpdir):
+        proposals = tmpdir.join('proposals')
+        proposals.join('cluster-ceph/cluster/mon1.sls').write('cluster: ceph\n', ensure=True)
+        proposals.join('cluster-ceph/cluster/mon2.sls').write('', ensure=True)
+        policy_file = tmpdir.join('policy.cfg')
+        policy_file.write('cluster-ceph/cluster/*.sls')
+        p_d = push.PillarData(False)
+        p_d.proposals_dir = str(proposals)
+        organized = p_d.organize(str(policy_file))
+        assert list(organized.keys()) == ['cluster/mon1.sls']
 
     @patch('os.path.isfile', new=f_os.path.isfile)
     def test_organize_function_missing_file(self):
@@ -120,3 +103,53 @@ class TestPush():
         assert result == {}
 
 
+class TestPillarDataOutput():
+
+    def _common(self, tmpdir, pathname, content):
+        source = tmpdir.join('proposals', pathname)
+        source.write(content, ensure=True)
+        return {pathname: [str(source)]}
+
+    def _pillar_data(self, tmpdir):
+        p_d = push.PillarData(False)
+        p_d.pillar_dir = str(tmpdir.join('pillar'))
+        return p_d
+
+    def test_output_writes(self, tmpdir):
+        p_d = self._pillar_data(tmpdir)
+        common = self._common(tmpdir, 'stack/default/global.yml', 'a: 1\n')
+        counts = p_d.output(common)
+        assert counts == {'written': 1, 'unchanged': 0, 'removed': 0}
+        assert tmpdir.join('pillar/stack/default/global.yml').read() == 'a: 1\n'
+
+    def test_output_unchanged(self, tmpdir):
+        p_d = self._pillar_data(tmpdir)
+        common = self._common(tmpdir, 'stack/default/global.yml', 'a: 1\n')
+        p_d.output(common)
+        target = tmpdir.join('pillar/stack/default/global.yml')
+        mtime = target.mtime()
+        counts = p_d.output(common)
+        assert counts == {'written': 0, 'unchanged': 1, 'removed': 0}
+        assert target.mtime() == mtime
+
+    def test_output_removes_stale(self, tmpdir):
+        p_d = self._pillar_data(tmpdir)
+        stale = tmpdir.join('pillar/stack/default/ceph/minions/old.yml')
+        stale.write('roles: []\n', ensure=True)
+        common = self._common(tmpdir, 'stack/default/global.yml', 'a: 1\n')
+        counts = p_d.output(common)
+        assert counts == {'written': 1, 'unchanged': 0, 'removed': 1}
+        assert not stale.check()
+        assert not tmpdir.join('pillar/stack/default/ceph').check()
+        assert tmpdir.join('pillar/stack/default/global.yml').check()
+
+    def test_output_dryrun(self, tmpdir):
+        p_d = self._pillar_data(tmpdir)
+        p_d.dryrun = True
+        stale = tmpdir.join('pillar/stack/default/old.yml')
+        stale.write('a: 1\n', ensure=True)
+        common = self._common(tmpdir, 'stack/default/global.yml', 'a: 1\n')
+        counts = p_d.output(common)
+        assert counts == {'written': 1, 'unchanged': 0, 'removed': 1}
+        assert stale.check()
+        assert not tmpdir.join('pillar/stack/default/global.yml').check()
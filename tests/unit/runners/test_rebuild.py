@@ -1,7 +1,15 @@
+import pytest
 from mock import patch, MagicMock, mock
 from srv.modules.runners import rebuild
 
 
+@pytest.fixture(autouse=True)
+def state_file(tmpdir, monkeypatch):
+    # An absolute path replaces the cachedir
+    monkeypatch.setattr(rebuild, 'STATE_FILE', str(tmpdir.join('state.json')))
+    return str(tmpdir.join('state.json'))
+
+
 class TestRebuild():
     """
     """
@@ -233,6 +241,25 @@ class TestRebuild():
         assert result == True
         assert rr.skipped == ['data1.ceph']
 
+    @patch('time.sleep')
+    @patch('srv.modules.runners.rebuild.master_minion', autospec=True)
+    @patch('salt.runner.Runner', autospec=True)
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_busy_wait(self, localclient, runner, mm, sleep):
+        rebuild.__opts__ = {}
+
+        rr = rebuild.Rebuild(['data*.ceph'])
+        rr.master_minion = 'admin.ceph'
+        rr.local.cmd = MagicMock()
+        rr.local.cmd.side_effect = [{'admin.ceph': "Timeout expired waiting on active+clean"},
+                                    {}, {'admin.ceph': True}]
+        rr._busy_wait()
+        assert rr.local.cmd.call_count == 3
+        assert rr.local.cmd.call_args[1]['kwarg'] == {'deadline': rebuild.QUIESCENT_DEADLINE}
+        # Waiting happens on the minion, only quick answers are delayed
+        for args, _ in sleep.call_args_list:
+            assert args[0] <= rebuild.QUIESCENT_INTERVAL
+
     @patch('srv.modules.runners.rebuild.master_minion', autospec=True)
     @patch('salt.runner.Runner', autospec=True)
     @patch('salt.client.LocalClient', autospec=True)
@@ -433,3 +460,156 @@ class TestRebuild():
         assert rr._skipped_summary.called
 
 
+
+
+TREE = {'nodes': [
+    {'id': -1, 'name': 'default', 'type': 'root', 'children': [-2, -3]},
+    {'id': -2, 'name': 'rack1', 'type': 'rack', 'children': [-4, -5]},
+    {'id': -3, 'name': 'rack2', 'type': 'rack', 'children': [-6]},
+    {'id': -4, 'name': 'data1', 'type': 'host', 'children': [0]},
+    {'id': -5, 'name': 'data2', 'type': 'host', 'children': [1]},
+    {'id': -6, 'name': 'data3', 'type': 'host', 'children': [2]},
+    {'id': -7, 'name': 'data4', 'type': 'host', 'children': []},
+    {'id': 0, 'name': 'osd.0', 'type': 'osd'},
+    {'id': 1, 'name': 'osd.1', 'type': 'osd'},
+    {'id': 2, 'name': 'osd.2', 'type': 'osd'}]}
+
+
+class TestFailureDomains():
+
+    def test_racks(self):
+        assert rebuild.failure_domains(TREE, 'rack') == {
+            'data1': 'rack1', 'data2': 'rack1', 'data3': 'rack2', 'data4': 'data4'}
+
+    def test_missing_type(self):
+        assert rebuild.failure_domains(TREE, 'row') == {
+            'data1': 'data1', 'data2': 'data2', 'data3': 'data3', 'data4': 'data4'}
+
+
+class TestRebuildState():
+
+    def test_resume(self, state_file):
+        state = rebuild.RebuildState(['data2', 'data1'], state_file)
+        state.finish('data1')
+        resumed = rebuild.RebuildState(['data1', 'data2'], state_file)
+        assert resumed.finished('data1')
+        assert not resumed.finished('data2')
+
+    def test_other_minions(self, state_file):
+        rebuild.RebuildState(['data1', 'data2'], state_file).finish('data1')
+        assert not rebuild.RebuildState(['data1'], state_file).finished('data1')
+
+    def test_clear(self, state_file):
+        state = rebuild.RebuildState(['data1'], state_file)
+        state.finish('data1')
+        state.clear()
+        assert not rebuild.RebuildState(['data1'], state_file).finished('data1')
+
+    def test_broken(self, tmpdir):
+        tmpdir.join('state.json').write('{')
+        assert rebuild.RebuildState(['data1'], str(tmpdir.join('state.json'))).done == []
+
+
+class TestParallel():
+
+    @pytest.fixture
+    def rr(self):
+        with patch('srv.modules.runners.rebuild.master_minion', autospec=True), \
+                patch('salt.runner.RunnerClient', autospec=True), \
+                patch('salt.client.LocalClient', autospec=True):
+            rebuild.__opts__ = {}
+            rr = rebuild.Rebuild(['data*.ceph'], parallel=2)
+            rr.minions = ['data1.ceph', 'data2.ceph', 'data3.ceph']
+            rr.master_minion = 'admin.ceph'
+            rr.local.cmd = MagicMock(return_value={'admin.ceph': TREE})
+            rr._disengaged = MagicMock(return_value=True)
+            rr._osd_list = MagicMock(side_effect=lambda minion: [minion[4]])
+            rr.safe = MagicMock(return_value=True)
+            rr._busy_wait = MagicMock()
+            rr.calls = []
+            rr._start = MagicMock(side_effect=lambda events, stage, minion, fun, *args, **kwargs:
+                                  (rr.calls.append((fun, minion)),
+                                   events.put((stage, minion, {'data': True}
+                                               if stage == 'removed' else []))))
+            yield rr
+
+    def test_kwargs_not_passed_on(self, rr):
+        assert rr.parallel == 2
+        assert rr.kwargs == {}
+
+    def test_force_is_sequential(self):
+        with patch('srv.modules.runners.rebuild.master_minion', autospec=True), \
+                patch('salt.client.LocalClient', autospec=True):
+            rebuild.__opts__ = {}
+            rr = rebuild.Rebuild(['data*.ceph'], parallel=4, force=True)
+            assert rr.parallel == 1
+            assert rr.kwargs == {'force': True}
+
+    def test_different_domains(self, rr):
+        rr.run()
+        # data1 and data2 share rack1, so data3 empties alongside data1
+        assert rr.safe.call_args_list[1][0][0] == ['3', '1']
+        assert rr.calls[:2] == [('osd.remove', 'data1.ceph'), ('osd.remove', 'data3.ceph')]
+        assert sorted(rr.calls) == sorted(
+            [(fun, minion) for fun in ['osd.remove', 'disks.deploy']
+             for minion in rr.minions])
+        assert rr._busy_wait.call_count == 1
+        assert rr.skipped == []
+
+    def test_pipelined(self, rr):
+        rr.run()
+        # data2 empties once data1 is empty, while data1 deploys
+        assert (rr.calls.index(('osd.remove', 'data2.ceph')) <
+                rr.calls.index(('disks.deploy', 'data2.ceph')))
+        assert rr.calls.index(('disks.deploy', 'data1.ceph')) < \
+            rr.calls.index(('osd.remove', 'data2.ceph'))
+
+    def test_capacity_waits_for_inflight(self, rr):
+        rr.safe.side_effect = [True, False, True, True]
+        rr.run()
+        # data3 waits until data1 is empty
+        assert rr.calls[:3] == [('osd.remove', 'data1.ceph'), ('disks.deploy', 'data1.ceph'),
+                                ('osd.remove', 'data2.ceph')]
+        assert rr.skipped == []
+
+    def test_capacity_waits_for_deploy(self, rr, state_file):
+        rr.minions = ['data1.ceph', 'data2.ceph']
+        rr.state = rebuild.RebuildState(rr.minions, state_file)
+        rr.safe.side_effect = [True, False, True]
+        rr.run()
+        # data2 waits for the deployment of data1 instead of aborting
+        assert rr.calls == [('osd.remove', 'data1.ceph'), ('disks.deploy', 'data1.ceph'),
+                            ('osd.remove', 'data2.ceph'), ('disks.deploy', 'data2.ceph')]
+        assert rr.skipped == []
+
+    def test_capacity_aborts_after_deploy(self, rr, state_file):
+        rr.minions = ['data1.ceph', 'data2.ceph']
+        rr.state = rebuild.RebuildState(rr.minions, state_file)
+        rr.safe.side_effect = [True, False, False]
+        rr.run()
+        assert rr.calls == [('osd.remove', 'data1.ceph'), ('disks.deploy', 'data1.ceph')]
+        # The deployment in flight is still recorded
+        assert rebuild.RebuildState(rr.minions, state_file).done == ['data1.ceph']
+
+    def test_capacity_aborts(self, rr):
+        rr.safe.return_value = False
+        rr.run()
+        assert rr.calls == []
+
+    def test_resume(self, rr, state_file):
+        rebuild.RebuildState(rr.minions, state_file).finish('data1.ceph')
+        rr.state = rebuild.RebuildState(rr.minions, state_file)
+        rr.run()
+        assert ('osd.remove', 'data1.ceph') not in rr.calls
+        assert len(rr.calls) == 4
+
+    def test_failed_remove_not_deployed(self, rr, state_file):
+        rr._start.side_effect = lambda events, stage, minion, fun, *args, **kwargs: (
+            rr.calls.append((fun, minion)),
+            events.put((stage, minion, None if minion == 'data3.ceph' else [])))
+        rr._check_failed = MagicMock(return_value=False)
+        rr.state = rebuild.RebuildState(rr.minions, state_file)
+        rr.run()
+        assert ('disks.deploy', 'data3.ceph') not in rr.calls
+        assert rr.skipped == ['data3.ceph']
+        assert rebuild.RebuildState(rr.minions, state_file).done == ['data1.ceph', 'data2.ceph']
@@ -0,0 +1,11 @@
+from srv.modules.utils import stats
+
+
+class TestPercentile():
+
+    def test_percentile(self):
+        assert stats.percentile([1, 2, 3, 4], 50) == 2
+        assert stats.percentile([1, 2, 3, 4], 99) == 4
+
+    def test_percentile_empty(self):
+        assert stats.percentile([], 50) is None
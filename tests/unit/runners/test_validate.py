@@ -610,6 +610,15 @@ class TestValidation():
         validator._check_available()
         assert 'ceph_version' not in validator.errors
 
+    @patch('salt.client.LocalClient')
+    def test_check_installed_no_minions(self, mock_localclient):
+        validator = validate.Validate("setup")
+        validator.matches = []
+        mock_localclient.return_value.cmd.reset_mock()
+        validator._check_installed()
+        assert not mock_localclient.return_value.cmd.called
+        assert validator.uninstalled == []
+
     @patch('salt.client.LocalClient')
     def test_check_available_succeeds_with_no_minions(self, mock_localclient):
         validator = validate.Validate("setup")
@@ -794,6 +803,139 @@ class TestValidation():
             assert validator.skipped['subvolume'] == "skipping"
 
 
+class TestCheckExecutor():
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_single_fetch(self, mock_localclient):
+        local = mock_localclient.return_value
+        local.cmd.return_value = {'mon1': {'pillar.items': {'roles': ['mon']},
+                                           'grains.items': {'id': 'mon1'}},
+                                  'mon2': 'Minion did not return'}
+        validator = validate.Validate("setup", search_pillar=True, search_grains=True)
+        assert local.cmd.call_count == 1
+        assert validator.data == {'mon1': {'roles': ['mon']}, 'mon2': 'Minion did not return'}
+        assert validator.grains == {'mon1': {'id': 'mon1'}, 'mon2': 'Minion did not return'}
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_results_in_check_order(self, mock_localclient):
+        import time
+
+        def slow(self):
+            time.sleep(0.2)
+            self.passed['slow'] = "valid"
+
+        def fast(self):
+            self.errors['fast'] = ["failed"]
+            self.ipversion.add(4)
+
+        with patch.multiple(validate.Validate, slow=slow, fast=fast, create=True):
+            validator = validate.Validate("setup")
+            executor = validate.CheckExecutor(validator)
+            executor.run(['slow', 'fast'])
+        assert list(executor.timings) == ['slow', 'fast']
+        assert validator.passed == {'slow': "valid"}
+        assert validator.errors == {'fast': ["failed"]}
+        assert validator.ipversion == set([4])
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_stages(self, mock_localclient):
+        validator = validate.Validate("setup")
+        validator.ipversion = set()
+
+        def network(self):
+            self.ipversion.add(6)
+
+        with patch.object(validate.Validate, "network", network, create=True):
+            validate.CheckExecutor(validator).run(['check_ipversion', 'network'])
+        assert validator.passed['ip_version'] == "valid"
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_late_check_in_order(self, mock_localclient):
+        validator = validate.Validate("setup")
+        validator.ipversion = set()
+
+        def network(self):
+            self.ipversion.add(4)
+            self.passed['network'] = "valid"
+
+        def other(self):
+            self.passed['other'] = "valid"
+
+        with patch.multiple(validate.Validate, network=network, other=other, create=True):
+            validate.CheckExecutor(validator).run(['network', 'check_ipversion', 'other'])
+        assert list(validator.passed) == ['network', 'ip_version', 'other']
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_client_per_thread(self, mock_localclient):
+        validator = validate.Validate("setup")
+        validator.local = mock_localclient.return_value
+        checks = ['check{}'.format(num) for num in range(6)]
+        methods = dict((check, lambda self: None) for check in checks)
+        mock_localclient.reset_mock()
+        with patch.multiple(validate.Validate, create=True, **methods):
+            validate.CheckExecutor(validator, workers=2).run(checks)
+        assert mock_localclient.call_count <= 2
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_timeout(self, mock_localclient):
+        import time
+
+        def hung(self):
+            time.sleep(1)
+            self.passed['hung'] = "valid"
+
+        with patch.object(validate.Validate, "hung", hung, create=True):
+            validator = validate.Validate("setup")
+            validate.CheckExecutor(validator, timeout=0.1).run(['hung'])
+        assert 'hung' not in validator.passed
+        assert "did not finish" in validator.errors['hung'][0]
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_timeout_per_check(self, mock_localclient):
+        import time
+
+        def slow(self):
+            time.sleep(0.15)
+            self.passed.setdefault('slow', []).append("valid")
+
+        checks = ['slow{}'.format(num) for num in range(4)]
+        with patch.multiple(validate.Validate, create=True,
+                            **dict((check, slow) for check in checks)):
+            validator = validate.Validate("setup")
+            validate.CheckExecutor(validator, timeout=0.5, workers=1).run(checks)
+        # The last check waited 0.45s in the queue, which is not counted
+        assert validator.passed['slow'] == ["valid"] * 4
+        assert not validator.errors
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_hung_worker_replaced(self, mock_localclient):
+        import time
+
+        def hung(self):
+            time.sleep(0.5)
+            self.passed['hung'] = "valid"
+
+        def quick(self):
+            self.passed['quick'] = "valid"
+
+        with patch.multiple(validate.Validate, hung=hung, quick=quick, create=True):
+            validator = validate.Validate("setup")
+            validate.CheckExecutor(validator, timeout=0.1, workers=1).run(['hung', 'quick'])
+            time.sleep(0.6)
+        assert validator.passed == {'quick': "valid"}
+        assert "did not finish" in validator.errors['hung'][0]
+
+    @patch('salt.client.LocalClient', autospec=True)
+    def test_exception(self, mock_localclient):
+        def broken(self):
+            raise KeyError('roles')
+
+        with patch.object(validate.Validate, "broken", broken, create=True):
+            validator = validate.Validate("setup")
+            validate.CheckExecutor(validator).run(['broken'])
+        assert "broken failed" in validator.errors['broken'][0]
+
+
 class TestConfigCheck():
 
     @pytest.fixture(scope='class')